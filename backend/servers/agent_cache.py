@@ -0,0 +1,184 @@
+# File: servers/agent_cache.py
+"""
+Semantic answer cache for the agent.
+
+A finished turn's answer and sources are stored under (model, intent, query
+embedding). The intent is the keyword heuristic's tool guess for the message
+(or the tool_hint), so "weather in Leeds" and "where is the login code" never
+meet even when their embeddings happen to be close. A later message with the
+same model and intent, whose embedding is within `threshold` cosine similarity,
+gets the stored answer back without any tool or LLM call.
+
+How long an answer stays valid depends on the tools that produced it; the
+shortest TTL among them wins (TOOL_TTLS, seconds; 0 = never cached):
+
+  time_now           never
+  web_metoffice      15 min        web_ground   15 min
+  web_search         1 h           search_memory 10 min
+  rag_search         until the RAG index changes generation (capped at 1 day)
+  editor / clipboard never
+  no tool            1 h
+
+Entries are shared across chats only when the turn started with an empty
+agent session (no earlier turns) and used no chat memory; anything else
+is served back to the same chat only. A turn that had history and used no
+tool answered from the conversation itself ("yes please", "and the second
+one?"), so it is not cached at all.
+
+Environment:
+  NOVA_AGENT_CACHE            1/0 (default 1)
+  NOVA_AGENT_CACHE_SIZE       entries kept (default 512)
+  NOVA_AGENT_CACHE_THRESHOLD  cosine similarity for a hit (default 0.92)
+"""
+import os
+import time
+import threading
+import numpy as np
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from . import rag_store
+from utils.embedding_service import embedder
+from utils.logger import logger, setup_logger
+
+setup_logger()
+logger = logger.bind(name="AgentCache")
+
+ENABLED = os.environ.get("NOVA_AGENT_CACHE", "1").lower() not in {"0", "false", "no", "off"}
+CACHE_SIZE = int(os.environ.get("NOVA_AGENT_CACHE_SIZE", "512"))
+THRESHOLD = float(os.environ.get("NOVA_AGENT_CACHE_THRESHOLD", "0.92"))
+
+TOOL_TTLS: Dict[str, float] = {
+    "time_now": 0,
+    "web_metoffice": 15 * 60,
+    "web_ground": 15 * 60,
+    "web_search": 60 * 60,
+    "search_memory": 10 * 60,
+    "rag_search": 24 * 60 * 60,
+}
+NO_TOOL_TTL = 60 * 60
+SCOPED_TOOLS = {"search_memory"}   # answers that only make sense in the chat that asked
+
+
+@dataclass
+class CachedAnswer:
+    model: str
+    intent: str
+    vec: np.ndarray
+    message: str
+    answer: str
+    sources: List[Dict[str, Any]]
+    tools: List[str]
+    expires: float
+    scope: str = ""
+    rag_generation: int | None = None
+    created: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class AnswerCache:
+    def __init__(self, maxsize: int = CACHE_SIZE, threshold: float = THRESHOLD):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries: List[CachedAnswer] = []
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    @staticmethod
+    def ttl_for(tools: List[str]) -> float:
+        if not tools:
+            return NO_TOOL_TTL
+        return min(TOOL_TTLS.get(t, 0) for t in tools)
+
+    def _valid(self, e: CachedAnswer, now: float, generation: int | None) -> bool:
+        if e.expires <= now:
+            return False
+        return e.rag_generation is None or e.rag_generation == generation
+
+    def embed(self, message: str) -> np.ndarray:
+        return embedder.embed_query(message)
+
+    def lookup(self, model: str, intent: str, vec: np.ndarray, scope: str = "") -> CachedAnswer | None:
+        """Closest valid answer at or above the threshold, or None."""
+        now = time.time()
+        generation = None
+        with self._lock:
+            if any(e.rag_generation is not None for e in self._entries):
+                generation = rag_store.index_generation()
+            self._entries = [e for e in self._entries if self._valid(e, now, generation)]
+            pool = [e for e in self._entries
+                    if e.model == model and e.intent == intent and (not e.scope or e.scope == scope)]
+            best = None
+            if pool:
+                scores = np.stack([e.vec for e in pool]) @ vec
+                i = int(np.argmax(scores))
+                if scores[i] >= self.threshold:
+                    best = pool[i]
+                    best.hits += 1
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return best
+
+    def store(self, model: str, intent: str, vec: np.ndarray, message: str, answer: str,
+              sources: List[Dict[str, Any]], tools: List[str], scope: str = "", history: bool = False) -> bool:
+        """
+        Keep a finished answer if its tools allow caching; returns whether it was stored.
+        `scope` is the asking chat; `history` says whether the turn had earlier turns in context.
+        """
+        tools = sorted(set(tools))
+        ttl = self.ttl_for(tools)
+        if ttl <= 0 or not answer or self.maxsize <= 0:
+            return False
+        if history and not tools:
+            return False   # answered from earlier turns, meaningless on its own
+        shared = not history and not SCOPED_TOOLS.intersection(tools)
+        entry = CachedAnswer(
+            model=model,
+            intent=intent,
+            vec=vec,
+            message=message,
+            answer=answer,
+            sources=sources,
+            tools=tools,
+            expires=time.time() + ttl,
+            scope="" if shared else scope,
+            rag_generation=rag_store.index_generation() if "rag_search" in tools else None,
+        )
+        with self._lock:
+            # A near-identical question replaces its older answer instead of piling up
+            self._entries = [
+                e for e in self._entries
+                if not (e.model == model and e.intent == intent and e.scope == entry.scope
+                        and float(e.vec @ vec) >= self.threshold)
+            ]
+            self._entries.append(entry)
+            if len(self._entries) > self.maxsize:
+                self._entries = self._entries[-self.maxsize:]
+            self.stored += 1
+        logger.debug(f"Cached answer for {message[:60]!r} ({tools or 'no tools'}, {ttl:.0f}s)")
+        return True
+
+    def clear(self) -> int:
+        with self._lock:
+            n, self._entries = len(self._entries), []
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "enabled": ENABLED,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stored": self.stored,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+cache = AnswerCache()
@@ -0,0 +1,242 @@
+# File: servers/agent_context.py
+"""
+Fits tool results into the agent prompt.
+
+Tool output is shaped for the UI: scores, screenshot paths, the query echoed
+back, 800-character chunks. Before it reaches the model, fit():
+
+  - drops fields the model never uses and empty values
+  - collapses whitespace and cuts snippets at a word boundary
+  - drops snippets the chat has already seen (earlier steps or turns), and
+    RAG hits that overlap an earlier hit from the same file
+  - if the step is still over budget, shrinks snippets further, then drops
+    the lowest-ranked items
+
+Budgets are estimated tokens per step's tool results, read from
+~/nova/config/agent_budget.json (re-read when the file changes). The same file
+holds each model's context window (num_ctx), which the agent sends to Ollama
+and trims its session history against:
+
+    {"default": 1500, "models": {"llama3.2": 800, "qwen2.5:14b": 3000},
+     "num_ctx": {"default": 8192, "models": {"qwen2.5:14b": 16384}}}
+
+A model matches its exact entry first, then the longest entry it starts with.
+Editor and clipboard results are only pruned: the model edits against them.
+"""
+import os
+import re
+import json
+import math
+import hashlib
+import threading
+from typing import Any, Dict, List, Tuple
+
+from utils.logger import logger, setup_logger
+
+setup_logger()
+logger = logger.bind(name="AgentContext")
+
+BUDGET_PATH = os.path.join(os.path.expanduser("~/nova"), "config", "agent_budget.json")
+DEFAULT_BUDGET = int(os.environ.get("NOVA_AGENT_TOOL_BUDGET", "1500"))
+DEFAULT_NUM_CTX = int(os.environ.get("NOVA_AGENT_NUM_CTX", "8192"))
+CHARS_PER_TOKEN = 4.0
+
+DROP_FIELDS = {"score", "screenshot"}       # anywhere in a result
+ECHO_FIELDS = {"query", "type"}             # top level of a budgeted result
+BUDGETED = {"search_memory", "rag_search", "web_search", "web_ground", "web_metoffice"}
+ITEM_LISTS = ("pages", "hits")              # most useful first; items are ranked best first
+SNIPPET_FIELDS = ("content", "snippet")
+SNIPPET_CAPS = (600, 350, 200, 100)         # chars, tried in order until the step fits
+SEEN_PREFIX = "snippet:"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def prune(value: Any) -> Any:
+    """Drop DROP_FIELDS and empty values, recursively."""
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            if k in DROP_FIELDS:
+                continue
+            v = prune(v)
+            if v is not None and v != "" and v != [] and v != {}:
+                out[k] = v
+        return out
+    if isinstance(value, list):
+        return [prune(v) for v in value]
+    return value
+
+
+def compact(value: Any) -> str:
+    """JSON as the model sees it: pruned, no padding, no \\u escapes."""
+    return json.dumps(prune(value), ensure_ascii=False, separators=(",", ":"))
+
+
+def _cut(text: str, cap: int) -> str:
+    if len(text) <= cap:
+        return text
+    cut = text[:cap]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > cap * 0.6 else cut).rstrip() + "…"
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.lower().encode("utf-8")).hexdigest()[:16]
+
+
+class BudgetConfig:
+    def __init__(self, path: str = BUDGET_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp: tuple | None = None
+        self._data: Dict[str, Any] = self._defaults()
+
+    def _load(self) -> None:
+        try:
+            st = os.stat(self.path)
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = (None, None)
+        with self._lock:
+            if stamp == self._stamp:
+                return
+            data = self._defaults()
+            if stamp[0] is not None:
+                try:
+                    with open(self.path, "r") as f:
+                        raw = json.load(f)
+                    ctx = raw.get("num_ctx") or {}
+                    data["default"] = int(raw.get("default", DEFAULT_BUDGET))
+                    data["models"] = {str(k): int(v) for k, v in (raw.get("models") or {}).items()}
+                    data["num_ctx"] = {
+                        "default": int(ctx.get("default", DEFAULT_NUM_CTX)),
+                        "models": {str(k): int(v) for k, v in (ctx.get("models") or {}).items()},
+                    }
+                except Exception as e:
+                    logger.error(f"Invalid agent budget file {self.path}: {e}; using defaults")
+                    data = self._defaults()
+            self._data, self._stamp = data, stamp
+
+    @staticmethod
+    def _defaults() -> Dict[str, Any]:
+        return {"default": DEFAULT_BUDGET, "models": {}, "num_ctx": {"default": DEFAULT_NUM_CTX, "models": {}}}
+
+    @staticmethod
+    def _match(section: Dict[str, Any], model: str) -> int:
+        models = section["models"]
+        if model in models:
+            return models[model]
+        prefixes = [m for m in models if model.startswith(m)]
+        return models[max(prefixes, key=len)] if prefixes else section["default"]
+
+    def for_model(self, model: str) -> int:
+        """Token budget for one step's tool results."""
+        self._load()
+        return self._match(self._data, model)
+
+    def num_ctx(self, model: str) -> int:
+        """Context window (tokens) the agent runs `model` with."""
+        self._load()
+        return self._match(self._data["num_ctx"], model)
+
+
+budgets = BudgetConfig()
+
+
+def _clean(res: Dict[str, Any]) -> Dict[str, Any]:
+    """Budgeted result reshaped for the model: no echoes, normalised snippets, compact line ranges."""
+    out = {k: v for k, v in prune(res).items() if k not in ECHO_FIELDS}
+    for key in ITEM_LISTS:
+        items = []
+        for item in out.get(key) or []:
+            if not isinstance(item, dict):
+                continue
+            item = dict(item)
+            for field in SNIPPET_FIELDS:
+                if isinstance(item.get(field), str):
+                    item[field] = re.sub(r"\s+", " ", item[field]).strip()
+            if "line_start" in item:
+                start, end = item.pop("line_start"), item.pop("line_end", None)
+                item["lines"] = f"{start}-{end}" if end and end != start else str(start)
+            items.append(item)
+        if key in out:
+            out[key] = items
+    return out
+
+
+def _items(results: List[Any]) -> List[Tuple[Dict[str, Any], str]]:
+    """(item, snippet field) for every snippet-bearing item, in rank order per result."""
+    found = []
+    for res in results:
+        if not isinstance(res, dict):
+            continue
+        for key in ITEM_LISTS:
+            for item in res.get(key) or []:
+                field = next((f for f in SNIPPET_FIELDS if isinstance(item.get(f), str)), None)
+                if field:
+                    found.append((item, field))
+    return found
+
+
+def _dedupe(results: List[Any], seen: Dict[str, str]) -> List[str]:
+    """Blank snippets already seen, or overlapping an earlier hit's lines; returns the new digests."""
+    fresh: List[str] = []
+    spans: Dict[str, List[Tuple[int, int]]] = {}
+    for item, field in _items(results):
+        digest = _digest(item[field])
+        dup = (SEEN_PREFIX + digest) in seen or digest in fresh
+        path, lines = item.get("path"), item.get("lines")
+        if path and lines:
+            a, _, b = lines.partition("-")
+            try:
+                lo, hi = int(a), int(b or a)
+                dup = dup or any(lo <= h and l <= hi for l, h in spans.get(path, []))
+                spans.setdefault(path, []).append((lo, hi))
+            except ValueError:
+                pass
+        if dup:
+            item[field] = "(shown earlier)"
+        else:
+            fresh.append(digest)
+    return fresh
+
+
+def _size(results: List[Any]) -> int:
+    return sum(estimate_tokens(compact(r)) for r in results)
+
+
+def fit(calls: List[Tuple[str, Any]], budget: int, seen: Dict[str, str] | None = None) -> Tuple[List[Any], Dict[str, int]]:
+    """
+    Tool results (one per (kind, result) call) reshaped to fit `budget` estimated tokens.
+    `seen` holds snippet digests already in the chat and gets this step's added.
+    Returns (results, {"before": tokens, "after": tokens}).
+    """
+    seen = seen if seen is not None else {}
+    before = sum(estimate_tokens(compact(res)) for _, res in calls)
+    results = [_clean(res) if kind in BUDGETED and isinstance(res, dict) else prune(res) for kind, res in calls]
+    budgeted = [r for (kind, _), r in zip(calls, results) if kind in BUDGETED]
+
+    fresh = _dedupe(budgeted, seen)
+    full = {id(item): item[field] for item, field in _items(budgeted)}
+    for cap in SNIPPET_CAPS:
+        for item, field in _items(budgeted):
+            item[field] = _cut(full[id(item)], cap)
+        if _size(results) <= budget:
+            break
+    else:
+        # Still over: drop the lowest-ranked item of the longest list until it fits
+        while _size(results) > budget:
+            lists = [res[key] for res in budgeted for key in ITEM_LISTS if len(res.get(key) or []) > 1]
+            if not lists:
+                break
+            max(lists, key=len).pop()
+
+    for digest in fresh:
+        seen[SEEN_PREFIX + digest] = "snippet"
+    after = _size(results)
+    if after < before:
+        logger.debug(f"Tool results fitted: ~{before} -> ~{after} tokens (budget {budget})")
+    return results, {"before": before, "after": after}
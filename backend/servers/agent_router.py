@@ -6,15 +6,23 @@ from __future__ import annotations
 import os
 import re
 import json
-from typing import List, Dict, Any, Tuple, Optional
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from contextlib import aclosing
+from typing import AsyncGenerator, List, Dict, Any, Tuple, Optional
 
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 
-from utils.ollama_client import OllamaClient
+from utils.ollama_client import get_async_client, JsonObjectScanner, JSON_NUM_PREDICT
+from utils.executor import run_io
 from utils.logger import logger, setup_logger
 
 import servers.agent_tools as agent_tools
+import servers.agent_context as agent_context
+import servers.agent_cache as agent_cache
 import servers.rag_store as rag_store
 
 setup_logger()
@@ -52,6 +60,9 @@ Rules:
   • Prefer insert/append; use replace only when the user is explicit about overwriting.
   • Verify after write: snapshot again and confirm the change landed (contains/length check). Retry once if needed.
   • If multiple editor windows are open, ask the user which to use using the IDs provided by the system, then include that client_id in subsequent editor tool calls.
+- Independent lookups (e.g. code AND past notes) go in ONE reply as a batch; they run together:
+  {"action":"tools","input":"","actions":[{"action":"rag_search","input":"..."},{"action":"search_memory","input":"..."}]}
+  Only search_memory, rag_search, web_search, web_ground, web_metoffice and time_now can be batched.
 - After any tool call, return a clear final answer.
 - For rag_search: include top file paths & 1–2 short quoted lines per file.
 - For web_*: summarize and include the domains in text.
@@ -67,39 +78,252 @@ Reply ONLY with compact JSON on one line:
 {"action":"editor_inject","input":"client_id=...; mode=insert; position=cursor; text=..."}
 {"action":"editor_clipboard_read","input":""}
 {"action":"editor_clipboard_write","input":"text=..."}
+{"action":"tools","input":"","actions":[{"action":"...","input":"..."}]}
 """
 
 
-def _call_llm_json(model: str, messages: List[Dict[str, str]]):
-    ol = OllamaClient()
-    txt = ""
-    for chunk in ol.fetch_chat_stream_result(messages, model):
-        txt += chunk
+# Tools without side effects: safe to run side by side, and to prefetch.
+PARALLEL_ACTIONS = ["search_memory", "rag_search", "web_search", "web_ground", "web_metoffice", "time_now"]
+EDITOR_ACTIONS = ["editor_snapshot", "editor_inject", "editor_clipboard_read", "editor_clipboard_write"]
+TOOL_ACTIONS = PARALLEL_ACTIONS + EDITOR_ACTIONS
+ACTIONS = ["answer", "tools"] + TOOL_ACTIONS
+
+# Ollama's structured output: the model can only emit {"action": <one of ACTIONS>, "input": "..."},
+# plus an "actions" list when it batches tools.
+# Set NOVA_AGENT_JSON_FORMAT=json for Ollama builds without JSON-schema support.
+ACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "action": {"type": "string", "enum": ACTIONS},
+        "input": {"type": "string"},
+        "actions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "action": {"type": "string", "enum": PARALLEL_ACTIONS},
+                    "input": {"type": "string"},
+                },
+                "required": ["action", "input"],
+            },
+        },
+    },
+    "required": ["action", "input"],
+}
+AGENT_JSON_FORMAT = os.environ.get("NOVA_AGENT_JSON_FORMAT", "schema").lower()
+
+FALSE_VALUES = {"0", "false", "no", "off"}
+
+
+def _flag(value: Any, default: bool) -> bool:
+    """A boolean from env/JSON, where strings like "false" or "0" mean False."""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() not in FALSE_VALUES | {""}
+    return bool(value)
+
+
+# Speculative mode (off by default): when the keyword heuristic is ambiguous, run
+# the likely local lookups on the user's message while the model is still
+# deciding, and use a result only if the model asks for that tool with that same
+# input. Only SPECULATE_TOOLS are prefetched: a wasted prefetch can't be stopped
+# once its thread has started, so it must be cheap and touch nothing remote.
+SPECULATE = _flag(os.environ.get("NOVA_AGENT_SPECULATE"), False)
+SPECULATE_MAX = int(os.environ.get("NOVA_AGENT_SPECULATE_MAX", "2"))
+SPECULATE_TOOLS = ["search_memory", "rag_search"]
+
+TAG_ACTIONS = {
+    "memory": "search_memory",
+    "rag": "rag_search",
+    "web": "web_search",
+    "web:ground": "web_ground",
+    "web:metoffice": "web_metoffice",
+    "time": "time_now",
+}
+
+
+# Per-chat sessions: each request's prompt extends the previous one unchanged
+# (same system prompt, same earlier messages) and keep_alive keeps the model
+# loaded, so Ollama reuses its KV cache for that prefix instead of re-reading
+# AGENT_PROMPT and the history on every step.
+# History is capped in estimated tokens against the model's num_ctx (see
+# agent_context.budgets), which is also sent to Ollama, so the prompt never
+# outgrows the window and gets silently truncated from the front.
+KEEP_ALIVE = os.environ.get("NOVA_AGENT_KEEP_ALIVE", "30m")
+SESSION_MAX = int(os.environ.get("NOVA_AGENT_SESSIONS", "64"))
+SESSION_IDLE_S = float(os.environ.get("NOVA_AGENT_SESSION_IDLE_S", "1800"))
+SESSION_RESERVE_STEPS = 2   # tool steps' worth of budget kept free for the next turn
+MESSAGE_TOKENS = 4          # per-message overhead of the chat template
+
+
+def _message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(agent_context.estimate_tokens(m.get("content") or "") + MESSAGE_TOKENS for m in messages)
+
+
+def _history_limit(model: str) -> int:
+    """Estimated tokens of earlier turns that still leave room for a new turn in num_ctx."""
+    reserve = (_message_tokens([{"content": AGENT_PROMPT}])
+               + SESSION_RESERVE_STEPS * agent_context.budgets.for_model(model)
+               + JSON_NUM_PREDICT)
+    return max(0, agent_context.budgets.num_ctx(model) - reserve)
+
+
+class AgentSession:
+    """A chat's agent transcript, kept between turns (one turn at a time)."""
+
+    def __init__(self, key: Optional[str], model: str):
+        self.key = key
+        self.model = model
+        self.turns: List[List[Dict[str, str]]] = []
+        self.tokens: List[int] = []      # estimated tokens per turn
+        self.sent: Dict[str, str] = {}   # digest of a tool result already in the transcript -> label
+        self.lock = asyncio.Lock()
+        self.used = time.time()
+
+    def begin(self, message: str) -> List[Dict[str, str]]:
+        self.used = time.time()
+        history = [m for turn in self.turns for m in turn]
+        return [{"role":"system","content":AGENT_PROMPT}, *history, {"role":"user","content":message}]
+
+    def commit(self, messages: List[Dict[str, str]], sent: Dict[str, str]) -> None:
+        """Keep this turn's messages (everything after the stored history)."""
+        start = 1 + sum(len(t) for t in self.turns)
+        self.turns.append(messages[start:])
+        self.tokens.append(_message_tokens(self.turns[-1]))
+        self.sent = sent
+        limit = _history_limit(self.model)
+        if sum(self.tokens) > limit:
+            # Whole turns go, oldest first. Dropping them changes the prefix once;
+            # the next turn re-caches it
+            while self.turns and sum(self.tokens) > limit:
+                self.turns.pop(0)
+                self.tokens.pop(0)
+            self.sent = {}
+        self.used = time.time()
+
+
+_sessions: "OrderedDict[str, AgentSession]" = OrderedDict()
+
+
+def _get_session(chat_key: Optional[str], model: str) -> AgentSession:
+    if not chat_key:
+        return AgentSession(None, model)   # anonymous: a fresh transcript per turn
+    now = time.time()
+    for key in [k for k, sess in _sessions.items() if now - sess.used > SESSION_IDLE_S and not sess.lock.locked()]:
+        _sessions.pop(key, None)
+    key = f"{chat_key}\x00{model}"
+    sess = _sessions.get(key)
+    if sess is None:
+        sess = _sessions[key] = AgentSession(key, model)
+    _sessions.move_to_end(key)
+    if len(_sessions) > SESSION_MAX:
+        # Least recently used first; a session mid-turn is kept until its turn ends
+        idle = [k for k, s in _sessions.items() if k != key and not s.lock.locked()]
+        for k in idle[:len(_sessions) - SESSION_MAX]:
+            _sessions.pop(k, None)
+    return sess
+
+
+def _llm_options(model: str) -> Dict[str, Any]:
+    return {"num_ctx": agent_context.budgets.num_ctx(model)}
+
+
+async def _call_llm_json(model: str, messages: List[Dict[str, str]], stats: Optional[Dict[str, Any]] = None):
+    schema = ACTION_SCHEMA if AGENT_JSON_FORMAT == "schema" else None
+    return await get_async_client().chat_json(messages, model, schema=schema, early_stop=True,
+                                              options=_llm_options(model), keep_alive=KEEP_ALIVE, stats=stats)
+
+
+class _AnswerText:
+    """Decodes the "input" of {"action":"answer","input":"..."} while the JSON is still streaming."""
+
+    HEAD = re.compile(r'\s*\{\s*"action"\s*:\s*"answer"\s*,\s*"input"\s*:\s*"')
+
+    def __init__(self):
+        self.buf = ""
+        self.pos: Optional[int] = None
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        """Add raw JSON text; return the newly decoded part of the answer."""
+        self.buf += chunk
+        if self.done:
+            return ""
+        if self.pos is None:
+            m = self.HEAD.match(self.buf)
+            if not m:
+                return ""   # not an answer (or its head hasn't arrived yet)
+            self.pos = m.end()
+        buf, i, out = self.buf, self.pos, []
+        try:
+            while i < len(buf):
+                ch = buf[i]
+                if ch == '"':
+                    self.done = True
+                    break
+                if ch != "\\":
+                    out.append(ch)
+                    i += 1
+                    continue
+                n = 2
+                if buf[i + 1:i + 2] == "u":
+                    n = 6
+                    if len(buf) >= i + 6 and 0xD800 <= int(buf[i + 2:i + 6], 16) <= 0xDBFF:
+                        n = 12   # surrogate pair
+                if len(buf) < i + n:
+                    break        # escape split across chunks
+                out.append(json.loads('"' + buf[i:i + n] + '"'))
+                i += n
+        except ValueError:
+            self.done = True     # malformed escape; the final parse reports it
+        self.pos = i
+        return "".join(out)
+
+
+async def _stream_llm_json(model: str, messages: List[Dict[str, str]], stats: Optional[Dict[str, Any]] = None) -> AsyncGenerator[Tuple[str, Any], None]:
+    """Like _call_llm_json, but yields ("token", text) for an answer as it streams, then ("action", obj)."""
+    schema = ACTION_SCHEMA if AGENT_JSON_FORMAT == "schema" else None
+    scanner, answer, found = JsonObjectScanner(), _AnswerText(), None
+    async with aclosing(get_async_client().chat_json_stream(messages, model, schema=schema,
+                                                            options=_llm_options(model), keep_alive=KEEP_ALIVE,
+                                                            stats=stats)) as chunks:
+        async for chunk in chunks:
+            if found is not None:
+                continue   # draining to the stats line
+            text = answer.feed(chunk)
+            if text:
+                yield "token", text
+            found = scanner.feed(chunk)
     try:
-        return json.loads(txt.strip())
-    except Exception:
-        m = re.search(r"\{.*\}", txt, flags=re.S)
-        if not m:
-            raise ValueError("Model did not return JSON")
-        return json.loads(m.group(0))
+        yield "action", json.loads(found or scanner.text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Model did not return JSON: {e}") from e
 
 
-def _choose_auto_tool(msg: str) -> str | None:
+def _auto_tool_candidates(msg: str) -> List[str]:
+    """Every tool tag whose keywords match, in priority order."""
     s = (msg or "").lower()
+    tags = []
     if any(k in s for k in ["headline", "front page", "top news", "today in news"]):
-        return "web:ground"
+        tags.append("web:ground")
     if any(k in s for k in ["weather", "forecast", "met office", "metoffice"]):
-        return "web:metoffice"
+        tags.append("web:metoffice")
     if any(k in s for k in ["what's the date", "what is the date", "today's date", "what's the time", "time now", "date today", "today now", "what day is it"]):
-        return "time"
+        tags.append("time")
     if "http://" in s or "https://" in s or re.search(r"\b([a-z0-9-]+\.)+[a-z]{2,}\b", s):
-        return "web"
+        tags.append("web")
     if any(k in s for k in ["readme", "readme.md", "/mnt/", "/home/", "~/", "where in my code", "path", "file", ".py", ".js", ".ts", ".html", ".css", ".json"]):
-        return "rag"
+        tags.append("rag")
     if any(k in s for k in ["what did i say", "notes", "last time", "my hardware", "you said"]):
-        return "memory"
+        tags.append("memory")
     # intentionally do not auto-pick editor tools here (require ID resolution)
-    return None
+    return tags
+
+
+def _choose_auto_tool(msg: str) -> str | None:
+    tags = _auto_tool_candidates(msg)
+    return tags[0] if tags else None
 
 
 def _parse_editor_input(value: str) -> Dict[str, str]:
@@ -271,6 +495,124 @@ def _run_tool(kind: str, value: str, tools_used: list, chat_key: Optional[str] =
     raise ValueError(f"unknown action {kind}")
 
 
+def _run_call(kind: str, value: str, chat_key: Optional[str] = None):
+    """One tool call with its own tools_used list, so concurrent calls don't interleave."""
+    used: List[Dict[str, Any]] = []
+    res = _run_tool(kind, value, used, chat_key=chat_key)
+    return res, used
+
+
+def _prefetch_key(kind: str, value: str) -> Tuple[str, str]:
+    return kind, " ".join((value or "").split()).lower()
+
+
+async def _run_calls(calls: List[Tuple[str, str]], chat_key: Optional[str] = None, prefetched: Optional[Dict[str, Any]] = None):
+    """
+    Run tool calls, yielding (index, kind, input, result, tools_used) as each one finishes.
+    Side-effect-free tools run concurrently; a batch touching the editor runs in order.
+    A call takes a prefetched result only when both its kind and its input match the
+    prefetch (keyed by _prefetch_key); a prefetch of the same kind with another input
+    is dropped and the call runs fresh.
+    """
+    prefetched = prefetched if prefetched is not None else {}
+
+    async def one(i: int, kind: str, value: str):
+        task = prefetched.pop(_prefetch_key(kind, value), None)
+        for key in [k for k in prefetched if k[0] == kind]:
+            prefetched.pop(key).cancel()
+        if task is not None:
+            res, used = await task
+        else:
+            res, used = await run_io(_run_call, kind, value, chat_key)
+        return i, kind, value, res, used
+
+    if not all(kind in PARALLEL_ACTIONS for kind, _ in calls):
+        for i, (k, v) in enumerate(calls):
+            yield await one(i, k, v)
+        return
+    tasks = [asyncio.ensure_future(one(i, k, v)) for i, (k, v) in enumerate(calls)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _calls_of(action: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """(kind, input) pairs for a single action or a {"action":"tools","actions":[...]} batch."""
+    if action.get("action") == "tools" or action.get("actions"):
+        calls = [(a.get("action"), a.get("input", "")) for a in action.get("actions") or [] if isinstance(a, dict)]
+    else:
+        calls = [(action.get("action"), action.get("input", ""))]
+    return list(dict.fromkeys(calls))
+
+
+def _router_answer(ran: list) -> Optional[str]:
+    for _, _, res, _ in ran:
+        if isinstance(res, dict) and res.get("_router_answer"):
+            return res["_router_answer"]
+    return None
+
+
+def _summarize(res: Any) -> Dict[str, Any]:
+    """A few fields of a tool result for progress events (the full result goes to the model)."""
+    if not isinstance(res, dict):
+        return {"text": str(res)[:200]}
+    if res.get("_router_answer"):
+        return {"router_answer": True}
+    if res.get("error"):
+        return {"error": res["error"]}
+    out: Dict[str, Any] = {"type": res.get("type")}
+    for key in ("hits", "pages"):
+        if isinstance(res.get(key), list):
+            out[key] = len(res[key])
+    top = [h.get("path") or h.get("href") or h.get("url") for h in (res.get("pages") or res.get("hits") or []) if isinstance(h, dict)]
+    if any(top):
+        out["top"] = [t for t in top if t][:3]
+    if res.get("pretty"):
+        out["text"] = res["pretty"]
+    return out
+
+
+_compact = agent_context.compact
+
+
+def _tool_turn(ran: list, sent: Dict[str, str], budget: int) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+    """
+    The assistant call + tool result messages appended after a step, and the
+    estimated tool tokens before/after fitting. Only new output is added: a
+    result identical to one already in the transcript is referenced instead of
+    repeated, and the rest is fitted into `budget` (`sent` tracks both).
+    """
+    texts: List[Optional[str]] = []
+    fresh = []
+    for kind, value, res, _ in ran:
+        digest = hashlib.sha1(_compact(res).encode("utf-8")).hexdigest()
+        if digest in sent:
+            texts.append(f"(unchanged: same as the earlier {sent[digest]} result)")
+        else:
+            sent[digest] = f"{kind} {json.dumps(value[:60], ensure_ascii=False)}"
+            texts.append(None)
+            fresh.append((kind, res))
+    fitted, sizes = agent_context.fit(fresh, budget, sent)
+    fitted_iter = iter(fitted)
+    lines = []
+    for (kind, _, _, _), text in zip(ran, texts):
+        text = text if text is not None else _compact(next(fitted_iter))
+        lines.append(text if len(ran) == 1 else f"{kind}: {text}")
+    if len(ran) == 1:
+        call = {"action": ran[0][0], "input": ran[0][1]}
+        result = "Tool result:\n" + lines[0]
+    else:
+        call = {"action": "tools", "input": "", "actions": [{"action": k, "input": v} for k, v, _, _ in ran]}
+        result = "Tool results:\n" + "\n".join(lines)
+    return [
+        {"role":"assistant","content":_compact(call)},
+        {"role":"user","content":result + "\nNow respond ONLY with final JSON: {\"action\":\"answer\",\"input\":\"...\"}"}
+    ], sizes
+
+
 def _collect_sources(tools_used: list, max_items: int = 3):
     sources = []
     for t in tools_used:
@@ -278,7 +620,10 @@ def _collect_sources(tools_used: list, max_items: int = 3):
         data = t.get("data", {})
         if kind == "RAG":
             for h in (data.get("hits") or [])[:max_items]:
-                sources.append({"kind":"file", "path": h.get("path"), "snippet": (h.get("content") or "")[:240]})
+                src = {"kind":"file", "path": h.get("path"), "snippet": (h.get("content") or "")[:240]}
+                if h.get("line_start"):
+                    src["lines"] = [h.get("line_start"), h.get("line_end")]
+                sources.append(src)
         elif kind == "Web":
             pages = data.get("pages") or []
             hits = data.get("hits") or []
@@ -296,95 +641,284 @@ def _collect_sources(tools_used: list, max_items: int = 3):
 
 
 
-@AgentRouter.post("/agent")
-async def agent_entry(request: Request):
-    body = await request.json()
+async def _agent_turn(body: Dict[str, Any], stream: bool = False) -> AsyncGenerator[Tuple[str, Dict[str, Any]], None]:
+    """
+    One agent turn as (event, data) pairs:
+      start, tool_chosen, tool_started, tool_result, sources, token, then done or error.
+    `done` carries the /agent response body; `error` carries {"status", "error"}.
+    With stream=True the final answer also arrives as `token` events while Ollama generates it.
+    A semantic cache hit (see agent_cache) skips tools and LLM: start, sources, token, done.
+    """
     model = body.get("model")
     message = body.get("message")
     tool_hint = (body.get("tool_hint") or "").lower().strip()  # 'auto'|'memory'|'rag'|'web'
-    chat_id = (body.get("chat_id") or "").strip() or (body.get("username") or "").strip()
+    session_id = (body.get("chat_id") or "").strip()
+    # Editor choice, tool scope and cache scope fall back to the user; the transcript
+    # doesn't (a new chat's first turn carries only a username).
+    chat_id = session_id or (body.get("username") or "").strip()
     max_steps = int(body.get("max_steps", 3))
+    speculate = _flag(body.get("speculate"), SPECULATE)
 
     if not model or not message:
-        return JSONResponse(status_code=400, content={"error":"model and message are required"})
+        yield "error", {"status": 400, "error": "model and message are required"}
+        return
 
     # If user said "use editor N/ID", capture sticky choice and acknowledge
-    chosen = _maybe_capture_editor_choice(chat_id, message)
+    chosen = await run_io(_maybe_capture_editor_choice, chat_id, message)
     if chosen:
-        return {"answer": f"Okay — I’ll use editor `{chosen}` for this chat.", "steps": 0, "tools_used": [], "sources": []}
+        yield "done", {"answer": f"Okay — I’ll use editor `{chosen}` for this chat.", "steps": 0, "tools_used": [], "sources": []}
+        return
 
-    messages = [
-        {"role":"system","content":AGENT_PROMPT},
-        {"role":"user","content":message}
-    ]
+    session = _get_session(session_id or None, model)
+    session_history: List[Dict[str, str]] = []
+    messages: List[Dict[str, str]] = []
+    sent: Dict[str, str] = {}
 
     tools_used: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+    timings: Dict[str, Any] = {"llm_ms": 0.0, "tools_ms": 0.0, "llm_calls": 0, "prompt_eval_tokens": 0, "steps": []}
+
+    budget = agent_context.budgets.for_model(model)
+
+    def add_tool_turn(ran: list):
+        turn, sizes = _tool_turn(ran, sent, budget)
+        messages.extend(turn)
+        timings["tool_tokens_raw"] = timings.get("tool_tokens_raw", 0) + sizes["before"]
+        timings["tool_tokens"] = timings.get("tool_tokens", 0) + sizes["after"]
+
+    def reply(answer: str, steps: int):
+        messages.append({"role":"assistant","content":_compact({"action": "answer", "input": answer})})
+        session.commit(messages, sent)
+        sources = _collect_sources(tools_used)
+        if query_vec is not None:
+            agent_cache.cache.store(model, intent, query_vec, message, answer, sources, tools_run,
+                                    scope=chat_id, history=len(session_history) > 0)
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        out = {k: round(v, 1) if isinstance(v, float) else v for k, v in timings.items()}
+        logger.info(f"Agent turn: {steps} step(s) {out}")
+        return {"answer": answer, "steps": steps, "tools_used": tools_used, "sources": sources, "timings": out}
+
+    async def decide():
+        t = time.perf_counter()
+        stats: Dict[str, Any] = {}
+        try:
+            if not stream:
+                yield "action", await _call_llm_json(model, messages, stats)
+                return
+            async for event, data in _stream_llm_json(model, messages, stats):
+                if event == "token" and "ttft_ms" not in timings:
+                    timings["ttft_ms"] = (time.perf_counter() - started) * 1000
+                yield event, data
+        finally:
+            ms = (time.perf_counter() - t) * 1000
+            timings["llm_ms"] += ms
+            timings["llm_calls"] += 1
+            # prompt_eval_count counts only tokens Ollama had to evaluate; a cached prefix doesn't show up
+            timings["prompt_eval_tokens"] += stats.get("prompt_eval_count", 0)
+            timings["steps"].append({"messages": len(messages), "ms": round(ms, 1), **stats})
+            logger.debug(f"Agent step {timings['llm_calls']}: {len(messages)} messages, {stats}")
+
+    async def run(calls: List[Tuple[str, str]], by: str, ran: list):
+        yield "tool_chosen", {"by": by, "calls": [{"action": k, "input": v} for k, v in calls]}
+        for k, v in calls:
+            yield "tool_started", {"action": k, "input": v, "prefetched": _prefetch_key(k, v) in prefetch}
+        t = time.perf_counter()
+        results: List[Any] = [None] * len(calls)
+        try:
+            async for i, kind, value, res, used in _run_calls(calls, chat_id, prefetch):
+                results[i] = (kind, value, res, used)
+                yield "tool_result", {"action": kind, "input": value, "summary": _summarize(res)}
+        finally:
+            timings["tools_ms"] += (time.perf_counter() - t) * 1000
+        for r in results:
+            tools_used.extend(r[3])
+        tools_run.extend(k for k, _ in calls)
+        ran.extend(results)
+        yield "sources", {"sources": _collect_sources(tools_used)}
+
+    # Forced or heuristic first tool (editor tools are intentionally not auto-picked).
+    # An ambiguous heuristic (several matches, or none) doesn't force anything; in
+    # speculative mode the likely local lookups start now and overlap the first LLM call.
+    candidates = [tool_hint] if tool_hint in {"memory","rag","web"} else _auto_tool_candidates(message)
+
+    # Semantic answer cache; a request can opt out with "no_cache": true
+    intent = ",".join(candidates)
+    tools_run: List[str] = []
+    query_vec = None
+    if agent_cache.ENABLED and not _flag(body.get("no_cache"), False):
+        query_vec = await run_io(agent_cache.cache.embed, message)
+        hit = agent_cache.cache.lookup(model, intent, query_vec, chat_id)
+        if hit is not None:
+            async with session.lock:
+                turn = session.begin(message)
+                turn.append({"role":"assistant","content":_compact({"action": "answer", "input": hit.answer})})
+                session.commit(turn, session.sent)
+            out = {"total_ms": round((time.perf_counter() - started) * 1000, 1), "cached": True}
+            logger.info(f"Agent turn: answer cache hit {out}")
+            yield "start", {"model": model, "prefetched": [], "cached": True}
+            yield "sources", {"sources": hit.sources}
+            if stream:
+                yield "token", {"text": hit.answer}
+            yield "done", {"answer": hit.answer, "steps": 0, "tools_used": [], "sources": hit.sources,
+                           "cached": True, "timings": out}
+            return
+
+    mapped = None
+    prefetch: Dict[Tuple[str, str], Any] = {}
+    if len(candidates) == 1 or (candidates and not speculate):
+        mapped = TAG_ACTIONS.get(candidates[0])
+    elif speculate:
+        kinds = [TAG_ACTIONS[t] for t in candidates] if candidates else SPECULATE_TOOLS
+        for kind in [k for k in kinds if k in SPECULATE_TOOLS][:SPECULATE_MAX]:
+            task = asyncio.ensure_future(run_io(_run_call, kind, message, chat_id))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            prefetch[_prefetch_key(kind, message)] = task
+        timings["prefetched"] = [k for k, _ in prefetch]
+
+
+    async def answer_step():
+        """Run decide(); forward answer tokens, then hand back the parsed action."""
+        streamed = False
+        async for event, data in decide():
+            if event == "token":
+                streamed = True
+                yield "token", {"text": data}
+            else:
+                if stream and not streamed and data.get("action") == "answer" and data.get("input"):
+                    yield "token", {"text": data["input"]}   # answer the stream couldn't split
+                yield "action", data
 
-    # Forced or heuristic first tool (editor tools are intentionally not auto-picked)
-    first = None
-    if tool_hint in {"memory","rag","web"}:
-        first = tool_hint
-    else:
-        first = _choose_auto_tool(message)
-
-    def map_first(tag: str | None):
-        if not tag:
-            return None
-        if tag == "memory": return "search_memory"
-        if tag == "rag": return "rag_search"
-        if tag == "web": return "web_search"
-        if tag == "web:ground": return "web_ground"
-        if tag == "web:metoffice": return "web_metoffice"
-        if tag == "time": return "time_now"
-        return None
+    # One turn per chat at a time, so the transcript (and the cached prefix) stays linear
+    held = False
+    try:
+        await session.lock.acquire()
+        held = True
+        messages.extend(session.begin(message))
+        session_history = messages[1:-1]
+        sent.update(session.sent)
+        yield "start", {"model": model, "prefetched": [k for k, _ in prefetch], "history": len(messages) - 2}
+
+        if mapped:
+            ran: list = []
+            async for event in run([(mapped, message)], "hint" if tool_hint else "heuristic", ran):
+                yield event
+            routed = _router_answer(ran)
+            if routed:
+                yield "done", reply(routed, 0)
+                return
+            add_tool_turn(ran)
+            try:
+                action: Dict[str, Any] = {}
+                async for event, data in answer_step():
+                    if event == "action":
+                        action = data
+                    else:
+                        yield event, data
+                if action.get("action") == "answer":
+                    yield "done", reply(action.get("input",""), 1)
+                    return
+            except Exception as e:
+                logger.error(f"Parse error after forced tool: {e}")
+                yield "error", {"status": 500, "error": f"agent_parse_error: {e}"}
+                return
+
+        # Fallback loop
+        for step in range(max_steps):
+            try:
+                action = {}
+                async for event, data in answer_step():
+                    if event == "action":
+                        action = data
+                    else:
+                        yield event, data
+            except Exception as e:
+                logger.error(f"Parse error: {e}")
+                yield "error", {"status": 500, "error": f"agent_parse_error: {e}"}
+                return
 
-    mapped = map_first(first)
-    if mapped:
-        tool_res = _run_tool(mapped, message, tools_used, chat_key=chat_id)
-        if isinstance(tool_res, dict) and tool_res.get("_router_answer"):
-            return {"answer": tool_res["_router_answer"], "steps": 0, "tools_used": tools_used, "sources": _collect_sources(tools_used)}
-        messages.extend([
-            {"role":"assistant","content":json.dumps({"action": mapped, "input": message})},
-            {"role":"user","content":"Tool result:\n" + json.dumps(tool_res) + "\nNow respond ONLY with final JSON: {\"action\":\"answer\",\"input\":\"...\"}"}
-        ])
-        try:
-            action = _call_llm_json(model, messages)
             if action.get("action") == "answer":
-                return {"answer": action.get("input",""), "steps": 1, "tools_used": tools_used, "sources": _collect_sources(tools_used)}
-        except Exception as e:
-            logger.error(f"Parse error after forced tool: {e}")
-            return JSONResponse(status_code=500, content={"error": f"agent_parse_error: {e}"})
+                yield "done", reply(action.get("input", ""), step+1)
+                return
+
+            calls = _calls_of(action)
+            unknown = [kind for kind, _ in calls if kind not in TOOL_ACTIONS]
+            if not calls or unknown:
+                yield "error", {"status": 400, "error": f"unknown action {(unknown or [action.get('action')])[0]}"}
+                return
+
+            ran = []
+            async for event in run(calls, "model", ran):
+                yield event
+            routed = _router_answer(ran)
+            if routed:
+                yield "done", reply(routed, step+1)
+                return
+            add_tool_turn(ran)
+
+        yield "error", {"status": 500, "error": "max_steps_exceeded"}
+    finally:
+        if held:
+            session.lock.release()
+        # Unused prefetches finish in the background; their results are dropped
+        for task in prefetch.values():
+            task.cancel()
 
-    # Fallback loop
-    for step in range(max_steps):
-        try:
-            action = _call_llm_json(model, messages)
-        except Exception as e:
-            logger.error(f"Parse error: {e}")
-            return JSONResponse(status_code=500, content={"error": f"agent_parse_error: {e}"})
-
-        kind = action.get("action")
-        value = action.get("input", "")
-        if kind == "answer":
-            return {"answer": value, "steps": step+1, "tools_used": tools_used, "sources": _collect_sources(tools_used)}
-
-        if kind in {
-            "search_memory","rag_search","web_search","web_ground","web_metoffice","time_now",
-            "editor_snapshot","editor_inject","editor_clipboard_read","editor_clipboard_write"
-        }:
-            tool_res = _run_tool(kind, value, tools_used, chat_key=chat_id)
-        else:
-            return JSONResponse(status_code=400, content={"error": f"unknown action {kind}"})
 
-        if isinstance(tool_res, dict) and tool_res.get("_router_answer"):
-            return {"answer": tool_res["_router_answer"], "steps": step+1, "tools_used": tools_used, "sources": _collect_sources(tools_used)}
+@AgentRouter.post("/agent")
+async def agent_entry(request: Request):
+    body = await request.json()
+    async with aclosing(_agent_turn(body)) as events:
+        async for event, data in events:
+            if event == "error":
+                return JSONResponse(status_code=data["status"], content={"error": data["error"]})
+            if event == "done":
+                return data
+    return JSONResponse(status_code=500, content={"error": "agent_no_result"})
+
+
+@AgentRouter.get("/agent/cache")
+def agent_cache_stats():
+    return agent_cache.cache.stats()
+
+
+@AgentRouter.delete("/agent/cache")
+def agent_cache_clear():
+    return {"cleared": agent_cache.cache.clear()}
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 
-        messages.extend([
-            {"role":"assistant","content":json.dumps(action)},
-            {"role":"user","content":"Tool result:\n" + json.dumps(tool_res) + "\nNow respond ONLY with final JSON: {\"action\":\"answer\",\"input\":\"...\"}"}
-        ])
+@AgentRouter.post("/agent/stream")
+async def agent_stream(request: Request):
+    """
+    /agent as Server-Sent Events. Same body as /agent; events, in order:
+      start        {model, prefetched, history}          sent once the chat's session is free
+      tool_chosen  {by: hint|heuristic|model, calls}
+      tool_started {action, input, prefetched}
+      tool_result  {action, input, summary}
+      sources      {sources}                             after each tool step
+      token        {text}                                the final answer as it's generated
+      done         the /agent response body (answer, steps, tools_used, sources, timings)
+      error        {status, error}
+    """
+    body = await request.json()
+
+    async def events():
+        try:
+            async with aclosing(_agent_turn(body, stream=True)) as turn:
+                async for event, data in turn:
+                    yield _sse(event, data)
+        except Exception as e:
+            logger.error(f"Agent stream failed: {e}")
+            yield _sse("error", {"status": 500, "error": str(e)})
 
-    return JSONResponse(status_code=500, content={"error":"max_steps_exceeded"})
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @AgentRouter.post('/web/browse')
@@ -395,7 +929,7 @@ async def web_browse(request: Request):
         shot = bool(body.get('screenshot'))
         if not url:
             return JSONResponse(status_code=400, content={'error':'missing url'})
-        page = agent_tools.browse_url(url, screenshot=shot)
+        page = await run_io(agent_tools.browse_url, url, screenshot=shot)
         sc = page.get('screenshot')
         if sc and sc.startswith('/shots/'):
             fname = os.path.basename(sc)
@@ -404,8 +938,3 @@ async def web_browse(request: Request):
         return page
     except Exception as e:
         return JSONResponse(status_code=500, content={'error': f'browse_failed: {e}'})
-
-
-@AgentRouter.post("/rag/reindex")
-def rag_reindex(clean: bool = False):
-    return rag_store.reindex(clean=clean)
@@ -5,7 +5,6 @@ from __future__ import annotations
 
 import os, re, time
 import requests
-import numpy as np
 from typing import Dict, Any, List
 from datetime import datetime
 
@@ -14,7 +13,7 @@ try:
 except Exception:
     zoneinfo = None
 
-from .chat_memory_router import get_db as get_chat_db, get_model as get_embed_model
+from .chat_memory_router import search_embeddings as search_chat_embeddings
 from . import rag_store
 
 SEARX_URL = os.environ.get("SEARX_URL", "http://127.0.0.1:8888")
@@ -29,20 +28,8 @@ API_BASE = os.environ.get("NOVA_API_URL", "http://127.0.0.1:56969")
 # ----------------
 
 def search_memory(query: str, top_k: int = 5) -> Dict[str, Any]:
-    model = get_embed_model()
-    q_emb = np.array(model.encode(query), dtype=np.float32)
-    with get_chat_db() as db:
-        rows = db.execute(
-            "SELECT e.embedding, m.role, m.content FROM embeddings e JOIN messages m ON m.id = e.message_id"
-        ).fetchall()
-    scored = []
-    for r in rows:
-        emb = np.frombuffer(r["embedding"], dtype=np.float32)
-        denom = float(np.linalg.norm(q_emb) * np.linalg.norm(emb))
-        score = float(np.dot(q_emb, emb) / denom) if denom else 0.0
-        scored.append((score, r["role"], r["content"]))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    hits = [{"score": s, "role": role, "content": content} for s, role, content in scored[:top_k]]
+    scored = search_chat_embeddings(query, top_k=top_k)
+    hits = [{"score": s, "role": role, "content": content} for s, role, content in scored]
     return {"type": "memory", "query": query, "hits": hits}
 
 # ----------------
@@ -50,7 +37,8 @@ def search_memory(query: str, top_k: int = 5) -> Dict[str, Any]:
 # ----------------
 
 def rag_search(query: str, top_k: int = 5) -> Dict[str, Any]:
-    results = rag_store.search(query, top_k=top_k)
+    # Hybrid so exact identifiers / file names rank as well as fuzzy questions
+    results = rag_store.search(query, top_k=top_k, mode="hybrid")
     return {"type": "rag", "query": query, "hits": results}
 
 # ----------------
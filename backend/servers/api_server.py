@@ -15,9 +15,13 @@ from servers.editor_router import EditorRouter
 from servers.editor_bridge_router import EditorBridgeRouter
 from servers.agent_router import AgentRouter
 from servers.rag_store import RagRouter
+from servers.rag_watcher import RagWatchRouter
+from servers.rag_jobs import RagJobRouter
 
 
 from utils.logger import logger, setup_logger
+from utils import executor, sqlite_pool
+from utils.ollama_client import close_clients
 
 # Set the process title
 setproctitle("nova_API_server")
@@ -53,6 +57,12 @@ logger.debug("Mounted agent router")
 app.include_router(RagRouter)
 logger.debug("Mounted rag router")
 
+app.include_router(RagWatchRouter)
+logger.debug("Mounted rag watcher router")
+
+app.include_router(RagJobRouter)
+logger.debug("Mounted rag jobs router")
+
 app.include_router(ChatRouter)  # Ensure chat router is included for model management
 logger.debug("Mounted chat router")
 
@@ -76,4 +86,11 @@ app.include_router(EditorBridgeRouter, prefix="/editor")
 
 
 
+@app.on_event("shutdown")
+async def release_workers():
+    await close_clients()
+    executor.shutdown()
+    sqlite_pool.close_all()
+
+
 logger.info("API endpoints registered ✅")
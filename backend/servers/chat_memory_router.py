@@ -3,6 +3,7 @@ import uuid
 import sqlite3
 import numpy as np
 import json
+import threading
 
 from fastapi import APIRouter, Request, Query, Depends
 from fastapi.responses import JSONResponse
@@ -10,97 +11,216 @@ from sqlalchemy.orm import Session
 from datetime import datetime
 from numpy.linalg import norm
 
+from utils.embedding_codec import EMBED_DTYPE, encode_vector, decode_rows, quantize_matrix, score
+from utils.embedding_service import embedder
+from utils.sqlite_pool import get_pool
+from utils.executor import run_io
+from utils.logger import logger, setup_logger
+from .memory_tagger import vocabulary, DEFAULT_VOCABULARY
+
+setup_logger()
+logger = logger.bind(name="ChatMemory")
+
 ChatMemoryRouter = APIRouter()
 
 BASE_DIR = os.path.expanduser('~/nova')
 DB_PATH = os.path.join(BASE_DIR, "vault", "vault.db")
 CONFIG_DIR = os.path.join(BASE_DIR, "config")
 
-model = None
 def get_model():
-    global model
-    if model is None:
-        from sentence_transformers import SentenceTransformer
-        model = SentenceTransformer("all-MiniLM-L6-v2")
-    return model
+    """Shared embedding service (SentenceTransformer-compatible .encode)."""
+    return embedder
 
 def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """This thread's pooled vault.db connection (WAL, foreign keys on)."""
+    return _pool.connection()
+
+# ---------------------------
+# Schema migrations (PRAGMA user_version)
+# ---------------------------
+
+def _migrate_base(db):
+    """v1: the original tables (plus the dtype/auto columns added in place)."""
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS chats (
+        id TEXT PRIMARY KEY,
+        title TEXT,
+        created_at TEXT,
+        model TEXT,
+        summary TEXT DEFAULT ''
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT,
+        role TEXT,
+        content TEXT,
+        timestamp TEXT
+    )
+    """)
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS embeddings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER,
+        chat_id TEXT,
+        embedding BLOB,
+        dtype TEXT NOT NULL DEFAULT 'float32'
+    )
+    """)
+    if "dtype" not in {r["name"] for r in db.execute("PRAGMA table_info(embeddings)")}:
+        db.execute("ALTER TABLE embeddings ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float32'")
+    db.execute("""
+    CREATE TABLE IF NOT EXISTS message_tags (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER,
+        tag TEXT,
+        auto INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    if "auto" not in {r["name"] for r in db.execute("PRAGMA table_info(message_tags)")}:
+        db.execute("ALTER TABLE message_tags ADD COLUMN auto INTEGER NOT NULL DEFAULT 0")
+        # rows written by the old single-label tagger
+        legacy = list(DEFAULT_VOCABULARY["tags"])
+        db.execute(f"UPDATE message_tags SET auto = 1 WHERE tag IN ({','.join('?' * len(legacy))})", legacy)
+
+def _migrate_foreign_keys(db):
+    """v2: rebuild child tables with ON DELETE CASCADE foreign keys, add indexes.
+
+    Messages whose chat row is missing get a 'Recovered' chat so nothing is lost;
+    embeddings/tags of messages that no longer exist are dropped.
+    """
+    db.execute("""
+    INSERT INTO chats (id, title, created_at, model)
+    SELECT chat_id, 'Recovered', MIN(timestamp), 'unknown' FROM messages
+    WHERE chat_id IS NOT NULL AND chat_id NOT IN (SELECT id FROM chats)
+    GROUP BY chat_id
+    """)
+    db.execute("""
+    CREATE TABLE messages_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT REFERENCES chats(id) ON DELETE CASCADE,
+        role TEXT,
+        content TEXT,
+        timestamp TEXT
+    )
+    """)
+    db.execute("INSERT INTO messages_v2 SELECT id, chat_id, role, content, timestamp FROM messages")
+    db.execute("DROP TABLE messages")
+    db.execute("ALTER TABLE messages_v2 RENAME TO messages")
+    db.execute("""
+    CREATE TABLE embeddings_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER REFERENCES messages(id) ON DELETE CASCADE,
+        chat_id TEXT REFERENCES chats(id) ON DELETE CASCADE,
+        embedding BLOB,
+        dtype TEXT NOT NULL DEFAULT 'float32'
+    )
+    """)
+    db.execute("""
+    INSERT INTO embeddings_v2 SELECT e.id, e.message_id, m.chat_id, e.embedding, e.dtype
+    FROM embeddings e JOIN messages m ON m.id = e.message_id
+    """)
+    db.execute("DROP TABLE embeddings")
+    db.execute("ALTER TABLE embeddings_v2 RENAME TO embeddings")
+    db.execute("""
+    CREATE TABLE message_tags_v2 (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_id INTEGER REFERENCES messages(id) ON DELETE CASCADE,
+        tag TEXT,
+        auto INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    db.execute("""
+    INSERT INTO message_tags_v2 SELECT t.id, t.message_id, t.tag, t.auto
+    FROM message_tags t WHERE t.message_id IN (SELECT id FROM messages)
+    """)
+    db.execute("DROP TABLE message_tags")
+    db.execute("ALTER TABLE message_tags_v2 RENAME TO message_tags")
+    db.execute("CREATE INDEX IF NOT EXISTS ix_chats_title ON chats(title)")
+    db.execute("CREATE INDEX IF NOT EXISTS ix_messages_chat ON messages(chat_id, id)")
+    db.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_message ON embeddings(message_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_chat ON embeddings(chat_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS ix_message_tags_message ON message_tags(message_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS ix_message_tags_tag ON message_tags(tag)")
+
+# Append only: position + 1 is the user_version a migration brings the db to.
+MIGRATIONS = [_migrate_base, _migrate_foreign_keys]
+
+def _migrate(db):
+    """Bring vault.db up to len(MIGRATIONS); run once per process by the pool."""
+    db.isolation_level = None  # explicit BEGIN/COMMIT so DDL is transactional too
+    # table rebuilds must run with enforcement off (it cannot change inside a transaction)
+    db.execute("PRAGMA foreign_keys = OFF")
+    current = db.execute("PRAGMA user_version").fetchone()[0]
+    for version, migrate in enumerate(MIGRATIONS[current:], start=current + 1):
+        db.execute("BEGIN")
+        try:
+            migrate(db)
+            if db.execute("PRAGMA foreign_key_check").fetchone():
+                raise sqlite3.IntegrityError(f"foreign key violations after migration {version}")
+            db.execute(f"PRAGMA user_version = {version}")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        logger.info(f"vault.db migrated to schema v{version}")
+
+_pool = get_pool(DB_PATH, init=_migrate, foreign_keys=True)
 
 def init_db():
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    if not os.path.exists(DB_PATH):
-        open(DB_PATH, 'a').close()
-
-    with get_db() as db:
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS chats (
-            id TEXT PRIMARY KEY,
-            title TEXT,
-            created_at TEXT,
-            model TEXT,
-            summary TEXT DEFAULT ''
-        )
-        """)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id TEXT,
-            role TEXT,
-            content TEXT,
-            timestamp TEXT
-        )
-        """)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS embeddings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message_id INTEGER,
-            chat_id TEXT,
-            embedding BLOB
-        )
-        """)
-        db.execute("""
-        CREATE TABLE IF NOT EXISTS message_tags (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message_id INTEGER,
-            tag TEXT
-        )
-        """)
+    _pool.prepare()
+
+def get_core_chat_id(db, create: bool = False):
+    """Id of the 'Core' chat (created on demand, inside the caller's transaction).
+
+    Looked up every time through ix_chats_title rather than cached: a cached id
+    would outlive a rolled-back INSERT or a deleted Core chat.
+    """
+    row = db.execute("SELECT id FROM chats WHERE title = 'Core'").fetchone()
+    if row:
+        return row["id"]
+    if not create:
+        return None
+    chat_id = str(uuid.uuid4())
+    db.execute(
+        "INSERT INTO chats (id, title, created_at, model) VALUES (?, ?, ?, ?)",
+        (chat_id, "Core", datetime.utcnow().isoformat(), "unknown")
+    )
+    return chat_id
 
 @ChatMemoryRouter.on_event("startup")
 def startup_event():
     init_db()
+    embedder.start()  # load the embedding model now rather than on the first request
 
 @ChatMemoryRouter.get("/chat-memory/core")
 def get_core_memory():
     with get_db() as db:
-        row = db.execute("SELECT id FROM chats WHERE title = 'Core'").fetchone()
-        if not row:
+        chat_id = get_core_chat_id(db)
+        if not chat_id:
             return {"chat_id": None, "messages": []}
 
-        chat_id = row["id"]
-        messages = db.execute(
-            "SELECT id, role, content, timestamp FROM messages WHERE chat_id = ? ORDER BY id ASC",
-            (chat_id,)
-        ).fetchall()
+        # one indexed pass: messages joined to their tags, folded in id order
+        rows = db.execute("""
+            SELECT m.id, m.role, m.content, m.timestamp, t.tag
+            FROM messages m LEFT JOIN message_tags t ON t.message_id = m.id
+            WHERE m.chat_id = ?
+            ORDER BY m.id ASC, t.id ASC
+        """, (chat_id,)).fetchall()
 
         results = []
-        for m in messages:
-            message_id = m["id"]
-            tags = db.execute(
-                "SELECT tag FROM message_tags WHERE message_id = ?",
-                (message_id,)
-            ).fetchall()
-            tag_list = [t["tag"] for t in tags]
-            results.append({
-                "id": message_id,
-                "role": m["role"],
-                "content": m["content"],
-                "timestamp": m["timestamp"],
-                "tags": tag_list
-            })
+        for r in rows:
+            if not results or results[-1]["id"] != r["id"]:
+                results.append({
+                    "id": r["id"],
+                    "role": r["role"],
+                    "content": r["content"],
+                    "timestamp": r["timestamp"],
+                    "tags": []
+                })
+            if r["tag"] is not None:
+                results[-1]["tags"].append(r["tag"])
 
         return {
             "chat_id": chat_id,
@@ -108,25 +228,9 @@ def get_core_memory():
         }
 
 
-@ChatMemoryRouter.post("/chat-memory/core")
-async def append_core_memory(request: Request):
-    data = await request.json()
-    role = data.get("role")
-    content = data.get("content")
-    if not role or not content:
-        return JSONResponse(status_code=400, content={"error": "Missing role or content"})
-
+def _store_core_message(role: str, content: str, emb):
     with get_db() as db:
-        row = db.execute("SELECT id FROM chats WHERE title = 'Core'").fetchone()
-        if row:
-            chat_id = row["id"]
-        else:
-            chat_id = str(uuid.uuid4())
-            created_at = datetime.utcnow().isoformat()
-            db.execute(
-                "INSERT INTO chats (id, title, created_at, model) VALUES (?, ?, ?, ?)",
-                (chat_id, "Core", created_at, "unknown")
-            )
+        chat_id = get_core_chat_id(db, create=True)
 
         timestamp = datetime.utcnow().isoformat()
         cursor = db.execute(
@@ -135,38 +239,31 @@ async def append_core_memory(request: Request):
         )
         message_id = cursor.lastrowid
 
-        emb = get_model().encode(content)
         db.execute(
-            "INSERT INTO embeddings (message_id, chat_id, embedding) VALUES (?, ?, ?)",
-            (message_id, chat_id, sqlite3.Binary(np.array(emb, dtype=np.float32).tobytes()))
+            "INSERT INTO embeddings (message_id, chat_id, embedding, dtype) VALUES (?, ?, ?, ?)",
+            (message_id, chat_id, sqlite3.Binary(encode_vector(emb)), EMBED_DTYPE)
         )
 
         # Tagging
-        TAGS = ["personal", "preferences", "hardware", "software", "ui", "limits"]
-        tag_embeddings = {tag: np.array(get_model().encode(tag), dtype=np.float32) for tag in TAGS}
-
-        emb_array = np.array(emb, dtype=np.float32)
-        best_tag = None
-        best_score = -1
-        for tag, tag_emb in tag_embeddings.items():
-            score = float(np.dot(emb_array, tag_emb) / (np.linalg.norm(emb_array) * np.linalg.norm(tag_emb)))
-            print(f"Tag: {tag}, Score: {score}")  # Debug print
-            if score > best_score:
-                best_tag = tag
-                best_score = score
-
-        print(f"Best tag chosen: {best_tag} with score {best_score}")  # Debug print
-
-        if best_tag:
-            try:
-                db.execute("INSERT INTO message_tags (message_id, tag) VALUES (?, ?)", (message_id, best_tag))
-                print(f"Inserted tag '{best_tag}' for message {message_id}")  # Debug print
-            except Exception as e:
-                print(f"Failed to insert tag: {e}")
-
+        tags = vocabulary.assign(emb)[0]
+        db.executemany(
+            "INSERT INTO message_tags (message_id, tag, auto) VALUES (?, ?, 1)",
+            [(message_id, tag) for tag, _ in tags]
+        )
         db.commit()
+    return message_id, [tag for tag, _ in tags]
 
-    return {"status": "ok", "message_id": message_id}
+@ChatMemoryRouter.post("/chat-memory/core")
+async def append_core_memory(request: Request):
+    data = await request.json()
+    role = data.get("role")
+    content = data.get("content")
+    if not role or not content:
+        return JSONResponse(status_code=400, content={"error": "Missing role or content"})
+
+    emb = await embedder.encode_async(content)
+    message_id, tags = await run_io(_store_core_message, role, content, emb)
+    return {"status": "ok", "message_id": message_id, "tags": tags}
 
 
 @ChatMemoryRouter.get("/chat-memory/new")
@@ -187,9 +284,7 @@ def create_fresh_new_chat(username: str = Query("default"), temp: str = Query("f
         old_row = db.execute("SELECT id FROM chats WHERE title = 'new-chat'").fetchone()
         if old_row:
             old_id = old_row["id"]
-            db.execute("DELETE FROM embeddings WHERE chat_id = ?", (old_id,))
-            db.execute("DELETE FROM messages WHERE chat_id = ?", (old_id,))
-            db.execute("DELETE FROM chats WHERE id = ?", (old_id,))
+            db.execute("DELETE FROM chats WHERE id = ?", (old_id,))  # cascades to messages, embeddings, tags
             print("🗑️ Deleted old new-chat:", old_id)
 
         chat_id = str(uuid.uuid4())
@@ -204,11 +299,11 @@ def create_fresh_new_chat(username: str = Query("default"), temp: str = Query("f
         # in create_fresh_new_chat()
         core_messages = []
         if chat_history_enabled and not temp:
-            core_row = db.execute("SELECT id FROM chats WHERE title = 'Core'").fetchone()
-            if core_row:
+            core_id = get_core_chat_id(db)
+            if core_id:
                 core_messages = db.execute(
                     "SELECT id, role, content, timestamp FROM messages WHERE chat_id = ? ORDER BY id ASC",
-                    (core_row["id"],)
+                    (core_id,)
                 ).fetchall()
 
         return {
@@ -224,30 +319,95 @@ def get_all_tags():
         rows = db.execute("SELECT DISTINCT tag FROM message_tags ORDER BY tag ASC").fetchall()
         return [row["tag"] for row in rows]
 
+@ChatMemoryRouter.get("/chat-memory/tag-vocabulary")
+def get_tag_vocabulary():
+    return vocabulary.read()
 
+@ChatMemoryRouter.put("/chat-memory/tag-vocabulary")
+async def put_tag_vocabulary(request: Request):
+    """Replace the auto-tag vocabulary; tag embeddings are recomputed on next use."""
+    try:
+        return vocabulary.save(await request.json())
+    except (ValueError, TypeError, AttributeError) as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
 
+RETAG_BATCH = 256
 
-@ChatMemoryRouter.post("/chat-memory/{chat_id}")
-async def append_message(chat_id: str, request: Request):
-    data = await request.json()
-    role = data.get("role")
-    content = data.get("content")
-    if not role or not content:
-        return JSONResponse(status_code=400, content={"error": "Missing role or content."})
+@ChatMemoryRouter.post("/chat-memory/retag")
+def retag_core_memory():
+    """Recompute auto tags for the whole Core history with the current vocabulary.
 
+    Manual tags are kept. Messages are processed in id order, RETAG_BATCH at a
+    time, scoring each batch against the tag matrix in one product.
+    """
+    retagged = 0
     with get_db() as db:
+        core_id = get_core_chat_id(db)
+        if not core_id:
+            return {"status": "ok", "messages": 0}
+        last_id = -1
+        while True:
+            rows = db.execute("""
+                SELECT m.id, m.content, e.embedding, e.dtype
+                FROM messages m LEFT JOIN embeddings e ON e.message_id = m.id
+                WHERE m.chat_id = ? AND m.id > ?
+                GROUP BY m.id ORDER BY m.id LIMIT ?
+            """, (core_id, last_id, RETAG_BATCH)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            missing = [r for r in rows if r["embedding"] is None]
+            fresh = dict(zip((r["id"] for r in missing), get_model().encode([r["content"] for r in missing]))) if missing else {}
+            embs = np.vstack([
+                fresh[r["id"]] if r["embedding"] is None else decode_rows([(r["embedding"], r["dtype"])])[0]
+                for r in rows
+            ])
+            ids = [r["id"] for r in rows]
+            db.executemany(
+                "INSERT INTO embeddings (message_id, chat_id, embedding, dtype) VALUES (?, ?, ?, ?)",
+                [(mid, core_id, sqlite3.Binary(encode_vector(e)), EMBED_DTYPE) for mid, e in fresh.items()]
+            )
+            db.execute(f"DELETE FROM message_tags WHERE auto = 1 AND message_id IN ({','.join('?' * len(ids))})", ids)
+            db.executemany(
+                "INSERT INTO message_tags (message_id, tag, auto) VALUES (?, ?, 1)",
+                [(mid, tag) for mid, tags in zip(ids, vocabulary.assign(embs)) for tag, _ in tags]
+            )
+            db.commit()
+            retagged += len(rows)
+    return {"status": "ok", "messages": retagged}
+
+
+
+
+def _store_message(chat_id: str, role: str, content: str, emb):
+    """Insert a message and its embedding; None when the chat does not exist."""
+    with get_db() as db:
+        if not db.execute("SELECT 1 FROM chats WHERE id = ?", (chat_id,)).fetchone():
+            return None
         cursor = db.execute(
             "INSERT INTO messages (chat_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
             (chat_id, role, content, datetime.utcnow().isoformat())
         )
         message_id = cursor.lastrowid
-        emb = get_model().encode(content)
         db.execute(
-            "INSERT INTO embeddings (message_id, chat_id, embedding) VALUES (?, ?, ?)",
-            (message_id, chat_id, sqlite3.Binary(np.array(emb, dtype=np.float32).tobytes()))
+            "INSERT INTO embeddings (message_id, chat_id, embedding, dtype) VALUES (?, ?, ?, ?)",
+            (message_id, chat_id, sqlite3.Binary(encode_vector(emb)), EMBED_DTYPE)
         )
         db.commit()
+    return message_id
+
+@ChatMemoryRouter.post("/chat-memory/{chat_id}")
+async def append_message(chat_id: str, request: Request):
+    data = await request.json()
+    role = data.get("role")
+    content = data.get("content")
+    if not role or not content:
+        return JSONResponse(status_code=400, content={"error": "Missing role or content."})
 
+    emb = await embedder.encode_async(content)
+    message_id = await run_io(_store_message, chat_id, role, content, emb)
+    if message_id is None:
+        return JSONResponse(status_code=404, content={"error": "Chat not found."})
     return {"status": "ok", "message_id": message_id}
 
 @ChatMemoryRouter.get("/chat-memory/{chat_id}")
@@ -287,13 +447,10 @@ async def create_chat(request: Request):
 @ChatMemoryRouter.delete("/chat-memory/core/{message_id}")
 def delete_core_memory_message(message_id: int):
     with get_db() as db:
-        # Find the core chat
-        row = db.execute("SELECT id FROM chats WHERE title = 'Core'").fetchone()
-        if not row:
+        core_chat_id = get_core_chat_id(db)
+        if not core_chat_id:
             return JSONResponse(status_code=404, content={"error": "Core chat not found"})
 
-        core_chat_id = row["id"]
-
         # Ensure the message belongs to Core chat
         message_row = db.execute(
             "SELECT id FROM messages WHERE id = ? AND chat_id = ?",
@@ -302,9 +459,7 @@ def delete_core_memory_message(message_id: int):
         if not message_row:
             return JSONResponse(status_code=404, content={"error": "Message not found in Core chat"})
 
-        # Delete related entries
-        db.execute("DELETE FROM embeddings WHERE message_id = ?", (message_id,))
-        db.execute("DELETE FROM message_tags WHERE message_id = ?", (message_id,))
+        # embeddings and tags go with it (ON DELETE CASCADE)
         db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
         db.commit()
 
@@ -316,32 +471,102 @@ def delete_core_memory_message(message_id: int):
 def embed_chat(chat_id: str):
     with get_db() as db:
         messages = db.execute("SELECT id, content FROM messages WHERE chat_id = ?", (chat_id,)).fetchall()
-        for m in messages:
-            emb = get_model().encode(m["content"])
+        embs = get_model().encode([m["content"] for m in messages]) if messages else []
+        for m, emb in zip(messages, embs):
             db.execute(
-                "INSERT INTO embeddings (message_id, chat_id, embedding) VALUES (?, ?, ?)",
-                (m["id"], chat_id, sqlite3.Binary(np.array(emb, dtype=np.float32).tobytes()))
+                "INSERT INTO embeddings (message_id, chat_id, embedding, dtype) VALUES (?, ?, ?, ?)",
+                (m["id"], chat_id, sqlite3.Binary(encode_vector(emb)), EMBED_DTYPE)
             )
         db.commit()
     return {"status": "ok"}
 
-@ChatMemoryRouter.get("/chat-memory/query")
-def query_memory(q: str):
-    query_emb = get_model().encode(q)
-    query_emb = np.array(query_emb, dtype=np.float32)
+class _EmbeddingIndex:
+    """Unit-length vault embeddings kept in RAM between searches, in EMBED_DTYPE.
+
+    Each search checks COUNT/MAX(id) of the embeddings table first. Rows added
+    since the last search are decoded and appended; any other change (deletes,
+    a re-embedded chat) reloads the matrix. Writes from other processes are
+    picked up the same way.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stamp = (0, 0)   # (rows, max embeddings.id) the matrix reflects
+        self.message_ids = np.empty(0, dtype=np.int64)
+        self.matrix: np.ndarray | None = None
+        self.scales: np.ndarray | None = None
+
+    @staticmethod
+    def _load(db, after: int, upto: int):
+        rows = db.execute(
+            "SELECT message_id, embedding, dtype FROM embeddings WHERE id > ? AND id <= ? ORDER BY id",
+            (after, upto),
+        ).fetchall()
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32), None
+        mat = decode_rows((r["embedding"], r["dtype"]) for r in rows)
+        norms = norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix, scales = quantize_matrix(mat / norms, EMBED_DTYPE)
+        return np.array([r["message_id"] for r in rows], dtype=np.int64), matrix, scales
+
+    def current(self, db):
+        """(message_ids, matrix, scales) matching the table as it is now."""
+        count, top = db.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM embeddings").fetchone()
+        with self._lock:
+            if (count, top) == self.stamp and self.matrix is not None:
+                return self.message_ids, self.matrix, self.scales
+            fresh = None
+            if self.matrix is not None and len(self.matrix) and top > self.stamp[1]:
+                fresh = self._load(db, self.stamp[1], top)
+                if self.stamp[0] + len(fresh[0]) != count:
+                    fresh = None   # rows were deleted as well
+            if fresh is None:
+                self.message_ids, self.matrix, self.scales = self._load(db, 0, top)
+            else:
+                ids, matrix, scales = fresh
+                self.message_ids = np.concatenate([self.message_ids, ids])
+                self.matrix = np.concatenate([self.matrix, matrix])
+                if scales is not None:
+                    self.scales = np.concatenate([self.scales, scales])
+            self.stamp = (len(self.message_ids), top)
+            return self.message_ids, self.matrix, self.scales
+
+
+_index = _EmbeddingIndex()
+
+
+def search_embeddings(query: str, top_k: int = 5):
+    """Cosine-rank every stored message embedding against `query`.
+
+    The vault's vectors stay in memory between calls (see _EmbeddingIndex) and
+    are scored in their stored dtype; only the top hits are read back from
+    messages. Returns (score, role, content).
+    """
+    query_emb = embedder.embed_query(query)
 
     with get_db() as db:
-        rows = db.execute("SELECT e.embedding, m.role, m.content FROM embeddings e JOIN messages m ON m.id = e.message_id").fetchall()
+        message_ids, matrix, scales = _index.current(db)
+        if not len(message_ids) or top_k <= 0:
+            return []
+        scores = score(matrix, scales, query_emb)
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        picked = [int(message_ids[i]) for i in top]
+        rows = db.execute(
+            f"SELECT id, role, content FROM messages WHERE id IN ({','.join('?' * len(picked))})", picked
+        ).fetchall()
+    by_id = {r["id"]: r for r in rows}
+    return [(float(scores[i]), by_id[m]["role"], by_id[m]["content"])
+            for i, m in zip(top, picked) if m in by_id]
 
-    scored = []
-    for row in rows:
-        emb = np.frombuffer(row["embedding"], dtype=np.float32)
-        score = float(np.dot(query_emb, emb) / (norm(query_emb) * norm(emb)))
-        scored.append((score, row["role"], row["content"]))
 
-    scored.sort(reverse=True)
+@ChatMemoryRouter.get("/chat-memory/query")
+def query_memory(q: str):
+    scored = search_embeddings(q, top_k=5)
     return {
-        "matches": [{"role": role, "content": content, "score": score} for score, role, content in scored[:5]]
+        "matches": [{"role": role, "content": content, "score": score} for score, role, content in scored]
     }
 
 @ChatMemoryRouter.post("/chat-memory/tag/{message_id}")
@@ -352,7 +577,10 @@ async def tag_message(message_id: int, request: Request):
         return JSONResponse(status_code=400, content={"error": "Missing tag"})
 
     with get_db() as db:
-        db.execute("INSERT INTO message_tags (message_id, tag) VALUES (?, ?)", (message_id, tag))
+        try:
+            db.execute("INSERT INTO message_tags (message_id, tag) VALUES (?, ?)", (message_id, tag))
+        except sqlite3.IntegrityError:
+            return JSONResponse(status_code=404, content={"error": "Message not found"})
         db.commit()
 
     return {"status": "ok"}
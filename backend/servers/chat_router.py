@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse, StreamingResponse
-from utils.ollama_client import OllamaClient  # Import Ollama client
+from utils.ollama_client import get_async_client, coalesce, FLUSH_MS, FLUSH_BYTES  # Shared, pooled Ollama client
 from utils.logger import logger, setup_logger
 import asyncio
 
@@ -11,15 +11,12 @@ ChatRouter = APIRouter()
 
 # GET route for fetching models (tags)
 @ChatRouter.get("/api/tags")
-def get_models():
+async def get_models():
     try:
         logger.debug("Received request to fetch models from Ollama API.")
 
-        # Create an OllamaClient instance
-        ollama_client = OllamaClient()
-
         # Fetch models from Ollama API
-        models = ollama_client.fetch_models()
+        models = await get_async_client().fetch_models()
 
         logger.debug(f"Fetched models: {models}")
 
@@ -36,16 +33,20 @@ async def post_chat(request: Request):
         body = await request.json()
         model = body.get("model")
         messages = body.get("messages", [])
+        # Optional coalescing overrides: {"stream_options": {"flush_ms": 0}} streams token by token
+        stream_opts = body.get("stream_options") or {}
+        flush_ms = float(stream_opts.get("flush_ms", FLUSH_MS))
+        flush_bytes = int(stream_opts.get("flush_bytes", FLUSH_BYTES))
 
         if not model or not messages:
             return JSONResponse(status_code=400, content={"error": "Invalid request. Model and messages are required."})
 
         logger.debug(f"Streaming response to frontend for model: {model}")
-        ollama_client = OllamaClient()
+        ollama_client = get_async_client()
 
-        def stream_gen():
+        async def stream_gen():
             try:
-                for chunk in ollama_client.fetch_chat_stream_result(messages, model):
+                async for chunk in coalesce(ollama_client.chat_stream(messages, model), flush_ms, flush_bytes):
                     yield chunk
             except Exception as e:
                 logger.error(f"Streaming failed: {e}")
@@ -0,0 +1,125 @@
+# File: servers/memory_tagger.py
+"""
+Embedding-based auto-tagging for Core memory.
+
+The vocabulary lives in ~/nova/config/memory_tags.json:
+
+    {
+      "threshold": 0.25,
+      "max_tags": 3,
+      "tags": {"hardware": "hardware: GPU, CPU, RAM, disks, peripherals", ...}
+    }
+
+Each tag maps to the text that gets embedded (a bare list of names also
+works). Tag embeddings are computed once and cached until the file changes.
+A message gets every tag scoring above `threshold` (best first, at most
+`max_tags`), or the single best tag when none clears it.
+"""
+import os
+import json
+import threading
+import numpy as np
+from typing import Any, Dict, List
+
+from utils.embedding_service import embedder
+from utils.logger import logger, setup_logger
+
+setup_logger()
+logger = logger.bind(name="MemoryTags")
+
+TAGS_PATH = os.path.join(os.path.expanduser("~/nova"), "config", "memory_tags.json")
+
+DEFAULT_VOCABULARY: Dict[str, Any] = {
+    "threshold": 0.25,
+    "max_tags": 3,
+    "tags": {t: t for t in ["personal", "preferences", "hardware", "software", "ui", "limits"]},
+}
+
+
+class TagVocabulary:
+    def __init__(self, path: str = TAGS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp: tuple | None = None
+        self.names: List[str] = []
+        self.threshold = DEFAULT_VOCABULARY["threshold"]
+        self.max_tags = DEFAULT_VOCABULARY["max_tags"]
+        self._matrix: np.ndarray | None = None  # (n_tags, dim), unit rows
+
+    @staticmethod
+    def _normalize(data: Dict[str, Any]) -> Dict[str, Any]:
+        tags = data.get("tags", {})
+        if isinstance(tags, list):
+            tags = {str(t): str(t) for t in tags}
+        tags = {str(k).strip(): str(v or k) for k, v in tags.items() if str(k).strip()}
+        return {
+            "threshold": float(data.get("threshold", DEFAULT_VOCABULARY["threshold"])),
+            "max_tags": max(1, int(data.get("max_tags", DEFAULT_VOCABULARY["max_tags"]))),
+            "tags": tags,
+        }
+
+    def read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r") as f:
+                return self._normalize(json.load(f))
+        except FileNotFoundError:
+            return self._normalize(DEFAULT_VOCABULARY)
+        except Exception as e:
+            logger.error(f"Invalid tag vocabulary {self.path}: {e}; using defaults")
+            return self._normalize(DEFAULT_VOCABULARY)
+
+    def save(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        data = self._normalize(data)
+        if not data["tags"]:
+            raise ValueError("tag vocabulary is empty")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+        with self._lock:
+            self._stamp = None
+        return data
+
+    def _file_stamp(self) -> tuple:
+        try:
+            st = os.stat(self.path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return (None, None)
+
+    def matrix(self) -> tuple[List[str], np.ndarray]:
+        """(tag names, unit tag-embedding matrix), re-encoded only when the file changes."""
+        stamp = self._file_stamp()
+        with self._lock:
+            if self._stamp == stamp and self._matrix is not None:
+                return self.names, self._matrix
+            data = self.read()
+            names = list(data["tags"])
+            mat = np.asarray(embedder.encode([data["tags"][n] for n in names]), dtype=np.float32)
+            norms = np.linalg.norm(mat, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.names, self._matrix = names, mat / norms
+            self.threshold, self.max_tags = data["threshold"], data["max_tags"]
+            self._stamp = stamp
+            logger.info(f"Tag vocabulary loaded: {names}")
+            return self.names, self._matrix
+
+    def assign(self, embs: np.ndarray) -> List[List[tuple[str, float]]]:
+        """Tags (name, score) for each row of `embs`, one matrix product for the batch."""
+        names, tags = self.matrix()
+        embs = np.atleast_2d(np.asarray(embs, dtype=np.float32))
+        if not names or not len(embs):
+            return [[] for _ in range(len(embs))]
+        norms = np.linalg.norm(embs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = (embs / norms) @ tags.T
+        out = []
+        for row in scores:
+            order = np.argsort(-row)
+            picked = [i for i in order[:self.max_tags] if row[i] >= self.threshold] or [order[0]]
+            out.append([(names[i], float(row[i])) for i in picked])
+        return out
+
+
+vocabulary = TagVocabulary()
@@ -0,0 +1,278 @@
+# File: servers/rag_chunkers.py
+"""
+Structure-aware chunking for rag_store.
+
+Each strategy splits a file into semantic segments (top-level Python defs,
+Markdown sections, top-level JSON/YAML/TOML keys). Small neighbouring segments
+are packed together up to CHUNK_SIZE and oversized ones fall back to the
+sliding window, which is also used for every other extension.
+Chunks carry byte offsets into the raw file and 1-based line ranges so hits
+can point at lines.
+"""
+import re
+import ast
+import bisect
+import codecs
+import threading
+from typing import Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+CHUNK_SIZE = 800
+OVERLAP = 200
+MAX_SEGMENT = 1200  # structured segments up to this size are kept whole (~MiniLM window)
+
+
+class Chunk(NamedTuple):
+    text: str
+    start_byte: int
+    end_byte: int
+    line_start: int
+    line_end: int
+
+
+Span = Tuple[int, int]  # [start, end) character offsets into the file text
+
+
+# ---------------------------
+# Sliding window (fallback)
+# ---------------------------
+
+def _window(start: int, end: int, size: int = CHUNK_SIZE, overlap: int = OVERLAP) -> List[Span]:
+    spans = []
+    step = max(1, size - overlap)
+    i = start
+    while i < end:
+        spans.append((i, min(i + size, end)))
+        if i + size >= end:
+            break
+        i += step
+    return spans
+
+
+def chunk_window(text: str) -> List[Span]:
+    return _window(0, len(text))
+
+
+# ---------------------------
+# Segment helpers
+# ---------------------------
+
+def _line_starts(text: str) -> List[int]:
+    starts = [0]
+    for m in re.finditer("\n", text):
+        starts.append(m.end())
+    return starts
+
+
+def _spans_from_line_breaks(text: str, break_lines: Iterable[int]) -> List[Span]:
+    """Turn 0-based line numbers where a new segment starts into char spans."""
+    starts = _line_starts(text)
+    cuts = sorted({0, *(starts[i] for i in break_lines if 0 <= i < len(starts))})
+    cuts.append(len(text))
+    return [(a, b) for a, b in zip(cuts, cuts[1:]) if b > a]
+
+
+def _pack(spans: List[Span]) -> List[Span]:
+    """Merge adjacent small segments up to CHUNK_SIZE; window oversized ones."""
+    out: List[Span] = []
+    cur: Span | None = None
+    for a, b in spans:
+        if b - a > MAX_SEGMENT:
+            if cur:
+                out.append(cur)
+                cur = None
+            out.extend(_window(a, b))
+            continue
+        if cur and b - cur[0] <= CHUNK_SIZE:
+            cur = (cur[0], b)
+        else:
+            if cur:
+                out.append(cur)
+            cur = (a, b)
+    if cur:
+        out.append(cur)
+    return out
+
+
+# ---------------------------
+# Strategies
+# ---------------------------
+
+# CPython 3.11/3.12 ast.parse is not safe to run from several threads at once
+# ("AST constructor recursion depth mismatch"). Reindex chunks in worker processes,
+# where this lock is uncontended, but falls back to the thread pool when no process
+# pool is available or one breaks mid-run.
+_AST_LOCK = threading.Lock()
+
+
+def chunk_python(text: str) -> List[Span]:
+    try:
+        with _AST_LOCK:
+            tree = ast.parse(text)
+    except (SyntaxError, ValueError, RecursionError):
+        return chunk_window(text)
+    breaks = []
+    for node in tree.body:
+        first = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        breaks.append(first - 1)
+        # Large classes split further at their methods
+        end = getattr(node, "end_lineno", node.lineno)
+        if isinstance(node, ast.ClassDef) and end - first > 40:
+            for sub in node.body:
+                if isinstance(sub, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    breaks.append(min([sub.lineno] + [d.lineno for d in sub.decorator_list]) - 1)
+    return _pack(_spans_from_line_breaks(text, breaks))
+
+
+_MD_HEADING = re.compile(r"^#{1,6}\s")
+_MD_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def chunk_markdown(text: str) -> List[Span]:
+    breaks = []
+    in_fence = False
+    for i, line in enumerate(text.split("\n")):
+        if _MD_FENCE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and _MD_HEADING.match(line):
+            breaks.append(i)
+    return _pack(_spans_from_line_breaks(text, breaks))
+
+
+def chunk_json(text: str) -> List[Span]:
+    """Split a top-level object/array after each depth-1 comma."""
+    depth = 0
+    in_str = esc = False
+    cuts = [0]
+    for i, ch in enumerate(text):
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+        elif ch == '"':
+            in_str = True
+        elif ch in "{[":
+            depth += 1
+        elif ch in "}]":
+            depth -= 1
+        elif ch == "," and depth == 1:
+            cuts.append(i + 1)
+    if depth != 0 or len(cuts) == 1:
+        return chunk_window(text)
+    cuts.append(len(text))
+    return _pack([(a, b) for a, b in zip(cuts, cuts[1:]) if b > a])
+
+
+_YAML_TOP_KEY = re.compile(r"^[^\s#\-][^:]*:(\s|$)")
+
+
+def chunk_yaml(text: str) -> List[Span]:
+    breaks = [i for i, line in enumerate(text.split("\n")) if line.startswith("---") or _YAML_TOP_KEY.match(line)]
+    return _pack(_spans_from_line_breaks(text, breaks))
+
+
+_TOML_TABLE = re.compile(r"^\s*\[\[?[^\]]+\]\]?\s*(#.*)?$")
+
+
+def chunk_toml(text: str) -> List[Span]:
+    breaks = [i for i, line in enumerate(text.split("\n")) if _TOML_TABLE.match(line)]
+    return _pack(_spans_from_line_breaks(text, breaks))
+
+
+CHUNKERS: Dict[str, Callable[[str], List[Span]]] = {
+    ".py": chunk_python,
+    ".pyi": chunk_python,
+    ".md": chunk_markdown,
+    ".json": chunk_json,
+    ".yml": chunk_yaml,
+    ".yaml": chunk_yaml,
+    ".toml": chunk_toml,
+}
+
+
+def register_chunker(exts: Iterable[str], fn: Callable[[str], List[Span]]) -> None:
+    """Plug in a strategy for more extensions; fn(text) returns char spans."""
+    for ext in exts:
+        CHUNKERS[ext.lower()] = fn
+
+
+class _Decoded(NamedTuple):
+    text: str
+    lines: List[str]        # text of each line, without its line break
+    raw: List[bytes]        # the same lines as stored in the file
+    char_starts: List[int]  # offset of each line in text
+    byte_starts: List[int]  # offset of each line in the file
+
+
+def _decode(data: bytes) -> _Decoded:
+    """UTF-8 text as a universal-newline read would give it, keeping each line's byte position.
+
+    CRLF and CR line breaks become "\n" and undecodable bytes are dropped, so
+    offsets into the text drift from offsets into the file; the per-line
+    positions let _byte_offset() map them back.
+    """
+    lines, raw, char_starts, byte_starts, parts = [], [], [], [], []
+    c = b = 0
+    for line in data.splitlines(keepends=True):
+        body = line.rstrip(b"\r\n")
+        s = body.decode("utf-8", "ignore")
+        part = s + "\n" if len(body) < len(line) else s
+        lines.append(s)
+        raw.append(body)
+        char_starts.append(c)
+        byte_starts.append(b)
+        parts.append(part)
+        c += len(part)
+        b += len(line)
+    return _Decoded("".join(parts), lines, raw, char_starts, byte_starts)
+
+
+def _char_bytes(body: bytes) -> List[int]:
+    """Byte offset of each character of body.decode("utf-8", "ignore"), plus its end."""
+    dec = codecs.getincrementaldecoder("utf-8")("ignore")
+    out = []
+    for j in range(len(body)):
+        for ch in dec.decode(body[j:j + 1]):
+            out.append(j + 1 - len(ch.encode("utf-8")))
+    out.append(len(body))
+    return out
+
+
+def _byte_offset(doc: _Decoded, p: int, total: int) -> int:
+    if p >= len(doc.text):
+        return total
+    i = bisect.bisect_right(doc.char_starts, p) - 1
+    off, s, body = p - doc.char_starts[i], doc.lines[i], doc.raw[i]
+    if off >= len(s):   # the line break
+        return doc.byte_starts[i] + len(body)
+    if len(s.encode("utf-8")) == len(body):
+        return doc.byte_starts[i] + len(s[:off].encode("utf-8"))
+    return doc.byte_starts[i] + _char_bytes(body)[off]
+
+
+def chunk_file(ext: str, data: bytes) -> List[Chunk]:
+    """Chunk a file's raw bytes; chunk text is decoded, offsets are into data."""
+    doc = _decode(data)
+    text = doc.text
+    if not text:
+        return []
+    spans = CHUNKERS.get(ext.lower(), chunk_window)(text)
+
+    starts = doc.char_starts
+    to_byte: Dict[int, int] = {p: _byte_offset(doc, p, len(data)) for span in spans for p in span}
+
+    chunks = []
+    for a, b in spans:
+        piece = text[a:b]
+        if not piece.strip():
+            continue
+        chunks.append(Chunk(
+            text=piece,
+            start_byte=to_byte[a],
+            end_byte=to_byte[b],
+            line_start=bisect.bisect_right(starts, a),
+            line_end=bisect.bisect_right(starts, max(a, b - 1)),
+        ))
+    return chunks
@@ -0,0 +1,327 @@
+# File: servers/rag_jobs.py
+"""
+Background jobs for /rag/reindex.
+
+POST /rag/reindex starts rag_store.reindex() on the jobs worker thread and
+returns a job id straight away. That one long-lived thread runs every job, so
+they all share its pooled rag.db connection instead of each leaving one open. Only one job runs at a time (a second request gets 409
+with the running job's id). Progress (files scanned, chunks embedded, ETA) is
+kept in memory and served by GET /rag/jobs/{id} and the /ws/rag/jobs/{id}
+websocket; POST /rag/jobs/{id}/cancel stops a job at the next batch.
+
+Job rows (status, params, result) live in rag.db, shared by every API worker.
+A queued or running job refreshes its row's heartbeat; while one is fresh,
+other workers answer 409 too. At startup a worker resumes a job still marked
+queued/running only if its heartbeat is older than LEASE_S and nobody holds
+rag.db's writer lock, i.e. its process died rather than being busy elsewhere.
+It is rerun with the same params; reindex() skips every file the manifest
+already has, so the rerun starts where the crash left off.
+"""
+import json
+import time
+import uuid
+import queue
+import asyncio
+import threading
+from typing import Any, Dict, List
+
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse
+
+from . import rag_store
+from utils.executor import run_io
+from utils.logger import logger, setup_logger
+
+setup_logger()
+logger = logger.bind(name="RAG-Jobs")
+
+TERMINAL = {"done", "failed", "cancelled", "interrupted"}
+KEEP_JOBS = 20          # finished jobs kept in memory
+WS_POLL_S = 0.5
+HEARTBEAT_S = 10.0      # how often a live job refreshes its row
+LEASE_S = 60.0          # a queued/running row older than this belongs to a dead process
+
+RagJobRouter = APIRouter()
+
+
+class ReindexJob:
+    def __init__(self, params: Dict[str, Any], job_id: str | None = None, resumed_from: str | None = None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.params = params
+        self.resumed_from = resumed_from
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.result: Dict[str, Any] | None = None
+        self.error: str | None = None
+        self.created = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.cancel = threading.Event()
+        self.done = threading.Event()
+        self.heartbeat = 0.0
+
+    def update(self, progress: Dict[str, Any]) -> None:
+        self.progress = progress
+
+    def snapshot(self) -> Dict[str, Any]:
+        p = dict(self.progress)
+        scanned, expected, elapsed = p.get("files_scanned"), p.get("files_expected"), p.get("elapsed_s")
+        eta = None
+        if self.status == "running" and scanned and expected and expected > scanned and elapsed:
+            eta = round(elapsed * (expected - scanned) / scanned, 1)
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "progress": p,
+            "eta_s": eta,
+            "result": self.result,
+            "error": self.error,
+            "resumed_from": self.resumed_from,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, ReindexJob] = {}
+        self._active: ReindexJob | None = None
+        self._queue: "queue.Queue[ReindexJob]" = queue.Queue()
+        self._worker: threading.Thread | None = None
+
+    # --- persistence (status transitions only; progress stays in memory) ---
+    def _save(self, job: ReindexJob) -> None:
+        job.heartbeat = time.time()
+        with rag_store._get_db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO jobs(id, status, params, progress, result, error, created, started, finished, heartbeat)"
+                " VALUES (?,?,?,?,?,?,?,?,?,?)",
+                (job.id, job.status, json.dumps(job.params), json.dumps(job.progress),
+                 json.dumps(job.result) if job.result is not None else None,
+                 job.error, job.created, job.started, job.finished, job.heartbeat),
+            )
+
+    def _progress(self, job: ReindexJob, progress: Dict[str, Any]) -> None:
+        job.update(progress)
+        if time.time() - job.heartbeat >= HEARTBEAT_S:
+            job.heartbeat = time.time()
+            with rag_store._get_db() as db:
+                db.execute("UPDATE jobs SET heartbeat=? WHERE id=?", (job.heartbeat, job.id))
+
+    @staticmethod
+    def _live_elsewhere() -> str | None:
+        """Id of a queued/running job whose heartbeat is fresh (possibly in another worker)."""
+        row = rag_store._get_db().execute(
+            "SELECT id FROM jobs WHERE status IN ('queued', 'running') AND heartbeat >= ?"
+            " ORDER BY created DESC LIMIT 1",
+            (time.time() - LEASE_S,),
+        ).fetchone()
+        return row["id"] if row else None
+
+    @staticmethod
+    def _from_row(row) -> Dict[str, Any]:
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "params": json.loads(row["params"] or "{}"),
+            "progress": json.loads(row["progress"] or "{}"),
+            "eta_s": None,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "resumed_from": None,
+            "created": row["created"],
+            "started": row["started"],
+            "finished": row["finished"],
+        }
+
+    # --- lifecycle ---
+    def submit(self, params: Dict[str, Any], resumed_from: str | None = None) -> tuple[str, ReindexJob | None]:
+        """Start a job unless one is running; returns (job id, the job or None if one was already running)."""
+        with self._lock:
+            if self._active and not self._active.done.is_set():
+                return self._active.id, None
+            other = self._live_elsewhere()
+            if other:
+                return other, None
+            job = ReindexJob(params, resumed_from=resumed_from)
+            self._active = job
+            self._jobs[job.id] = job
+            for old in [j for j in self._jobs.values() if j.done.is_set()][:-KEEP_JOBS]:
+                self._jobs.pop(old.id, None)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._work, name="rag-jobs", daemon=True)
+                self._worker.start()
+        self._save(job)
+        self._queue.put(job)
+        return job.id, job
+
+    def _work(self) -> None:
+        while True:
+            self._run(self._queue.get())
+
+    def _run(self, job: ReindexJob) -> None:
+        job.status = "running"
+        job.started = time.time()
+        self._save(job)
+        logger.info(f"Reindex job {job.id} started: {job.params}")
+        try:
+            params = dict(job.params)
+            for key in ("ignore_dirs", "exclude_paths", "ignore_root_files"):
+                params[key] = set(params[key]) if params.get(key) else None
+            job.result = rag_store.reindex(**params, progress=lambda p: self._progress(job, p), cancel=job.cancel)
+            job.status = "cancelled" if job.result.get("status") == "cancelled" else "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"Reindex job {job.id} failed: {e}")
+        finally:
+            job.finished = time.time()
+            self._save(job)
+            job.done.set()
+            logger.info(f"Reindex job {job.id} {job.status}")
+
+    def cancel(self, job_id: str) -> ReindexJob | None:
+        job = self._jobs.get(job_id)
+        if job:
+            job.cancel.set()
+        return job
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        job = self._jobs.get(job_id)
+        if job:
+            return job.snapshot()
+        row = rag_store._get_db().execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return self._from_row(row) if row else None
+
+    def recent(self, limit: int = KEEP_JOBS) -> List[Dict[str, Any]]:
+        rows = rag_store._get_db().execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self.get(r["id"]) or self._from_row(r) for r in rows]
+
+    def resume_interrupted(self) -> ReindexJob | None:
+        """Mark jobs left queued/running by a dead process as interrupted; rerun the latest.
+
+        A job counts as dead once its heartbeat is older than LEASE_S and no
+        process holds the writer lock (a live job holds it for the whole reindex).
+        """
+        with rag_store._writer(blocking=False) as free:
+            if not free:
+                return None
+            stale = time.time() - LEASE_S
+            with rag_store._get_db() as db:
+                rows = db.execute(
+                    "SELECT * FROM jobs WHERE status IN ('queued', 'running')"
+                    " AND (heartbeat IS NULL OR heartbeat < ?) ORDER BY created DESC",
+                    (stale,),
+                ).fetchall()
+                claimed = []
+                for r in rows:
+                    # Conditional, so two workers starting together claim each row once
+                    cur = db.execute(
+                        "UPDATE jobs SET status='interrupted', finished=? WHERE id=? AND status=?"
+                        " AND (heartbeat IS NULL OR heartbeat < ?)",
+                        (time.time(), r["id"], r["status"], stale),
+                    )
+                    if cur.rowcount:
+                        claimed.append(r)
+        if not claimed:
+            return None
+        last = claimed[0]
+        params = json.loads(last["params"] or "{}")
+        params["clean"] = False  # a clean run already wiped the old index; resume, don't restart
+        job_id, job = self.submit(params, resumed_from=last["id"])
+        logger.info(f"Resuming interrupted reindex {last['id']} as {job_id}")
+        return job
+
+
+jobs = JobManager()
+
+
+@RagJobRouter.on_event("startup")
+def resume_jobs():
+    try:
+        jobs.resume_interrupted()
+    except Exception as e:
+        logger.error(f"Could not resume interrupted reindex jobs: {e}")
+
+
+@RagJobRouter.post("/rag/reindex")
+async def rag_reindex(request: Request):
+    """
+    Start a background reindex of the local RAG index.
+
+    Body (all optional):
+      paths: ["/home/nova", ...]
+      clean: true|false
+      ignore_dirs: [...]
+      exclude_paths: [...]
+      ignore_root_files: [...]
+      batch_size: chunks per embedding batch (default 256)
+      gitignore: true|false — honour .gitignore files (default true)
+      wait: true|false — hold the request until the job finishes (default false)
+
+    Returns 202 {job_id, status}; 409 with the running job's id if one is active.
+    """
+    body = await request.json() if await request.body() else {}
+    params = {
+        "paths": body.get("paths") or [rag_store.BASE_DIR],
+        "clean": bool(body.get("clean", False)),
+        "ignore_dirs": list(body.get("ignore_dirs") or []),
+        "exclude_paths": list(body.get("exclude_paths") or []),
+        "ignore_root_files": list(body.get("ignore_root_files") or []),
+        "batch_size": int(body.get("batch_size") or rag_store.EMBED_BATCH_SIZE),
+        "gitignore": bool(body.get("gitignore", True)),
+    }
+    job_id, job = await run_io(jobs.submit, params)
+    if job is None:
+        return JSONResponse(status_code=409, content={"error": "reindex_in_progress", "job_id": job_id})
+    if body.get("wait"):
+        await run_io(job.done.wait)
+        return job.snapshot()
+    return JSONResponse(status_code=202, content={"job_id": job.id, "status": job.status})
+
+
+@RagJobRouter.get("/rag/jobs")
+def list_jobs():
+    return {"jobs": jobs.recent()}
+
+
+@RagJobRouter.get("/rag/jobs/{job_id}")
+def get_job(job_id: str):
+    snap = jobs.get(job_id)
+    if snap is None:
+        return JSONResponse(status_code=404, content={"error": "job_not_found"})
+    return snap
+
+
+@RagJobRouter.post("/rag/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "job_not_found"})
+    return {"job_id": job.id, "status": job.status, "cancel_requested": True}
+
+
+@RagJobRouter.websocket("/ws/rag/jobs/{job_id}")
+async def job_progress(ws: WebSocket, job_id: str):
+    """Push the job snapshot whenever it changes; closes once the job has finished."""
+    await ws.accept()
+    last = None
+    try:
+        while True:
+            snap = jobs.get(job_id)
+            if snap is None:
+                await ws.send_text(json.dumps({"job_id": job_id, "error": "job_not_found"}))
+                break
+            text = json.dumps(snap)
+            if text != last:
+                await ws.send_text(text)
+                last = text
+            if snap["status"] in TERMINAL:
+                break
+            await asyncio.sleep(WS_POLL_S)
+        await ws.close()
+    except WebSocketDisconnect:
+        logger.debug(f"Job progress websocket for {job_id} disconnected")
@@ -0,0 +1,36 @@
+# File: servers/rag_loader.py
+"""
+Read, hash and chunk one file for rag_store.reindex().
+
+This is what the utils.executor process pool runs, so it imports nothing but
+the chunkers: a worker that unpickles load_file() loads this module only, not
+rag_store with its embedding service, SQLite pool and executors.
+"""
+import os
+import hashlib
+from typing import List
+
+from .rag_chunkers import Chunk, chunk_file
+
+MAX_BYTES = 1_000_000
+
+
+def read_file(path: str, max_bytes: int = MAX_BYTES) -> bytes:
+    try:
+        with open(path, "rb") as f:
+            return f.read(max_bytes)
+    except Exception:
+        return b""
+
+
+def load_file(path: str, known_hash: str | None) -> tuple[str, str, List[Chunk] | None]:
+    """(path, content hash, chunks).
+
+    chunks is None when the hash matches `known_hash`, so unchanged files are
+    never chunked or embedded.
+    """
+    data = read_file(path)
+    digest = hashlib.sha1(data).hexdigest()
+    if digest == known_hash:
+        return path, digest, None
+    return path, digest, chunk_file(os.path.splitext(path)[1], data)
@@ -1,17 +1,38 @@
 # File: servers/rag_store.py
 import os
+import re
+import json
+import fcntl
+import stat
+import hashlib
 import sqlite3
+import threading
+import time
 import numpy as np
-from typing import List, Dict, Any, Iterable
-from .chat_memory_router import get_model as get_embed_model
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, List
+from .rag_chunkers import Chunk
+from .rag_loader import load_file
+from .rag_walker import IgnoreMatcher, walk
+from utils.embedding_service import embedder
+from utils.sqlite_pool import get_pool
+from utils.executor import cpu_executor, discard_cpu_pool, io_executor, run_io
+from utils.logger import logger, setup_logger
+from utils.embedding_codec import EMBED_DTYPE, encode_vector, decode_rows, decode_vector, quantize_matrix, score
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+
+setup_logger()
+logger = logger.bind(name="RAG")
 
 # --- Root locations ---
 BASE_DIR = os.path.expanduser('~/nova')
                 # Scan EVERYTHING under here (by default)
 VAULT_DIR = os.path.join(BASE_DIR, "vault") # Vault still used for DB location
 DB_PATH = os.path.join(VAULT_DIR, "rag.db")
+# Memory-mapped search matrix shared by every API worker (see _VectorIndex)
+INDEX_PREFIX = os.path.join(VAULT_DIR, "rag.index")
 
 # --- File/type filters ---
 ALLOWED_EXT = {
@@ -34,15 +55,44 @@ EXCLUDE_PATHS = {
 
 IGNORE_ROOT_FILES = {".gitignore"}
 
-# --- Chunking ---
-CHUNK_SIZE = 800
-OVERLAP = 200
+# --- Indexing pipeline ---
+EMBED_BATCH_SIZE = 256  # chunks per embedding request, across files
+READ_AHEAD = 64         # max files read but not yet handed to the encoder
+PROGRESS_EVERY = 200    # files walked between progress reports
+
+# --- Hybrid search ---
+RRF_K = 60              # reciprocal rank fusion damping constant
+FUSION_DEPTH = 50       # candidates taken from each ranker before fusing
+RERANK_FACTOR = 4       # rerank=True rescoring depth, as a multiple of top_k
+
+# Serialises writers (HTTP reindex, filesystem watcher, jobs) on rag.db and the
+# index: the thread lock within a process, an flock on WRITER_LOCK across the
+# API workers
+_write_lock = threading.Lock()
+WRITER_LOCK = DB_PATH + ".lock"
+
+
+@contextmanager
+def _writer(blocking: bool = True):
+    """Hold rag.db's single-writer lock; yields False if blocking=False and it is taken."""
+    if not _write_lock.acquire(blocking=blocking):
+        yield False
+        return
+    try:
+        os.makedirs(os.path.dirname(WRITER_LOCK), exist_ok=True)
+        with open(WRITER_LOCK, "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+    finally:
+        _write_lock.release()
 
 
-def _get_db():
-    os.makedirs(VAULT_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+def _prepare_schema(conn: sqlite3.Connection) -> None:
+    """Create/migrate rag.db; run once per process by the connection pool."""
     conn.execute(
         """
         CREATE TABLE IF NOT EXISTS chunks(
@@ -56,7 +106,522 @@ def _get_db():
         """
     )
     conn.execute("CREATE INDEX IF NOT EXISTS ix_chunks_path ON chunks(path)")
-    return conn
+    # Content-addressed vectors: identical chunk text is embedded and stored once.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS embed_cache(
+            hash TEXT PRIMARY KEY,
+            embedding BLOB,
+            dtype TEXT NOT NULL DEFAULT 'float32'
+        )
+        """
+    )
+    if "dtype" not in {r["name"] for r in conn.execute("PRAGMA table_info(embed_cache)")}:
+        conn.execute("ALTER TABLE embed_cache ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float32'")
+    # Bumped by every embed_cache write, in the writer's transaction. Each index
+    # generation records the version it reflects, so vectors committed by a run
+    # that died before publishing are noticed and added (_VectorIndex.publish).
+    conn.execute("CREATE TABLE IF NOT EXISTS index_state(id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)")
+    if conn.execute("SELECT 1 FROM index_state WHERE id = 0").fetchone() is None:
+        # (checked first: a no-op INSERT would still wait for a running reindex's write lock)
+        conn.execute("INSERT INTO index_state(id, version) VALUES (0, 0)")
+    conn.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS embed_cache_ai AFTER INSERT ON embed_cache BEGIN
+            UPDATE index_state SET version = version + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS embed_cache_ad AFTER DELETE ON embed_cache BEGIN
+            UPDATE index_state SET version = version + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS embed_cache_au AFTER UPDATE OF hash, embedding, dtype ON embed_cache BEGIN
+            UPDATE index_state SET version = version + 1;
+        END;
+        """
+    )
+    cols = {r["name"] for r in conn.execute("PRAGMA table_info(chunks)")}
+    if "chunk_hash" not in cols:
+        conn.execute("ALTER TABLE chunks ADD COLUMN chunk_hash TEXT")
+        _migrate_chunk_embeddings(conn)
+    # Where each chunk sits in its file (NULL for chunks written before these existed)
+    for col in ("start_byte", "end_byte", "line_start", "line_end"):
+        if col not in cols:
+            conn.execute(f"ALTER TABLE chunks ADD COLUMN {col} INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_chunks_hash ON chunks(chunk_hash)")
+    # One row per indexed file; lets reindex() decide staleness without touching chunks.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS files(
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            hash TEXT,
+            chunk_count INTEGER
+        )
+        """
+    )
+    # Background reindex jobs (servers/rag_jobs.py); survives restarts so a crashed job can resume.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs(
+            id TEXT PRIMARY KEY,
+            status TEXT,
+            params TEXT,
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            created REAL,
+            started REAL,
+            finished REAL
+        )
+        """
+    )
+    if "heartbeat" not in {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}:
+        # Refreshed while a job is queued/running; a stale one marks a job whose process died
+        conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+    _ensure_fts(conn)
+
+
+_pool = get_pool(DB_PATH, init=_prepare_schema)
+
+
+def _get_db() -> sqlite3.Connection:
+    """This thread's rag.db connection (WAL, so searches don't wait on reindex)."""
+    return _pool.connection()
+
+
+_fts_ok = True
+
+
+def _ensure_fts(conn: sqlite3.Connection) -> None:
+    """Keep an external-content FTS5 index over chunks(chunk, path) in sync via triggers,
+    so every reindex() write lands in both within the same transaction."""
+    global _fts_ok
+    if not _fts_ok:
+        return
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name='chunks_fts'").fetchone()
+    if exists:
+        return
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE chunks_fts USING fts5(chunk, path, content='chunks', content_rowid='id')"
+        )
+    except sqlite3.OperationalError:
+        # sqlite built without FTS5: lexical/hybrid modes degrade to vector search
+        _fts_ok = False
+        return
+    conn.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_ai AFTER INSERT ON chunks BEGIN
+            INSERT INTO chunks_fts(rowid, chunk, path) VALUES (new.id, new.chunk, new.path);
+        END;
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_ad AFTER DELETE ON chunks BEGIN
+            INSERT INTO chunks_fts(chunks_fts, rowid, chunk, path) VALUES ('delete', old.id, old.chunk, old.path);
+        END;
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_au AFTER UPDATE OF chunk, path ON chunks BEGIN
+            INSERT INTO chunks_fts(chunks_fts, rowid, chunk, path) VALUES ('delete', old.id, old.chunk, old.path);
+            INSERT INTO chunks_fts(rowid, chunk, path) VALUES (new.id, new.chunk, new.path);
+        END;
+        INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild');
+        """
+    )
+
+
+def _chunk_hash(chunk: str) -> str:
+    return hashlib.sha1(chunk.encode("utf-8", "ignore")).hexdigest()
+
+
+def _migrate_chunk_embeddings(conn: sqlite3.Connection) -> None:
+    """Move per-row embeddings from chunks into embed_cache (one-off upgrade)."""
+    rows = conn.execute("SELECT id, chunk, embedding FROM chunks WHERE embedding IS NOT NULL").fetchall()
+    keyed = [(r["id"], _chunk_hash(r["chunk"] or ""), r["embedding"]) for r in rows]
+    conn.executemany(
+        "INSERT OR IGNORE INTO embed_cache(hash, embedding) VALUES (?,?)",
+        [(h, emb) for _, h, emb in keyed],
+    )
+    conn.executemany(
+        "UPDATE chunks SET chunk_hash=?, embedding=NULL WHERE id=?",
+        [(h, cid) for cid, h, _ in keyed],
+    )
+    conn.commit()
+
+
+def _load_manifest(db: sqlite3.Connection) -> Dict[str, tuple]:
+    """Return {path: (size, mtime, hash, chunk_count)} in a single query.
+
+    Databases created before the manifest existed are seeded from chunks, with
+    unknown size/hash, so an upgrade does not force a full re-embed.
+    """
+    rows = db.execute("SELECT path, size, mtime, hash, chunk_count FROM files").fetchall()
+    if not rows:
+        rows = db.execute(
+            "SELECT path, NULL AS size, MAX(mtime) AS mtime, NULL AS hash, COUNT(*) AS chunk_count"
+            " FROM chunks GROUP BY path"
+        ).fetchall()
+    return {r["path"]: (r["size"], r["mtime"], r["hash"], r["chunk_count"]) for r in rows}
+
+
+@contextmanager
+def _read_snapshot(db: sqlite3.Connection):
+    """Run the block's reads in one transaction (one WAL snapshot), unless one is already open."""
+    if db.in_transaction:
+        yield
+        return
+    db.execute("BEGIN")
+    try:
+        yield
+    finally:
+        db.commit()
+
+
+class _VectorIndex:
+    """Search matrix of every cached embedding, memory-mapped from next to rag.db.
+
+    Rows live in append-only files per epoch -- rag.index.e<epoch>.keys (hash
+    keys, the id map), .vecs (pre-normalised rows in EMBED_DTYPE) and, for
+    int8, .scales. A generation is a small manifest, rag.index.<gen>.json,
+    naming the epoch and how many of its rows are published, plus
+    rag.index.<gen>.dead.npy listing tombstoned rows. `rag.index.gen` holds
+    the current generation and is swapped with os.replace(), so readers in
+    any process see either the old or the new generation, never a
+    half-written one. Every uvicorn worker maps the same files and shares
+    pages through the OS cache; a search notices a new generation by
+    stat()ing the pointer file.
+
+    Publishing appends new rows past the published count and tombstones
+    evicted ones, so a reindex costs what it changed, not the matrix size; a
+    run that changed nothing publishes nothing. Once more than
+    COMPACT_RATIO of the rows are dead, the live rows are copied into a new
+    epoch. Readers of an older generation are unaffected either way: rows
+    they can see are never rewritten.
+
+    Each manifest also records the embed_cache version (index_state) it
+    reflects. A publish whose caller started from a different version than
+    the current generation's -- a reindex that crashed after committing
+    vectors but before publishing, another process's writes -- diffs the
+    index against embed_cache instead of trusting the caller's lists, and
+    searches trigger that repair themselves when no writer is running.
+
+    Rows are keyed by chunk hash, so duplicated chunk text occupies one live
+    row and can only ever produce one hit.
+    """
+
+    COPY_BLOCK = 50_000
+    COMPACT_RATIO = 0.25   # dead share of rows that triggers a compaction
+    COMPACT_MIN = 1_000    # ...once at least this many rows are dead
+    KEY_DTYPE = np.dtype("S40")
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.gen_file = prefix + ".gen"
+        self._lock = threading.Lock()
+        self._sig: tuple | None = None
+        self._pos: Dict[str, int] | None = None
+        self.keys = np.empty(0, dtype=self.KEY_DTYPE)
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self.scales: np.ndarray | None = None
+        self.dead = np.empty(0, dtype=np.int64)
+
+    # --- files ---
+    def _manifest_path(self, gen: int) -> str:
+        return f"{self.prefix}.{gen}.json"
+
+    def _dead_path(self, gen: int) -> str:
+        return f"{self.prefix}.{gen}.dead.npy"
+
+    def _epoch_paths(self, epoch: int) -> tuple[str, str, str]:
+        base = f"{self.prefix}.e{epoch}"
+        return base + ".keys", base + ".vecs", base + ".scales"
+
+    def _pointer(self) -> tuple[tuple, int] | None:
+        try:
+            st = os.stat(self.gen_file)
+            with open(self.gen_file) as f:
+                return (st.st_ino, st.st_mtime_ns, st.st_size), int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _manifest(self, gen: int) -> Dict[str, Any] | None:
+        try:
+            with open(self._manifest_path(gen)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None   # missing, or written by an older version of this index
+
+    def _open(self, gen: int, m: Dict[str, Any]):
+        n, dim = m["rows"], m["dim"]
+        kp, vp, sp = self._epoch_paths(m["epoch"])
+        vdtype = np.dtype(m["vec_dtype"])
+        if n:
+            keys = np.memmap(kp, dtype=self.KEY_DTYPE, mode="r", shape=(n,))
+            mat = np.memmap(vp, dtype=vdtype, mode="r", shape=(n, dim))
+            scales = np.memmap(sp, dtype=np.float32, mode="r", shape=(n,)) if m["scaled"] else None
+        else:
+            keys, mat = np.empty(0, dtype=self.KEY_DTYPE), np.empty((0, dim), dtype=vdtype)
+            scales = np.empty(0, dtype=np.float32) if m["scaled"] else None
+        dead = np.load(self._dead_path(gen)) if m["dead"] else np.empty(0, dtype=np.int64)
+        return keys, mat, scales, dead
+
+    @staticmethod
+    def db_version(db: sqlite3.Connection) -> int:
+        row = db.execute("SELECT version FROM index_state WHERE id = 0").fetchone()
+        return row[0] if row else 0
+
+    def published_version(self) -> int | None:
+        """embed_cache version the current generation reflects (None: no index, or unknown)."""
+        ptr = self._pointer()
+        m = self._manifest(ptr[1]) if ptr else None
+        return m.get("version") if m else None
+
+    # --- readers ---
+    def ensure_loaded(self, db: sqlite3.Connection) -> None:
+        ptr = self._pointer()
+        if ptr is None or self._manifest(ptr[1]) is None:
+            self.publish(db, rebuild=True)
+            ptr = self._pointer()
+        elif self.published_version() != self.db_version(db):
+            # Behind embed_cache. While a writer runs that is expected (it publishes
+            # when done); otherwise a run died before publishing, so repair now.
+            with _writer(blocking=False) as acquired:
+                if acquired:
+                    self.publish(db)
+            ptr = self._pointer()
+        if ptr is None or ptr[0] == self._sig:
+            return
+        sig, gen = ptr
+        m = self._manifest(gen)
+        try:
+            if m is None:
+                raise FileNotFoundError(gen)
+            keys, mat, scales, dead = self._open(gen, m)
+        except FileNotFoundError:
+            # Writer replaced the generation between our stat and open; retry next search
+            return
+        with self._lock:
+            self.keys, self.matrix, self.scales, self.dead = keys, mat, scales, dead
+            self._sig, self._pos = sig, None
+
+    def rows_for(self, hashes: List[str]) -> np.ndarray:
+        """Live matrix row numbers for the given hashes (unknown ones are skipped)."""
+        with self._lock:
+            if self._pos is None:
+                live = np.ones(len(self.keys), dtype=bool)
+                live[self.dead] = False
+                self._pos = {self.keys[i].decode(): int(i) for i in np.flatnonzero(live)}
+            pos = self._pos
+        return np.asarray([pos[h] for h in hashes if h in pos], dtype=np.int64)
+
+    def snapshot(self) -> tuple[np.ndarray, np.ndarray, np.ndarray | None, np.ndarray]:
+        """(keys, matrix, scales, dead rows) of the loaded generation."""
+        with self._lock:
+            return self.keys, self.matrix, self.scales, self.dead
+
+    # --- writer ---
+    @staticmethod
+    def _normalize(mat: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (mat / norms).astype(np.float32, copy=False)
+
+    @staticmethod
+    def _probe():
+        """(row dtype, scaled?) of EMBED_DTYPE's in-RAM format."""
+        mat, scales = quantize_matrix(np.zeros((1, 1), dtype=np.float32), EMBED_DTYPE)
+        return mat.dtype, scales is not None
+
+    def _append(self, m: Dict[str, Any], new_keys: List[str], embs: np.ndarray) -> int:
+        """Write rows after the first m["rows"] of m's epoch; returns how many were written."""
+        kp, vp, sp = self._epoch_paths(m["epoch"])
+        vdtype = np.dtype(m["vec_dtype"])
+        n, dim = m["rows"], m["dim"]
+        files = [(kp, self.KEY_DTYPE.itemsize), (vp, vdtype.itemsize * dim)]
+        if m["scaled"]:
+            files.append((sp, 4))
+        handles = [open(path, "ab") for path, _ in files]
+        try:
+            # Drop anything past the published rows (left by a publish that never swapped in)
+            for f, (_, width) in zip(handles, files):
+                f.truncate(n * width)
+            for i in range(0, len(new_keys), self.COPY_BLOCK):
+                mat, sc = quantize_matrix(self._normalize(embs[i:i + self.COPY_BLOCK]), EMBED_DTYPE)
+                handles[0].write(np.asarray(new_keys[i:i + self.COPY_BLOCK], dtype=self.KEY_DTYPE).tobytes())
+                handles[1].write(np.ascontiguousarray(mat, dtype=vdtype).tobytes())
+                if m["scaled"]:
+                    handles[2].write(sc.astype(np.float32).tobytes())
+        finally:
+            for f in handles:
+                f.close()
+        return len(new_keys)
+
+    def _new_epoch(self, m: Dict[str, Any] | None, dim: int) -> Dict[str, Any]:
+        vdtype, scaled = self._probe()
+        epoch = (m["epoch"] + 1) if m else 1
+        while os.path.exists(self._epoch_paths(epoch)[0]):
+            epoch += 1
+        for path in self._epoch_paths(epoch):
+            open(path, "wb").close()
+        return {"epoch": epoch, "rows": 0, "dim": dim, "vec_dtype": vdtype.str, "scaled": scaled, "dead": 0}
+
+    def _rebuild(self, db: sqlite3.Connection, m: Dict[str, Any] | None) -> Dict[str, Any]:
+        """A new epoch holding every embed_cache row."""
+        first = db.execute("SELECT embedding, dtype FROM embed_cache LIMIT 1").fetchone()
+        dim = len(decode_vector(first["embedding"], first["dtype"])) if first else 0
+        out = self._new_epoch(m, dim)
+        cur = db.execute("SELECT hash, embedding, dtype FROM embed_cache")
+        while True:
+            rows = cur.fetchmany(self.COPY_BLOCK)
+            if not rows:
+                break
+            out["rows"] += self._append(out, [r["hash"] for r in rows],
+                                        decode_rows((r["embedding"], r["dtype"]) for r in rows))
+        return out
+
+    def _diff(self, db: sqlite3.Connection, live_keys: np.ndarray):
+        """(removed keys, added keys, their vectors) that bring the index in line with embed_cache."""
+        indexed = {k.decode() for k in live_keys}
+        cached = [r[0] for r in db.execute("SELECT hash FROM embed_cache")]
+        removed = list(indexed.difference(cached))
+        missing = [h for h in cached if h not in indexed]
+        added, vecs = [], []
+        for i in range(0, len(missing), 500):
+            part = missing[i:i + 500]
+            rows = db.execute(
+                f"SELECT hash, embedding, dtype FROM embed_cache WHERE hash IN ({','.join('?' * len(part))})", part
+            ).fetchall()
+            added += [r["hash"] for r in rows]
+            vecs.append(decode_rows((r["embedding"], r["dtype"]) for r in rows))
+        if removed or added:
+            logger.warning(f"Vector index was out of step with embed_cache: +{len(added)} -{len(removed)} rows")
+        return removed, added, (np.vstack(vecs) if added else None)
+
+    def _compact(self, m: Dict[str, Any], keys, mat, scales, dead: np.ndarray) -> Dict[str, Any]:
+        """A new epoch holding only the live rows of m (copied as stored, not re-quantized)."""
+        out = self._new_epoch(m, m["dim"])
+        live = np.ones(len(keys), dtype=bool)
+        live[dead] = False
+        idx = np.flatnonzero(live)
+        kp, vp, sp = self._epoch_paths(out["epoch"])
+        with open(kp, "ab") as fk, open(vp, "ab") as fv, open(sp, "ab") as fs:
+            for i in range(0, len(idx), self.COPY_BLOCK):
+                block = idx[i:i + self.COPY_BLOCK]
+                fk.write(np.ascontiguousarray(keys[block]).tobytes())
+                fv.write(np.ascontiguousarray(mat[block]).tobytes())
+                if scales is not None:
+                    fs.write(np.ascontiguousarray(scales[block]).tobytes())
+        out["rows"] = len(idx)
+        return out
+
+    def publish(
+        self,
+        db: sqlite3.Connection,
+        removed_keys: List[str] | None = None,
+        added_keys: List[str] | None = None,
+        added_embs: List[np.ndarray] | None = None,
+        rebuild: bool = False,
+        base_version: int | None = None,
+    ) -> bool:
+        """Apply a reindex's changes as the next generation; returns whether one was published.
+
+        New keys are appended and removed keys tombstoned. The lists are only
+        trusted when `base_version` (the embed_cache version the caller started
+        from) is the one the current generation reflects; otherwise the index
+        is diffed against embed_cache. rebuild=True (first use, clean reindex,
+        dtype or dimension change) re-reads embed_cache into a new epoch.
+        Call with rag.db's writer lock held, or with nothing to publish.
+        """
+        os.makedirs(os.path.dirname(self.prefix), exist_ok=True)
+        with open(self.prefix + ".lock", "w") as lock_file, _read_snapshot(db):
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            version = self.db_version(db)
+            ptr = self._pointer()
+            gen = ptr[1] + 1 if ptr else 1
+            m = self._manifest(ptr[1]) if ptr else None
+            vdtype, scaled = self._probe()
+            if m is None or m["vec_dtype"] != vdtype.str or m["scaled"] != scaled:
+                rebuild = True
+
+            out = None
+            if not rebuild:
+                keys, mat, scales, dead = self._open(ptr[1], m)
+                live = np.ones(len(keys), dtype=bool)
+                live[dead] = False
+                if base_version is None or m.get("version") != base_version:
+                    removed_keys, new_keys, embs = self._diff(db, keys[live])
+                else:
+                    new_keys = list(added_keys or [])
+                    embs = np.vstack(added_embs).astype(np.float32, copy=False) if new_keys else None
+                if new_keys and m["rows"] and embs.shape[1] != m["dim"]:
+                    rebuild = True   # embedding model changed
+                else:
+                    kill = np.empty(0, dtype=np.int64)
+                    if removed_keys and len(keys):
+                        kill = np.flatnonzero(live & np.isin(keys, np.asarray(removed_keys, dtype=self.KEY_DTYPE)))
+                    if new_keys and len(keys):
+                        # Another worker may already have published some of these
+                        fresh = ~np.isin(np.asarray(new_keys, dtype=self.KEY_DTYPE), keys[live])
+                        new_keys = [k for k, f in zip(new_keys, fresh) if f]
+                        embs = embs[fresh]
+                    if not len(kill) and not new_keys:
+                        if m.get("version") != version:
+                            # Same rows; just record that they are current
+                            self._write_manifest(ptr[1], dict(m, version=version))
+                        return False
+                    dead = np.union1d(dead, kill).astype(np.int64)
+                    out = dict(m, dead=len(dead))
+                    if not m["rows"] and new_keys:
+                        out["dim"] = embs.shape[1]
+                    if new_keys:
+                        out["rows"] += self._append(out, new_keys, embs)
+                    if len(dead) >= self.COMPACT_MIN and len(dead) > self.COMPACT_RATIO * out["rows"]:
+                        keys, mat, scales, _ = self._open(ptr[1], dict(out, dead=0))
+                        out = self._compact(out, keys, mat, scales, dead)
+                        del keys, mat, scales
+                    elif len(dead):
+                        np.save(self._dead_path(gen), dead)
+            if rebuild:
+                out = self._rebuild(db, m)
+
+            out["version"] = version
+            self._write_manifest(gen, out)
+            tmp = f"{self.gen_file}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(str(gen))
+            os.replace(tmp, self.gen_file)
+            self._cleanup(gen, out["epoch"], m["epoch"] if m else None)
+            return True
+
+    def _write_manifest(self, gen: int, m: Dict[str, Any]) -> None:
+        tmp = f"{self._manifest_path(gen)}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(m, f)
+        os.replace(tmp, self._manifest_path(gen))
+
+    def _cleanup(self, gen: int, epoch: int, prev_epoch: int | None) -> None:
+        """Keep the previous generation for readers mid-search; drop older ones and unused epochs."""
+        doomed = []
+        for old in range(max(0, gen - 10), gen - 1):
+            doomed += [self._manifest_path(old), self._dead_path(old)]
+            # files of the pre-epoch layout
+            doomed += [f"{self.prefix}.{old}.{part}.npy" for part in ("keys", "vecs", "scales")]
+        keep = {epoch, prev_epoch}
+        folder, name = os.path.split(self.prefix)
+        for entry in os.listdir(folder):
+            m = re.fullmatch(re.escape(name) + r"\.e(\d+)\.(keys|vecs|scales)", entry)
+            if m and int(m.group(1)) not in keep:
+                doomed.append(os.path.join(folder, entry))
+        for path in doomed:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+_index = _VectorIndex(INDEX_PREFIX)
+
+
+def index_generation() -> int:
+    """The published index generation (0 before the first publish); changes whenever the index does."""
+    ptr = _index._pointer()
+    return ptr[1] if ptr else 0
 
 
 def _iter_files(
@@ -65,61 +630,67 @@ def _iter_files(
     ignore_dirs: set | None = None,
     exclude_paths: set | None = None,
     ignore_root_files: set | None = None,
-) -> Iterable[str]:
-    """Yield files to index under the provided paths (defaults to BASE_DIR)."""
+    gitignore: bool = True,
+) -> Iterable[tuple[str, os.stat_result]]:
+    """Yield (path, stat) for files to index under the provided paths (defaults to BASE_DIR).
+
+    Streams from the parallel scandir walker in rag_walker; .gitignore rules are
+    honoured unless gitignore=False.
+    """
     if paths is None:
         paths = [BASE_DIR]
 
-    eff_ignore_dirs = set(IGNORE_DIRS) | set(ignore_dirs or set())
-    eff_exclude_paths = set(EXCLUDE_PATHS) | set(exclude_paths or set())
-    eff_ignore_root_files = set(IGNORE_ROOT_FILES) | set(ignore_root_files or set())
+    seen: set[str] = set()
+    for path, st in walk(
+        paths,
+        allowed_ext=ALLOWED_EXT,
+        ignore_dirs=set(IGNORE_DIRS) | set(ignore_dirs or set()),
+        exclude_paths=set(EXCLUDE_PATHS) | set(exclude_paths or set()),
+        ignore_root_files=set(IGNORE_ROOT_FILES) | set(ignore_root_files or set()),
+        base_dir=BASE_DIR,
+        gitignore=gitignore,
+    ):
+        if path not in seen:
+            seen.add(path)
+            yield path, st
 
-    base_abs = os.path.abspath(BASE_DIR)
 
-    seen: set[str] = set()
-    for root in paths:
-        if not os.path.exists(root):
-            continue
-        for dirpath, dirnames, filenames in os.walk(root):
-            # Skip entire excluded subtrees
-            if any(os.path.abspath(dirpath).startswith(os.path.abspath(p)) for p in eff_exclude_paths):
-                dirnames[:] = []
-                continue
+_matcher = IgnoreMatcher(
+    allowed_ext=ALLOWED_EXT,
+    ignore_dirs=IGNORE_DIRS,
+    exclude_paths=EXCLUDE_PATHS,
+    ignore_root_files=IGNORE_ROOT_FILES,
+    base_dir=BASE_DIR,
+)
 
-            # Prune noisy dirs in-place
-            dirnames[:] = [d for d in dirnames if d not in eff_ignore_dirs]
 
-            for fn in filenames:
-                # Optionally ignore specific files at the BASE_DIR root
-                if os.path.abspath(dirpath) == base_abs and fn in eff_ignore_root_files:
-                    continue
+def _is_indexable(path: str, roots: List[str] | None = None) -> bool:
+    """Single-path version of the _iter_files filters, .gitignore included (used for watcher events)."""
+    return _matcher.indexable(path, roots or [BASE_DIR])
 
-                p = os.path.join(dirpath, fn)
-                ext = os.path.splitext(p)[1].lower()
-                if ext in ALLOWED_EXT and p not in seen:
-                    seen.add(p)
-                    yield p
 
+def _stat_files(files: List[str]) -> Iterable[tuple[str, os.stat_result]]:
+    for f in dict.fromkeys(files):
+        try:
+            st = os.stat(f)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            yield f, st
 
-def _read_file(path: str, max_bytes: int = 1_000_000) -> str:
-    try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read(max_bytes)
-    except Exception:
-        return ""
 
+def _under(path: str, roots: List[str]) -> bool:
+    return any(path == r or path.startswith(r.rstrip(os.sep) + os.sep) for r in roots)
 
-def _chunk_text(t: str, size: int = CHUNK_SIZE, overlap: int = OVERLAP) -> list[str]:
-    if not t:
-        return []
-    chunks = []
-    i = 0
-    n = len(t)
-    step = max(1, size - overlap)
-    while i < n:
-        chunks.append(t[i : i + size])
-        i += step
-    return chunks
+
+def _next_chunk_id(db: sqlite3.Connection) -> int:
+    """First unused chunks.id, honouring AUTOINCREMENT's never-reuse guarantee."""
+    row = db.execute(
+        "SELECT MAX(m) AS m FROM ("
+        " SELECT MAX(id) AS m FROM chunks"
+        " UNION ALL SELECT seq FROM sqlite_sequence WHERE name='chunks')"
+    ).fetchone()
+    return int(row["m"] or 0) + 1
 
 
 def reindex(
@@ -129,95 +700,407 @@ def reindex(
     ignore_dirs: set | None = None,
     exclude_paths: set | None = None,
     ignore_root_files: set | None = None,
+    batch_size: int = EMBED_BATCH_SIZE,
+    files: List[str] | None = None,
+    gitignore: bool = True,
+    progress: Callable[[Dict[str, Any]], None] | None = None,
+    cancel: threading.Event | None = None,
 ) -> Dict[str, Any]:
     """Index text/code across /home/nova by default, writing to vault/rag.db.
     Pass optional overrides for ignores. Safe to re-run; skips up-to-date files.
+    Pass `files` to index just those paths instead of walking `paths`; any of
+    them that no longer exist are pruned.
+
+    Staleness comes from the `files` manifest, loaded once per run: a matching
+    size/mtime skips the file outright, and a touched file whose content hash
+    is unchanged is not re-embedded. Manifest entries under the walked roots
+    that no longer exist on disk have their chunks pruned.
+
+    Files are read and chunked in utils.executor's worker processes while the
+    calling thread encodes fixed-size batches of chunks (spanning files) and writes each
+    batch with a single executemany + commit.
+
+    `progress` is called with running counters after every batch (and every
+    PROGRESS_EVERY files walked). Setting `cancel` stops the run at the next
+    file or batch boundary with status "cancelled"; everything committed so far
+    stays in the manifest, so the next run picks up where this one stopped.
     """
-    model = get_embed_model()
+    batch_size = max(1, int(batch_size or EMBED_BATCH_SIZE))
     files_processed = 0
+    files_skipped = 0
+    files_pruned = 0
     chunks_indexed = 0
+    chunks_embedded = 0
+    added_keys: List[str] = []
+    added_embs: List[np.ndarray] = []
+    pending: List[tuple[str, float, int, Chunk]] = []  # (path, mtime, chunk_index, chunk)
+    stats: Dict[str, tuple] = {}                     # path -> (size, mtime) from the walk
+    started = time.perf_counter()
+    scanned = 0
+    expected: int | None = len(files) if files is not None else None
 
-    with _get_db() as db:
+    def report() -> None:
+        if progress:
+            progress({
+                "files_scanned": scanned,
+                "files_expected": expected,
+                "files_processed": files_processed,
+                "files_skipped": files_skipped,
+                "chunks_indexed": chunks_indexed,
+                "chunks_embedded": chunks_embedded,
+                "elapsed_s": round(time.perf_counter() - started, 3),
+            })
+
+    def cancelled() -> bool:
+        return cancel is not None and cancel.is_set()
+
+    def drop_chunks(db: sqlite3.Connection, path: str) -> None:
+        db.execute("DELETE FROM chunks WHERE path=?", (path,))
+
+    def upsert_manifest(db: sqlite3.Connection, path: str, digest: str, count: int) -> None:
+        size, mtime = stats.pop(path)
+        db.execute(
+            "INSERT OR REPLACE INTO files(path, size, mtime, hash, chunk_count) VALUES (?,?,?,?,?)",
+            (path, size, mtime, digest, count),
+        )
+
+    if files is not None:
+        source: Iterable[tuple[str, os.stat_result]] = _stat_files(files)
+    else:
+        source = _iter_files(
+            paths,
+            ignore_dirs=ignore_dirs,
+            exclude_paths=exclude_paths,
+            ignore_root_files=ignore_root_files,
+            gitignore=gitignore,
+        )
+
+    with _writer(), _get_db() as db:
+        base_version = _index.db_version(db)
         if clean:
             db.execute("DELETE FROM chunks")
-        for path in _iter_files(paths, ignore_dirs=ignore_dirs, exclude_paths=exclude_paths, ignore_root_files=ignore_root_files):
+            db.execute("DELETE FROM files")
+            db.execute("DELETE FROM embed_cache")
+        manifest = _load_manifest(db)
+        if expected is None:
+            # last run's file count under these roots: good enough for an ETA
+            roots = [os.path.abspath(p) for p in (paths or [BASE_DIR])]
+            expected = sum(1 for p in manifest if _under(os.path.abspath(p), roots)) or None
+        next_id = _next_chunk_id(db)
+        # path -> (hash, chunk_count); the manifest row is written with the file's last chunk
+        awaiting: Dict[str, tuple[str, int]] = {}
+
+        def flush(n: int) -> None:
+            nonlocal next_id, chunks_indexed, chunks_embedded
+            batch = pending[:n]
+            del pending[:n]
+            hashes = [_chunk_hash(b[3].text) for b in batch]
+
+            # Only text whose hash is not cached yet goes through the model
+            uniq = list(dict.fromkeys(hashes))
+            marks = ",".join("?" * len(uniq))
+            cached = {r["hash"] for r in db.execute(f"SELECT hash FROM embed_cache WHERE hash IN ({marks})", uniq)}
+            text_for = {h: b[3].text for h, b in zip(hashes, batch)}
+            missing = [h for h in uniq if h not in cached]
+            if missing:
+                embs = embedder.encode([text_for[h] for h in missing])
+                db.executemany(
+                    "INSERT INTO embed_cache(hash, embedding, dtype) VALUES (?,?,?)",
+                    [(h, sqlite3.Binary(encode_vector(vec, EMBED_DTYPE)), EMBED_DTYPE) for h, vec in zip(missing, embs)],
+                )
+                added_keys.extend(missing)
+                added_embs.append(embs)
+                chunks_embedded += len(missing)
+
+            rows = []
+            for (path, mtime, idx, ck), h in zip(batch, hashes):
+                rows.append((next_id, path, mtime, idx, ck.text, h, ck.start_byte, ck.end_byte, ck.line_start, ck.line_end))
+                next_id += 1
+            db.executemany(
+                "INSERT INTO chunks(id, path, mtime, chunk_index, chunk, chunk_hash, start_byte, end_byte, line_start, line_end)"
+                " VALUES (?,?,?,?,?,?,?,?,?,?)",
+                rows,
+            )
+            for path, _, idx, _ in batch:
+                digest, count = awaiting.get(path, (None, 0))
+                if idx == count - 1:
+                    awaiting.pop(path)
+                    upsert_manifest(db, path, digest, count)
+            db.commit()
+            chunks_indexed += len(rows)
+            report()
+
+        # reading + chunking is CPU-bound pure Python: run it in worker processes
+        # (rag_loader, which imports only the chunkers). If a worker dies the
+        # pool breaks; the rest of the run falls back to threads.
+        pool = cpu_executor()
+
+        def fall_back(broken) -> None:
+            nonlocal pool
+            if pool is broken:
+                logger.warning("Chunking process pool broke; continuing this reindex on threads")
+                discard_cpu_pool(broken)
+                pool = io_executor()
+
+        def submit(path: str, known_hash: str | None) -> None:
             try:
-                mtime = os.path.getmtime(path)
-            except FileNotFoundError:
-                continue
-            # Skip up-to-date files
-            row = db.execute("SELECT MAX(mtime) as m FROM chunks WHERE path=?", (path,)).fetchone()
-            if row and row["m"] and row["m"] >= mtime:
-                continue
-            db.execute("DELETE FROM chunks WHERE path=?", (path,))
+                fut = pool.submit(load_file, path, known_hash)
+            except BrokenProcessPool:
+                fall_back(pool)
+                fut = pool.submit(load_file, path, known_hash)
+            inflight.append((path, known_hash, pool, fut))
 
-            text = _read_file(path)
-            parts = _chunk_text(text)
+        def drain(entry) -> None:
+            nonlocal files_processed, files_skipped
+            path, known_hash, used, fut = entry
+            try:
+                path, digest, parts = fut.result()
+            except BrokenProcessPool:
+                fall_back(used)
+                path, digest, parts = load_file(path, known_hash)
+            if parts is None:
+                # Touched but byte-identical: refresh size/mtime only
+                upsert_manifest(db, path, digest, manifest[path][3])
+                files_skipped += 1
+                return
+            drop_chunks(db, path)
             if not parts:
+                upsert_manifest(db, path, digest, 0)
+                return
+            mtime = stats[path][1]
+            awaiting[path] = (digest, len(parts))
+            pending.extend((path, mtime, idx, ck) for idx, ck in enumerate(parts))
+            files_processed += 1
+            while len(pending) >= batch_size and not cancelled():
+                flush(batch_size)
+
+        seen: set[str] = set()
+        inflight: deque = deque()
+        for path, st in source:
+            if cancelled():
+                break
+            seen.add(path)
+            scanned += 1
+            if scanned % PROGRESS_EVERY == 0:
+                report()
+            known = manifest.get(path)
+            # Any mtime change counts, backwards too (a restored or checked-out older file);
+            # the stored hash then decides whether it is actually re-embedded
+            if known and known[1] == st.st_mtime and known[0] in (None, st.st_size):
+                if known[0] is None:
+                    # Legacy row seeded from chunks; record its size, leave the hash unknown
+                    db.execute(
+                        "INSERT OR REPLACE INTO files(path, size, mtime, hash, chunk_count) VALUES (?,?,?,?,?)",
+                        (path, st.st_size, known[1], None, known[3]),
+                    )
+                files_skipped += 1
                 continue
 
-            embs = model.encode(parts)
-            for idx, (ck, emb) in enumerate(zip(parts, embs)):
-                db.execute(
-                    "INSERT INTO chunks(path, mtime, chunk_index, chunk, embedding) VALUES (?,?,?,?,?)",
-                    (path, mtime, idx, ck, sqlite3.Binary(np.array(emb, dtype=np.float32).tobytes())),
-                )
-                chunks_indexed += 1
-            files_processed += 1
+            stats[path] = (st.st_size, st.st_mtime)
+            submit(path, known[2] if known else None)
+            while len(inflight) >= READ_AHEAD or (inflight and inflight[0][3].done()):
+                drain(inflight.popleft())
+
+        if cancelled():
+            # Unfinished files have no manifest row yet, so they are redone next run
+            for *_, fut in inflight:
+                fut.cancel()
+            inflight.clear()
+            pending.clear()
+        while inflight:
+            drain(inflight.popleft())
+        if pending:
+            flush(len(pending))
+
+        # Prune files that vanished from disk under the roots we just walked
+        # (not after a cancel: the walk is incomplete, so `seen` is too)
+        if cancelled():
+            gone = []
+        elif files is not None:
+            gone = [p for p in dict.fromkeys(files) if p not in seen and p in manifest]
+        else:
+            roots = [os.path.abspath(p) for p in (paths or [BASE_DIR])]
+            gone = [p for p in manifest if p not in seen and _under(os.path.abspath(p), roots)]
+        for path in gone:
+            drop_chunks(db, path)
+            db.execute("DELETE FROM files WHERE path=?", (path,))
+            files_pruned += 1
+
+        # Evict cached vectors no chunk refers to any more
+        evicted = [
+            r["hash"] for r in db.execute(
+                "SELECT hash FROM embed_cache WHERE hash NOT IN"
+                " (SELECT chunk_hash FROM chunks WHERE chunk_hash IS NOT NULL)"
+            )
+        ]
+        if evicted:
+            db.executemany("DELETE FROM embed_cache WHERE hash=?", [(h,) for h in evicted])
         db.commit()
 
-    return {"status": "ok", "files_processed": files_processed, "chunks_indexed": chunks_indexed}
+        if clean or added_keys or evicted or _index.published_version() != base_version:
+            _index.publish(db, evicted, added_keys, added_embs, rebuild=clean, base_version=base_version)
 
+    report()
+    elapsed = time.perf_counter() - started
+    return {
+        "status": "cancelled" if cancelled() else "ok",
+        "files_scanned": scanned,
+        "files_processed": files_processed,
+        "files_skipped": files_skipped,
+        "files_pruned": files_pruned,
+        "chunks_indexed": chunks_indexed,
+        "chunks_embedded": chunks_embedded,
+        "batch_size": batch_size,
+        "elapsed_s": round(elapsed, 3),
+        "chunks_per_s": round(chunks_indexed / elapsed, 1) if elapsed > 0 else 0.0,
+    }
 
-def search(query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-    model = get_embed_model()
-    q = np.array(model.encode(query), dtype=np.float32)
-    with _get_db() as db:
-        rows = db.execute("SELECT path, chunk, embedding FROM chunks").fetchall()
-    scored = []
-    qn = float(np.linalg.norm(q))
-    for r in rows:
-        emb = np.frombuffer(r["embedding"], dtype=np.float32)
-        denom = qn * float(np.linalg.norm(emb))
-        score = float(np.dot(q, emb) / denom) if denom else 0.0
-        scored.append((score, r["path"], r["chunk"]))
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [{"score": s, "path": p, "content": c} for s, p, c in scored[:top_k]]
 
+def _fts_query(query: str) -> str:
+    """Build an FTS5 OR-query; identifiers become phrases of their parts so
+    `_pick_client_id` or `rag_store.py` match the way unicode61 tokenises them."""
+    terms = []
+    for word in re.findall(r"[\w.\-/]+", query or ""):
+        parts = [p for p in re.split(r"[^0-9A-Za-z]+", word) if p]
+        if parts:
+            terms.append('"' + " ".join(parts) + '"')
+    return " OR ".join(dict.fromkeys(terms))
 
 
-RagRouter = APIRouter()
+def _lexical(db: sqlite3.Connection, query: str, limit: int) -> List[str]:
+    """Chunk hashes ranked by BM25 (best first), one entry per distinct text."""
+    match = _fts_query(query)
+    if not _fts_ok or not match:
+        return []
+    rows = db.execute(
+        "SELECT c.chunk_hash FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.rowid"
+        " WHERE chunks_fts MATCH ? ORDER BY bm25(chunks_fts) LIMIT ?",
+        (match, limit * 3),
+    ).fetchall()
+    return list(dict.fromkeys(r["chunk_hash"] for r in rows if r["chunk_hash"]))[:limit]
+
+
+def _vector(q: np.ndarray, snap: tuple, limit: int, rows: np.ndarray | None = None) -> List[tuple[str, float]]:
+    """Top `limit` (hash, cosine) pairs, optionally only among the given matrix rows."""
+    keys, matrix, scales, dead = snap
+    live = len(keys) - len(dead)
+    if rows is not None:
+        keys, live = keys[rows], len(rows)   # rows_for() only returns live rows
+    if not live or limit <= 0:
+        return []
+    scores = score(matrix, scales, q, rows)
+    if rows is None and len(dead):
+        scores[dead] = -np.inf
+    k = min(limit, live)
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(keys[i].decode(), float(scores[i])) for i in top]
 
-@RagRouter.post("/rag/reindex")
-async def rag_reindex(request: Request):
+
+def _rerank(db: sqlite3.Connection, q: np.ndarray, ranked: List[tuple[str, float]]) -> List[tuple[str, float]]:
+    """Rescore candidates with exact float32 vectors.
+
+    float32 rows come straight from embed_cache; lossy rows are re-encoded from
+    their chunk text, which is cheap for a few dozen candidates.
     """
-    Rebuild the local RAG index.
-
-    Body (all optional):
-      paths: ["/home/nova", ...]
-      clean: true|false
-      ignore_dirs: [...]
-      exclude_paths: [...]
-      ignore_root_files: [...]
+    hashes = [h for h, _ in ranked]
+    marks = ",".join("?" * len(hashes))
+    rows = db.execute(
+        f"SELECT e.hash, e.embedding, e.dtype, MIN(c.id), c.chunk FROM embed_cache e"
+        f" JOIN chunks c ON c.chunk_hash = e.hash WHERE e.hash IN ({marks}) GROUP BY e.hash",
+        hashes,
+    ).fetchall()
+    exact = {r["hash"]: decode_vector(r["embedding"], "float32") for r in rows if r["dtype"] == "float32"}
+    lossy = [r for r in rows if r["dtype"] != "float32"]
+    if lossy:
+        embs = embedder.encode([r["chunk"] for r in lossy])
+        exact.update({r["hash"]: np.asarray(e, dtype=np.float32) for r, e in zip(lossy, embs)})
+    rescored = []
+    for h, s in ranked:
+        v = exact.get(h)
+        if v is not None:
+            n = float(np.linalg.norm(v))
+            s = float(v @ q / n) if n else 0.0
+        rescored.append((h, s))
+    return sorted(rescored, key=lambda x: x[1], reverse=True)
+
+
+def _rrf(*rankings: List[str]) -> List[tuple[str, float]]:
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, h in enumerate(ranking):
+            fused[h] = fused.get(h, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+def search(
+    query: str,
+    top_k: int = 5,
+    mode: str = "vector",
+    prefilter: bool = False,
+    rerank: bool = False,
+) -> List[Dict[str, Any]]:
+    """Search the index.
+
+    mode: "vector" (cosine), "lexical" (FTS5 BM25) or "hybrid" (both fused with
+    reciprocal rank fusion). prefilter=True scores vectors only for chunks that
+    matched lexically, falling back to the full matrix when nothing matched.
+    rerank=True (vector mode) rescores the top RERANK_FACTOR*top_k candidates
+    of a quantized index with float32 vectors.
     """
-    body = await request.json()
-    paths = body.get("paths") or [BASE_DIR]
-    clean = bool(body.get("clean", False))
-
-    # Per-request overrides (your reindex() already supports these)
-    ignore_dirs = set(body.get("ignore_dirs", [])) or None
-    exclude_paths = set(body.get("exclude_paths", [])) or None
-    ignore_root_files = set(body.get("ignore_root_files", [])) or None
-
-    res = reindex(
-        paths=paths,
-        clean=clean,
-        ignore_dirs=ignore_dirs,
-        exclude_paths=exclude_paths,
-        ignore_root_files=ignore_root_files,
-    )
-    # res already includes status/files_processed/chunks_indexed
-    return JSONResponse(res)
+    if top_k <= 0:
+        return []
+    if mode not in {"vector", "lexical", "hybrid"}:
+        mode = "vector"
+
+    with _get_db() as db:
+        lexical = _lexical(db, query, max(FUSION_DEPTH, top_k)) if (mode != "vector" or prefilter) else []
+
+        ranked: List[tuple[str, float]]
+        if mode == "lexical":
+            ranked = [(h, 1.0 / (RRF_K + i + 1)) for i, h in enumerate(lexical)]
+        else:
+            q = embedder.embed_query(query)
+            _index.ensure_loaded(db)
+            rows = _index.rows_for(lexical) if (prefilter and lexical) else None
+            depth = top_k if mode == "vector" else max(FUSION_DEPTH, top_k)
+            if mode == "vector" and rerank:
+                depth = top_k * RERANK_FACTOR
+            vector = _vector(q, _index.snapshot(), depth, rows)
+            if mode == "vector":
+                ranked = _rerank(db, q, vector) if (rerank and vector) else vector
+            else:
+                ranked = _rrf([h for h, _ in vector], lexical)
+        ranked = ranked[:top_k]
+        if not ranked:
+            return []
+
+        # Each hash is one row however many files share the text; report its first occurrence
+        wanted = [h for h, _ in ranked]
+        marks = ",".join("?" * len(wanted))
+        rows = db.execute(
+            f"SELECT chunk_hash, path, chunk, line_start, line_end, MIN(id) FROM chunks"
+            f" WHERE chunk_hash IN ({marks}) GROUP BY chunk_hash",
+            wanted,
+        ).fetchall()
+
+    by_hash = {r["chunk_hash"]: r for r in rows}
+    hits = []
+    for h, score in ranked:
+        r = by_hash.get(h)
+        if r is not None:
+            hits.append({
+                "score": float(score),
+                "path": r["path"],
+                "content": r["chunk"],
+                "line_start": r["line_start"],
+                "line_end": r["line_end"],
+            })
+    return hits
+
+
+
+RagRouter = APIRouter()
 
 @RagRouter.post("/rag/search")
 async def rag_search(request: Request):
@@ -226,10 +1109,16 @@ async def rag_search(request: Request):
     Body:
       q: "query string"
       k: top_k (default 5)
+      mode: "vector" | "lexical" | "hybrid" (default "vector")
+      prefilter: true|false — only vector-score lexical matches
+      rerank: true|false — float32 rescoring of a quantized index's top candidates
     """
     body = await request.json()
     q = body.get("q") or body.get("query") or ""
     k = int(body.get("k", 5))
-    hits = search(q, top_k=k)
+    mode = (body.get("mode") or "vector").lower()
+    prefilter = bool(body.get("prefilter", False))
+    rerank = bool(body.get("rerank", False))
+    hits = await run_io(search, q, top_k=k, mode=mode, prefilter=prefilter, rerank=rerank)
     return {"hits": hits}
 
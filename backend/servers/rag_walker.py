@@ -0,0 +1,325 @@
+# File: servers/rag_walker.py
+"""
+Parallel filesystem walker for rag_store.
+
+Directories are scanned with os.scandir on a thread pool. Each file's
+stat_result is taken from its DirEntry and streamed to the caller through a
+bounded queue, so indexing starts while the walk is still running and nobody
+needs to stat the file again. Exclusions are precompiled into a prefix tuple
+and .gitignore files are honoured per directory.
+
+IgnoreMatcher applies the same rules to one path at a time (watcher events),
+so a file the walk would skip is never indexed by the watcher either.
+"""
+import os
+import re
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+WALK_WORKERS = 8
+QUEUE_SIZE = 4096
+_WAKE = object()  # nudges the consumer when the last directory finishes
+
+
+# ---------------------------
+# .gitignore
+# ---------------------------
+
+def _glob_to_regex(pat: str) -> str:
+    out, i, n = [], 0, len(pat)
+    while i < n:
+        c = pat[i]
+        if pat.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pat.startswith("/**", i) and i + 3 == n:
+            out.append("/.+")   # foo/** matches what is inside foo, not foo itself
+            i += 3
+        elif pat.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif c == "*":
+            out.append("[^/]*")
+            i += 1
+        elif c == "?":
+            out.append("[^/]")
+            i += 1
+        elif c == "[":
+            j = pat.find("]", i + 1)
+            if j == -1:
+                out.append(re.escape(c))
+                i += 1
+            else:
+                body = pat[i + 1:j].replace("\\", "\\\\")
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = j + 1
+        elif c == "\\" and i + 1 < n:
+            out.append(re.escape(pat[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return "".join(out)
+
+
+class GitIgnore:
+    """Accumulated .gitignore rules from a root down to one directory.
+
+    Rules are (base_dir, regex, negated, dir_only); like git, the last
+    matching rule wins and a parent's rules apply beneath it.
+    """
+
+    __slots__ = ("rules",)
+
+    def __init__(self, rules: Tuple = ()):
+        self.rules = rules
+
+    @staticmethod
+    def _parse(base: str, text: str) -> List[tuple]:
+        rules = []
+        for raw in text.splitlines():
+            line = raw.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            neg = line.startswith("!")
+            if neg:
+                line = line[1:]
+            elif line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            line = line.lstrip("/")
+            rx = _glob_to_regex(line)
+            rx = ("^" if anchored else "^(?:.*/)?") + rx + "$"
+            rules.append((base, re.compile(rx), neg, dir_only))
+        return rules
+
+    def child(self, dirpath: str) -> "GitIgnore":
+        """Rules in effect inside dirpath (adds dirpath/.gitignore if present)."""
+        try:
+            with open(os.path.join(dirpath, ".gitignore"), "r", encoding="utf-8", errors="ignore") as f:
+                extra = self._parse(dirpath, f.read())
+        except OSError:
+            return self
+        return GitIgnore(self.rules + tuple(extra)) if extra else self
+
+    def ignored(self, path: str, is_dir: bool) -> bool:
+        hit = False
+        for base, rx, neg, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            prefix = base.rstrip(os.sep) + os.sep
+            if not path.startswith(prefix):
+                continue
+            if rx.match(path[len(prefix):].replace(os.sep, "/")):
+                hit = not neg
+        return hit
+
+
+def _outer_dirs(root: str) -> List[str]:
+    """Directories above root whose .gitignore applies to it, outermost first.
+
+    That is every parent up to the enclosing repository's top (the nearest one
+    holding .git); none when root is not inside a repository.
+    """
+    parents = []
+    d = os.path.dirname(root)
+    while d and d != os.path.dirname(d):
+        parents.append(d)
+        if os.path.isdir(os.path.join(d, ".git")):
+            return parents[::-1]
+        d = os.path.dirname(d)
+    return []
+
+
+class IgnoreMatcher:
+    """walk()'s filters for a single path, for callers that learn about files one by one.
+
+    Rules per directory are cached and rebuilt when that directory's .gitignore
+    (or any parent's) changes, so each check costs one stat per directory level.
+    """
+
+    def __init__(
+        self,
+        *,
+        allowed_ext: set,
+        ignore_dirs: set,
+        exclude_paths: set,
+        ignore_root_files: set,
+        base_dir: str,
+        gitignore: bool = True,
+    ):
+        self.allowed_ext = allowed_ext
+        self.ignore_dirs = ignore_dirs
+        self.excludes = tuple(os.path.abspath(p).rstrip(os.sep) + os.sep for p in exclude_paths)
+        self.ignore_root_files = ignore_root_files
+        self.base_abs = os.path.abspath(base_dir)
+        self.gitignore = gitignore
+        self._lock = threading.Lock()
+        self._rules: dict = {}   # dirpath -> (parent GitIgnore, .gitignore stamp, GitIgnore)
+
+    def _rules_for(self, dirpath: str, parent: GitIgnore) -> GitIgnore:
+        try:
+            st = os.stat(os.path.join(dirpath, ".gitignore"))
+            stamp = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            stamp = None
+        with self._lock:
+            hit = self._rules.get(dirpath)
+            if hit and hit[0] is parent and hit[1] == stamp:
+                return hit[2]
+        rules = parent.child(dirpath) if stamp else parent
+        with self._lock:
+            self._rules[dirpath] = (parent, stamp, rules)
+        return rules
+
+    def indexable(self, path: str, roots: List[str]) -> bool:
+        """Whether walk(roots) would yield path (which need not exist any more)."""
+        ap = os.path.abspath(path)
+        if os.path.splitext(ap)[1].lower() not in self.allowed_ext:
+            return False
+        if (ap + os.sep).startswith(self.excludes):
+            return False
+        parent_dir = os.path.dirname(ap)
+        if parent_dir == self.base_abs and os.path.basename(ap) in self.ignore_root_files:
+            return False
+        inside = [r for r in map(os.path.abspath, roots) if ap.startswith(r.rstrip(os.sep) + os.sep)]
+        if not inside:
+            return False
+        root = max(inside, key=len)
+        below = os.path.relpath(parent_dir, root).split(os.sep) if parent_dir != root else []
+        if any(part in self.ignore_dirs for part in below):
+            return False
+        if not self.gitignore:
+            return True
+        rules = GitIgnore()
+        for d in _outer_dirs(root):
+            rules = self._rules_for(d, rules)
+        d = root
+        rules = self._rules_for(d, rules)
+        for part in below:
+            d = os.path.join(d, part)
+            if rules.ignored(d, True):
+                return False
+            rules = self._rules_for(d, rules)
+        return not rules.ignored(ap, False)
+
+
+# ---------------------------
+# Walker
+# ---------------------------
+
+def walk(
+    roots: List[str],
+    *,
+    allowed_ext: set,
+    ignore_dirs: set,
+    exclude_paths: set,
+    ignore_root_files: set,
+    base_dir: str,
+    gitignore: bool = True,
+    workers: int = WALK_WORKERS,
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """Yield (path, stat) for indexable files under roots, as they are found."""
+    excludes = tuple(os.path.abspath(p).rstrip(os.sep) + os.sep for p in exclude_paths)
+    base_abs = os.path.abspath(base_dir)
+    out: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+    finished = threading.Event()
+    lock = threading.Lock()
+    pending = 1  # held by the seeding loop below until every root is submitted
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def release() -> None:
+        nonlocal pending
+        with lock:
+            pending -= 1
+            if pending == 0:
+                finished.set()
+                try:
+                    out.put_nowait(_WAKE)
+                except queue.Full:
+                    pass  # consumer is busy draining and will see `finished`
+
+    def submit(pool, dirpath: str, rules: GitIgnore) -> None:
+        nonlocal pending
+        with lock:
+            pending += 1
+        pool.submit(scan, pool, dirpath, rules)
+
+    def scan(pool, dirpath: str, rules: GitIgnore) -> None:
+        try:
+            if stop.is_set():
+                return
+            if gitignore:
+                rules = rules.child(dirpath)
+            at_base = dirpath == base_abs
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name in ignore_dirs:
+                                continue
+                            if (entry.path + os.sep).startswith(excludes):
+                                continue
+                            if gitignore and rules.ignored(entry.path, True):
+                                continue
+                            submit(pool, entry.path, rules)
+                        elif entry.is_file():
+                            if os.path.splitext(entry.name)[1].lower() not in allowed_ext:
+                                continue
+                            if at_base and entry.name in ignore_root_files:
+                                continue
+                            if gitignore and rules.ignored(entry.path, False):
+                                continue
+                            if not put((entry.path, entry.stat())):
+                                return
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        finally:
+            release()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="rag-walk")
+    try:
+        for root in map(os.path.abspath, roots):
+            if not os.path.isdir(root):
+                continue
+            if (root + os.sep).startswith(excludes):
+                continue
+            rules = GitIgnore()
+            if gitignore:
+                # .gitignore files above the root still apply (e.g. walking a repo subfolder)
+                for d in _outer_dirs(root):
+                    rules = rules.child(d)
+            submit(pool, root, rules)
+        release()
+        while True:
+            try:
+                item = out.get(timeout=0.1)
+            except queue.Empty:
+                item = _WAKE
+            if item is _WAKE:
+                if finished.is_set() and out.empty():
+                    return
+                continue
+            yield item
+    finally:
+        stop.set()
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,162 @@
+# File: servers/rag_watcher.py
+"""
+Optional background indexer that keeps rag.db in step with the filesystem.
+
+Enable with NOVA_RAG_WATCH=1 (roots default to rag_store.BASE_DIR, override with
+a colon-separated NOVA_RAG_WATCH_PATHS). inotify events come from `watchfiles`;
+touched paths are filtered with the same rules as a full reindex, held until
+the tree has been quiet for a short while, then re-embedded in one
+rag_store.reindex(files=...) call.
+"""
+import os
+import time
+import threading
+from typing import Dict, Any, List
+
+from fastapi import APIRouter
+
+from . import rag_store
+from utils.embedding_service import embedder
+from utils.logger import logger, setup_logger
+
+setup_logger()
+logger = logger.bind(name="RAG-Watch")
+
+try:
+    import watchfiles
+except Exception:  # optional dependency
+    watchfiles = None
+
+WATCH_ENABLED = os.environ.get("NOVA_RAG_WATCH", "0").lower() in {"1", "true", "yes"}
+WATCH_PATHS = [p for p in os.environ.get("NOVA_RAG_WATCH_PATHS", "").split(":") if p] or [rag_store.BASE_DIR]
+DEBOUNCE_S = 2.0     # wait this long after the last event before indexing
+MAX_DELAY_S = 30.0   # but never hold a path longer than this under constant churn
+
+RagWatchRouter = APIRouter()
+
+
+class RagWatcher:
+    def __init__(self, roots: List[str]):
+        self.roots = [os.path.abspath(r) for r in roots]
+        self._stop = threading.Event()
+        self._cond = threading.Condition()
+        self._pending: Dict[str, float] = {}   # path -> time first seen since last flush
+        self._last_event = 0.0
+        self._threads: List[threading.Thread] = []
+        self.last_indexed: float | None = None
+        self.last_result: Dict[str, Any] | None = None
+        self.last_error: str | None = None
+        self.files_indexed = 0
+
+    # --- lifecycle ---
+    def start(self) -> None:
+        for target, name in ((self._watch_loop, "rag-watch"), (self._index_loop, "rag-watch-index")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"RAG watcher started for {self.roots}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    @property
+    def running(self) -> bool:
+        return any(t.is_alive() for t in self._threads)
+
+    # --- producer: inotify events ---
+    def _filter(self, change, path: str) -> bool:
+        return rag_store._is_indexable(path, self.roots)
+
+    def _watch_loop(self) -> None:
+        roots = [r for r in self.roots if os.path.isdir(r)]
+        try:
+            for changes in watchfiles.watch(*roots, watch_filter=self._filter, stop_event=self._stop, debounce=500):
+                now = time.time()
+                with self._cond:
+                    for _, path in changes:
+                        self._pending.setdefault(path, now)
+                    self._last_event = now
+                    self._cond.notify()
+        except Exception as e:
+            self.last_error = f"watch_failed: {e}"
+            logger.error(f"RAG watcher stopped: {e}")
+
+    # --- consumer: debounced re-embed ---
+    def _take_batch(self) -> List[str]:
+        with self._cond:
+            while not self._stop.is_set():
+                if self._pending:
+                    now = time.time()
+                    quiet = now - self._last_event
+                    oldest = now - min(self._pending.values())
+                    if quiet >= DEBOUNCE_S or oldest >= MAX_DELAY_S:
+                        batch = list(self._pending)
+                        self._pending.clear()
+                        return batch
+                    self._cond.wait(timeout=max(0.05, DEBOUNCE_S - quiet))
+                else:
+                    self._cond.wait()
+        return []
+
+    def _index_loop(self) -> None:
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                res = rag_store.reindex(files=batch)
+                self.last_result = res
+                self.last_indexed = time.time()
+                self.files_indexed += res.get("files_processed", 0)
+                self.last_error = None
+                logger.debug(f"RAG watcher indexed {len(batch)} touched paths: {res}")
+            except Exception as e:
+                self.last_error = f"index_failed: {e}"
+                logger.error(f"RAG watcher failed to index batch: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        with self._cond:
+            depth = len(self._pending)
+            oldest = min(self._pending.values()) if self._pending else None
+        return {
+            "enabled": True,
+            "running": self.running,
+            "roots": self.roots,
+            "queue_depth": depth,
+            "lag_s": round(time.time() - oldest, 3) if oldest else 0.0,
+            "last_indexed": self.last_indexed,
+            "files_indexed": self.files_indexed,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+_watcher: RagWatcher | None = None
+
+
+@RagWatchRouter.on_event("startup")
+def start_watcher():
+    global _watcher
+    if not WATCH_ENABLED:
+        return
+    if watchfiles is None:
+        logger.warning("NOVA_RAG_WATCH is set but watchfiles is not installed; watcher disabled")
+        return
+    _watcher = RagWatcher(WATCH_PATHS)
+    _watcher.start()
+
+
+@RagWatchRouter.on_event("shutdown")
+def stop_watcher():
+    if _watcher:
+        _watcher.stop()
+
+
+@RagWatchRouter.get("/rag/status")
+def rag_status():
+    """Watcher health (queue depth, lag, last index time) plus embedding-service stats."""
+    status = _watcher.status() if _watcher else {"enabled": False, "available": watchfiles is not None}
+    status["embeddings"] = embedder.stats()
+    return status
@@ -7,6 +7,7 @@ from typing import List, Dict, Any
 from tray.tray_status import *
 from tray.tray_mic import is_mic_server_up
 from utils.logger import logger, setup_logger
+from utils.executor import run_io
 
 setup_logger()
 logger = logger.bind(name="Servers-Routes")
@@ -18,7 +19,7 @@ SystemStatusRouter = APIRouter()
 @SystemStatusRouter.get("/tray-status")
 async def get_novatray_service_status():
     logger.debug("HIT /tray-status route")
-    status = service_status_check()
+    status = await run_io(service_status_check)
     logger.debug(f"Tray status: {status}")
     return status
 
@@ -30,7 +31,7 @@ async def websocket_status(ws: WebSocket):
     try:
         logger.debug("WebSocket connection established for system status.")
         while True:
-            packet = gather_sensor_packet()
+            packet = await run_io(gather_sensor_packet)
             await ws.send_text(packet.json())
             await asyncio.sleep(1)  # 1Hz update interval
     except WebSocketDisconnect:
@@ -43,7 +44,7 @@ async def websocket_system_info(ws: WebSocket):
     try:
         logger.debug("WebSocket connection established for system info.")
         while True:
-            info = get_system_info()
+            info = await run_io(get_system_info)
             await ws.send_text(json.dumps(info))  # Send the formatted JSON data
             await asyncio.sleep(60)
     except WebSocketDisconnect:
@@ -51,7 +52,7 @@ async def websocket_system_info(ws: WebSocket):
 
 @SystemStatusRouter.get("/mic-server-status")
 async def get_mic_server_status():
-    if is_mic_server_up():
+    if await run_io(is_mic_server_up):
         logger.debug("Mic server is running.")
         return {"status": "running"}
     else:
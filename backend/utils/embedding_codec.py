@@ -0,0 +1,191 @@
+# utils/embedding_codec.py
+"""
+Compact storage formats for sentence embeddings (rag.db and vault.db).
+
+  float32  raw little-endian float32 (the original format)
+  float16  raw float16, 2x smaller
+  int8     symmetric per-vector scale: float32 scale + int8 codes, ~4x smaller
+
+New vectors are written in NOVA_EMBED_DTYPE (default float32); every row keeps
+its own `dtype` column so mixed databases decode correctly. Scoring works on
+the quantized matrix directly, in row blocks so the float32 temporaries stay
+small.
+
+CLI (run from backend/):
+  python -m utils.embedding_codec migrate --dtype int8 [--only rag|vault]
+  python -m utils.embedding_codec bench --dtype int8 [--queries 200]
+"""
+import os
+import sys
+import argparse
+import sqlite3
+import numpy as np
+from typing import Iterable, List, Tuple
+
+EMBED_DTYPES = ("float32", "float16", "int8")
+EMBED_DTYPE = os.environ.get("NOVA_EMBED_DTYPE", "float32").lower()
+if EMBED_DTYPE not in EMBED_DTYPES:
+    EMBED_DTYPE = "float32"
+
+SCORE_BLOCK = 32768  # rows dequantised at a time while scoring
+
+
+# ---------------------------
+# Single vectors (BLOB <-> array)
+# ---------------------------
+
+def encode_vector(vec, dtype: str = EMBED_DTYPE) -> bytes:
+    v = np.asarray(vec, dtype=np.float32).ravel()
+    if dtype == "float16":
+        return v.astype(np.float16).tobytes()
+    if dtype == "int8":
+        codes, scale = quantize_int8(v[None, :])
+        return scale.astype(np.float32).tobytes() + codes.tobytes()
+    return v.tobytes()
+
+
+def decode_vector(blob: bytes, dtype: str | None = "float32") -> np.ndarray:
+    if dtype == "float16":
+        return np.frombuffer(blob, dtype=np.float16).astype(np.float32)
+    if dtype == "int8":
+        scale = np.frombuffer(blob[:4], dtype=np.float32)[0]
+        return np.frombuffer(blob[4:], dtype=np.int8).astype(np.float32) * scale
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def decode_rows(rows: Iterable[Tuple[bytes, str | None]]) -> np.ndarray:
+    """Stack (blob, dtype) pairs into one float32 matrix."""
+    vecs = [decode_vector(blob, dtype) for blob, dtype in rows]
+    if not vecs:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.vstack(vecs).astype(np.float32, copy=False)
+
+
+# ---------------------------
+# Matrices (in-RAM search)
+# ---------------------------
+
+def quantize_int8(mat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    mat = np.asarray(mat, dtype=np.float32)
+    scales = np.abs(mat).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(mat / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_matrix(mat: np.ndarray, dtype: str = EMBED_DTYPE) -> Tuple[np.ndarray, np.ndarray | None]:
+    """Return (matrix, per-row scales or None) in the requested in-RAM format."""
+    if dtype == "int8":
+        return quantize_int8(mat)
+    if dtype == "float16":
+        return np.asarray(mat, dtype=np.float16), None
+    return np.asarray(mat, dtype=np.float32), None
+
+
+def score(matrix: np.ndarray, scales: np.ndarray | None, q: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+    """matrix @ q for a quantized matrix, without materialising it in float32."""
+    if rows is not None:
+        matrix = matrix[rows]
+        scales = scales[rows] if scales is not None else None
+    if matrix.dtype == np.float32:
+        return matrix @ q
+    out = np.empty(len(matrix), dtype=np.float32)
+    for i in range(0, len(matrix), SCORE_BLOCK):
+        out[i:i + SCORE_BLOCK] = matrix[i:i + SCORE_BLOCK].astype(np.float32) @ q
+    if scales is not None:
+        out *= scales
+    return out
+
+
+# ---------------------------
+# Migration / benchmark
+# ---------------------------
+
+def migrate_table(db_path: str, table: str, key: str, dtype: str, batch: int = 5000) -> int:
+    """Re-encode every embedding in `table` to `dtype`, then VACUUM."""
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(db_path)
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if "dtype" not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN dtype TEXT NOT NULL DEFAULT 'float32'")
+    rows = conn.execute(f"SELECT {key}, embedding, dtype FROM {table} WHERE dtype != ?", (dtype,)).fetchall()
+    for i in range(0, len(rows), batch):
+        conn.executemany(
+            f"UPDATE {table} SET embedding=?, dtype=? WHERE {key}=?",
+            [(sqlite3.Binary(encode_vector(decode_vector(blob, old), dtype)), dtype, k) for k, blob, old in rows[i:i + batch]],
+        )
+        conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return len(rows)
+
+
+def _load_matrix(db_path: str, table: str) -> np.ndarray:
+    conn = sqlite3.connect(db_path)
+    cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    sel = "embedding, dtype" if "dtype" in cols else "embedding, 'float32'"
+    mat = decode_rows(conn.execute(f"SELECT {sel} FROM {table}"))
+    conn.close()
+    return mat
+
+
+def recall_at_k(mat: np.ndarray, dtype: str, queries: int = 200, k: int = 10, seed: int = 0) -> float:
+    """recall@k of quantized scoring vs float32, using perturbed corpus vectors as queries."""
+    if len(mat) <= k:
+        return 1.0
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    mat = mat / norms
+    qmat, scales = quantize_matrix(mat, dtype)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(mat), size=min(queries, len(mat)), replace=False)
+    found = 0
+    for i in picks:
+        q = mat[i] + rng.normal(scale=0.05, size=mat.shape[1]).astype(np.float32)
+        q /= np.linalg.norm(q)
+        exact = set(np.argpartition(-(mat @ q), k)[:k])
+        approx = set(np.argpartition(-score(qmat, scales, q), k)[:k])
+        found += len(exact & approx)
+    return found / (len(picks) * k)
+
+
+def _targets(only: str | None) -> List[Tuple[str, str, str, str]]:
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+    from servers import rag_store, chat_memory_router
+    out = []
+    if only in (None, "rag"):
+        out.append(("rag", rag_store.DB_PATH, "embed_cache", "hash"))
+    if only in (None, "vault"):
+        out.append(("vault", chat_memory_router.DB_PATH, "embeddings", "id"))
+    return out
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m utils.embedding_codec")
+    ap.add_argument("command", choices=["migrate", "bench"])
+    ap.add_argument("--dtype", choices=EMBED_DTYPES, default=EMBED_DTYPE)
+    ap.add_argument("--only", choices=["rag", "vault"])
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args(argv)
+
+    for name, path, table, key in _targets(args.only):
+        if not os.path.exists(path):
+            print(f"{name}: {path} not found, skipped")
+            continue
+        if args.command == "migrate":
+            before = os.path.getsize(path)
+            n = migrate_table(path, table, key, args.dtype)
+            print(f"{name}: re-encoded {n} vectors as {args.dtype}; {before} -> {os.path.getsize(path)} bytes")
+        else:
+            mat = _load_matrix(path, table)
+            r = recall_at_k(mat, args.dtype, queries=args.queries)
+            full = mat.astype(np.float32).nbytes
+            q, s = quantize_matrix(mat, args.dtype)
+            small = q.nbytes + (s.nbytes if s is not None else 0)
+            print(f"{name}: {len(mat)} vectors, recall@10={r:.4f}, matrix {full} -> {small} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+# utils/embedding_service.py
+"""
+Process-wide sentence-embedding service.
+
+One SentenceTransformer is loaded at API startup (in the background, so the
+server comes up immediately) and owned by a single worker thread. Callers from
+rag_store, agent_tools and chat_memory_router submit texts and get futures
+back; the worker collects whatever arrives within MAX_WAIT_MS (up to
+MAX_BATCH texts) and runs one model.encode() for all of them, which is much
+cheaper than many single-sentence calls and keeps the model off the event loop.
+
+Search queries go through embed_query(), which returns a unit-length vector
+from a small LRU/TTL cache, so one /agent turn that runs rag_search,
+search_memory and query_memory on the same text encodes it once.
+
+Environment:
+  NOVA_EMBED_MODEL      model name (default all-MiniLM-L6-v2)
+  NOVA_EMBED_BACKEND    torch | onnx | openvino (default torch)
+  NOVA_EMBED_ONNX_FILE  optional ONNX file inside the model repo, e.g.
+                        onnx/model_qint8_avx512_vnni.onnx for a quantized CPU model
+  NOVA_EMBED_CACHE_SIZE query-embedding cache entries (default 1024, 0 disables)
+  NOVA_EMBED_CACHE_TTL  seconds a cached query embedding stays valid (default 600)
+"""
+import os
+import time
+import queue
+import asyncio
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, List, Sequence
+
+from utils.logger import logger, setup_logger
+
+setup_logger()
+logger = logger.bind(name="Embeddings")
+
+MODEL_NAME = os.environ.get("NOVA_EMBED_MODEL", "all-MiniLM-L6-v2")
+EMBED_BACKEND = os.environ.get("NOVA_EMBED_BACKEND", "torch").lower()
+ONNX_FILE = os.environ.get("NOVA_EMBED_ONNX_FILE", "")
+MAX_BATCH = 64      # texts per micro-batch
+MAX_WAIT_MS = 5     # how long the first request waits for company
+QUERY_CACHE_SIZE = int(os.environ.get("NOVA_EMBED_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("NOVA_EMBED_CACHE_TTL", "600"))
+
+
+class QueryCache:
+    """Bounded LRU of text -> unit vector, entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> np.ndarray | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.monotonic() - item[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), vec)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class EmbeddingService:
+    def __init__(self, model_name: str = MODEL_NAME, backend: str = EMBED_BACKEND):
+        self.model_name = model_name
+        self.backend = backend
+        self.model = None
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+        self._queue: "queue.Queue[tuple[List[str], Future]]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self.load_error: str | None = None
+        self.load_seconds: float | None = None
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.query_cache = QueryCache()
+
+    # --- lifecycle ---
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+        kwargs: Dict[str, Any] = {}
+        if self.backend != "torch":
+            kwargs["backend"] = self.backend
+            if ONNX_FILE:
+                kwargs["model_kwargs"] = {"file_name": ONNX_FILE}
+        started = time.perf_counter()
+        try:
+            model = SentenceTransformer(self.model_name, **kwargs)
+        except Exception as e:
+            if not kwargs:
+                raise
+            logger.warning(f"{self.backend} backend unavailable ({e}); falling back to torch")
+            model = SentenceTransformer(self.model_name)
+        self.load_seconds = round(time.perf_counter() - started, 3)
+        logger.info(f"Loaded embedding model {self.model_name} ({self.backend}) in {self.load_seconds}s")
+        return model
+
+    def start(self) -> None:
+        """Start the worker (idempotent); the model loads on the worker thread."""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="embed-worker", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            self.model = self._load()
+        except Exception as e:
+            self.load_error = str(e)
+            logger.error(f"Failed to load embedding model: {e}")
+        finally:
+            self._ready.set()
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.perf_counter() + MAX_WAIT_MS / 1000.0
+            while size < MAX_BATCH:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch: List[tuple[List[str], Future]]) -> None:
+        live = [(texts, fut) for texts, fut in batch if fut.set_running_or_notify_cancel()]
+        if not live:
+            return
+        if self.model is None:
+            err = RuntimeError(f"embedding model unavailable: {self.load_error}")
+            for _, fut in live:
+                fut.set_exception(err)
+            return
+        flat = [t for texts, _ in live for t in texts]
+        try:
+            embs = np.asarray(self.model.encode(flat, batch_size=max(len(flat), 1)), dtype=np.float32)
+        except Exception as e:
+            for _, fut in live:
+                fut.set_exception(e)
+            return
+        self.batches += 1
+        self.texts += len(flat)
+        at = 0
+        for texts, fut in live:
+            fut.set_result(embs[at:at + len(texts)])
+            at += len(texts)
+
+    # --- API ---
+    def submit(self, texts: Sequence[str]) -> "Future[np.ndarray]":
+        """Queue texts for the next micro-batch; the future yields a (n, dim) array."""
+        self.start()
+        fut: Future = Future()
+        texts = list(texts)
+        self.requests += 1
+        if not texts:
+            fut.set_result(np.empty((0, 0), dtype=np.float32))
+            return fut
+        self._queue.put((texts, fut))
+        return fut
+
+    def encode(self, sentences, **_: Any) -> np.ndarray:
+        """Drop-in for SentenceTransformer.encode: str -> (dim,), list -> (n, dim).
+
+        Extra keyword arguments (batch_size, ...) are accepted and ignored; the
+        service picks its own batching.
+        """
+        single = isinstance(sentences, str)
+        embs = self.submit([sentences] if single else sentences).result()
+        return embs[0] if single else embs
+
+    async def encode_async(self, sentences) -> np.ndarray:
+        single = isinstance(sentences, str)
+        embs = await asyncio.wrap_future(self.submit([sentences] if single else sentences))
+        return embs[0] if single else embs
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Unit-length float32 embedding of a search query, cached.
+
+        The returned array is read-only and shared between callers.
+        """
+        key = " ".join(text.split())
+        vec = self.query_cache.get(key)
+        if vec is None:
+            vec = np.array(self.encode(key), dtype=np.float32)
+            n = float(np.linalg.norm(vec))
+            if n:
+                vec /= n
+            vec.setflags(write=False)
+            self.query_cache.put(key, vec)
+        return vec
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "ready": self._ready.is_set() and self.model is not None,
+            "load_seconds": self.load_seconds,
+            "load_error": self.load_error,
+            "queue_depth": self._queue.qsize(),
+            "requests": self.requests,
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "query_cache": self.query_cache.stats(),
+        }
+
+
+embedder = EmbeddingService()
+
+
+def get_embedder() -> EmbeddingService:
+    return embedder
@@ -0,0 +1,92 @@
+# utils/executor.py
+"""
+Where blocking work runs, so the event loop stays free for websockets.
+
+  run_io(fn, ...)   blocking I/O (HTTP, Ollama, SQLite, subprocesses) on a
+                    bounded thread pool
+  run_cpu(fn, ...)  CPU-heavy pure-Python work (parsing, chunking) on a
+                    process pool; fn and its arguments must be picklable
+
+The process pool uses the forkserver start method, because forking a
+process that already runs threads (uvicorn, the embedding worker) is unsafe.
+If no process pool can be started, CPU work falls back to the I/O threads;
+a pool broken by a dead worker is discarded and replaced on next use.
+
+Sizes: NOVA_IO_WORKERS (default 32), NOVA_CPU_WORKERS (default half the cores).
+"""
+import os
+import asyncio
+import threading
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from utils.logger import logger, setup_logger
+
+setup_logger()
+logger = logger.bind(name="Executor")
+
+IO_WORKERS = int(os.environ.get("NOVA_IO_WORKERS", "32"))
+CPU_WORKERS = int(os.environ.get("NOVA_CPU_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+_io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="nova-io")
+_cpu_pool: Executor | None = None
+_cpu_lock = threading.Lock()
+
+
+def io_executor() -> Executor:
+    return _io_pool
+
+
+def cpu_executor() -> Executor:
+    """The shared process pool (started on first use)."""
+    global _cpu_pool
+    if _cpu_pool is None:
+        with _cpu_lock:
+            if _cpu_pool is None:
+                try:
+                    ctx = multiprocessing.get_context("forkserver")
+                    _cpu_pool = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=ctx)
+                except (OSError, ValueError, NotImplementedError) as e:
+                    logger.warning(f"Process pool unavailable ({e}); CPU work will use threads")
+                    _cpu_pool = _io_pool
+    return _cpu_pool
+
+
+def discard_cpu_pool(pool: Executor) -> None:
+    """Drop a broken process pool; the next cpu_executor() call starts a fresh one."""
+    global _cpu_pool
+    if pool is _io_pool:
+        return
+    with _cpu_lock:
+        if _cpu_pool is pool:
+            _cpu_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_io(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_pool, functools.partial(fn, *args, **kwargs))
+
+
+async def run_cpu(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    loop = asyncio.get_running_loop()
+    pool = cpu_executor()
+    call = functools.partial(fn, *args, **kwargs)
+    try:
+        return await loop.run_in_executor(pool, call)
+    except BrokenProcessPool:
+        # A worker died (OOM, crash); retry this call on a thread, start a new pool next time
+        logger.warning("CPU process pool broke; retrying on the I/O threads")
+        discard_cpu_pool(pool)
+        return await loop.run_in_executor(_io_pool, call)
+
+
+def shutdown() -> None:
+    global _cpu_pool
+    if _cpu_pool is not None and _cpu_pool is not _io_pool:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+    _cpu_pool = None
+    _io_pool.shutdown(wait=False, cancel_futures=True)
@@ -1,21 +1,326 @@
 # utils/ollama_client.py
+"""
+Ollama HTTP clients over pooled httpx connections.
 
+AsyncOllamaClient is what the API routers use: one keep-alive pool per host,
+async generators for streaming, so a token stream holds no worker thread.
+OllamaClient keeps the original blocking interface (tray, scripts, anything
+running in a thread) on top of a shared sync pool.
+
+Use get_async_client()/get_client() rather than constructing clients per
+request; each call returns the shared instance for that host.
+
+coalesce() sits between a token stream and a slow consumer. Tokens are
+buffered and flushed every flush_ms or flush_bytes, whichever comes first.
+At most `buffer` chunks are read ahead; past that, the upstream read waits
+and TCP flow control slows Ollama down instead of memory growing. A consumer
+that falls behind gets fewer, larger chunks.
+
+chat_json() is the structured-output path. It sends Ollama's `format` ("json"
+or a JSON schema) and caps num_predict. With early_stop it streams and hangs
+up once one balanced {...} has arrived; otherwise it makes a single
+stream:false call. Either way it returns the parsed object. chat_json_stream()
+yields the same object's raw text as it arrives, for callers that want to show
+part of it early. Pass `stats={}` to either to get Ollama's timing counters
+for the call (prompt_eval_count, prompt_eval_ms, eval_count, ...); after the
+object has arrived, the stream is read for at most a couple more lines to
+catch the final stats line before hanging up.
+
+Environment:
+  NOVA_OLLAMA_URL              base URL of the Ollama API, used as given
+  OLLAMA_HOST                  used when NOVA_OLLAMA_URL is unset (default 127.0.0.1:11434).
+                               This is also what `ollama serve` binds to, so a wildcard
+                               address (0.0.0.0, ::) becomes loopback and a missing
+                               port becomes 11434.
+  NOVA_OLLAMA_CONNECT_TIMEOUT  seconds (default 5)
+  NOVA_OLLAMA_READ_TIMEOUT     seconds between streamed chunks (default 300)
+  NOVA_OLLAMA_MAX_CONNECTIONS  pool size per host (default 16)
+  NOVA_STREAM_FLUSH_MS         coalescing window (default 25, 0 = per token)
+  NOVA_STREAM_FLUSH_BYTES      flush early once this much text is buffered (default 512)
+  NOVA_STREAM_BUFFER           chunks read ahead of the consumer (default 256)
+  NOVA_JSON_NUM_PREDICT        token cap for chat_json() (default 1024)
+"""
+import os
 import json
-import urllib.parse
-import urllib.request
-import time
-from threading import Thread
-from typing import List, Generator
+import asyncio
+from urllib.parse import urlsplit
+from contextlib import aclosing
+from typing import AsyncGenerator, AsyncIterator, Dict, Generator, List
+
+import httpx
+
 from utils.logger import logger, setup_logger
 
 setup_logger()
 logger = logger.bind(name="Ollama")
 
+OLLAMA_PORT = 11434
+WILDCARD_HOSTS = {"", "0.0.0.0", "::", "[::]"}
+
+
+def _resolve_host() -> str:
+    """Base URL for Ollama: NOVA_OLLAMA_URL as given, else OLLAMA_HOST made connectable."""
+    url = os.environ.get("NOVA_OLLAMA_URL", "").strip()
+    if url:
+        return url.rstrip("/")
+    host = os.environ.get("OLLAMA_HOST", "").strip() or f"127.0.0.1:{OLLAMA_PORT}"
+    if "://" not in host:
+        host = f"http://{host}"
+    parts = urlsplit(host)
+    hostname = parts.hostname or ""
+    if hostname in WILDCARD_HOSTS:
+        hostname = "127.0.0.1"
+    elif ":" in hostname:
+        hostname = f"[{hostname}]"
+    try:
+        port = parts.port or OLLAMA_PORT
+    except ValueError:
+        port = OLLAMA_PORT
+    return f"{parts.scheme}://{hostname}:{port}{parts.path.rstrip('/')}"
+
+
+DEFAULT_HOST = _resolve_host()
+CONNECT_TIMEOUT = float(os.environ.get("NOVA_OLLAMA_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("NOVA_OLLAMA_READ_TIMEOUT", "300"))
+MAX_CONNECTIONS = int(os.environ.get("NOVA_OLLAMA_MAX_CONNECTIONS", "16"))
+FLUSH_MS = float(os.environ.get("NOVA_STREAM_FLUSH_MS", "25"))
+FLUSH_BYTES = int(os.environ.get("NOVA_STREAM_FLUSH_BYTES", "512"))
+STREAM_BUFFER = int(os.environ.get("NOVA_STREAM_BUFFER", "256"))
+JSON_NUM_PREDICT = int(os.environ.get("NOVA_JSON_NUM_PREDICT", "1024"))
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=30.0, pool=CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS, keepalive_expiry=60)
+
+
+def _pull_status(data: dict) -> str:
+    log = data.get("error") or data.get("status") or "No response"
+    if "status" in data:
+        total = data.get("total")
+        completed = data.get("completed", 0)
+        if total:
+            log += f" [{completed}/{total}]"
+    return log
+
+
+class JsonObjectScanner:
+    """Finds the end of the first top-level JSON object in streamed text."""
+
+    def __init__(self):
+        self.text = ""
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._start = -1
+
+    def feed(self, chunk: str) -> str | None:
+        """Add text; return the complete object's source once its closing brace arrives."""
+        base = len(self.text)
+        self.text += chunk
+        for i, ch in enumerate(chunk, start=base):
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = self._start >= 0
+            elif ch == "{":
+                if self._start < 0:
+                    self._start = i
+                self._depth += 1
+            elif ch == "}" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    return self.text[self._start:i + 1]
+        return None
+
+
+def _json_payload(model_name: str, chat_history: List[dict], schema: dict | None, num_predict: int,
+                  options: dict | None, keep_alive: str | None = None) -> dict:
+    payload = {
+        "model": model_name,
+        "messages": chat_history,
+        "format": schema or "json",
+        "options": {**(options or {}), "num_predict": num_predict},
+    }
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    return payload
+
+
+STAT_FIELDS = ("prompt_eval_count", "eval_count")
+STAT_DURATIONS = ("prompt_eval_duration", "eval_duration", "load_duration", "total_duration")
+STATS_GRACE_LINES = 2  # lines read after a chat_json object, waiting for the stats line
+
+
+def _stats(data: dict) -> dict:
+    """Ollama's final-message counters, durations converted from ns to ms."""
+    out = {k: data[k] for k in STAT_FIELDS if k in data}
+    for k in STAT_DURATIONS:
+        if k in data:
+            out[k.replace("_duration", "_ms")] = round(data[k] / 1e6, 1)
+    return out
+
+
+def _parse_json(text: str) -> dict:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Model did not return JSON: {e}") from e
+
+
+class AsyncOllamaClient:
+    def __init__(self, api_url: str = DEFAULT_HOST):
+        self.api_url = api_url.rstrip("/")
+        self._http = httpx.AsyncClient(base_url=self.api_url, timeout=_timeout(), limits=_limits())
+        logger.debug(f"AsyncOllamaClient initialized for {self.api_url}")
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    async def fetch_models(self) -> List[str]:
+        try:
+            r = await self._http.get("/api/tags")
+            r.raise_for_status()
+            return [model["name"] for model in r.json()["models"]]
+        except Exception as e:
+            logger.error(f"Error fetching models: {e}")
+            return []
+
+    async def delete_model(self, model_name: str) -> str:
+        try:
+            r = await self._http.request("DELETE", "/api/delete", json={"name": model_name})
+            if r.status_code == 404:
+                return "Model not found."
+            r.raise_for_status()
+            return "Model deleted successfully."
+        except Exception as e:
+            logger.error(f"Failed to delete model: {e}")
+            return f"Failed to delete model: {e}"
+
+    async def download_model(self, model_name: str, insecure: bool = False) -> AsyncGenerator[str, None]:
+        try:
+            async with self._http.stream(
+                "POST", "/api/pull", json={"name": model_name, "insecure": insecure, "stream": True}
+            ) as resp:
+                async for line in resp.aiter_lines():
+                    if line:
+                        yield _pull_status(json.loads(line))
+        except Exception as e:
+            logger.error(f"Failed to download model: {e}")
+            yield f"Failed to download model: {e}"
+
+    async def chat_stream(self, chat_history: List[dict], model_name: str, **options) -> AsyncGenerator[str, None]:
+        """Yield message content as Ollama streams it; `options` are merged into the request body."""
+        payload = {"model": model_name, "messages": chat_history, "stream": True, **options}
+        async with self._http.stream("POST", "/api/chat", json=payload) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "message" in data:
+                    yield data["message"]["content"]
+                else:
+                    logger.debug(f"Streamed data: {data}")
+
+    async def chat(self, chat_history: List[dict], model_name: str) -> str:
+        return "".join([chunk async for chunk in self.chat_stream(chat_history, model_name)])
+
+    async def chat_json(
+        self,
+        chat_history: List[dict],
+        model_name: str,
+        *,
+        schema: dict | None = None,
+        num_predict: int = JSON_NUM_PREDICT,
+        early_stop: bool = True,
+        options: dict | None = None,
+        keep_alive: str | None = None,
+        stats: dict | None = None,
+    ) -> dict:
+        """One JSON object from the model, constrained by `schema` (or plain JSON mode)."""
+        if not early_stop:
+            payload = _json_payload(model_name, chat_history, schema, num_predict, options, keep_alive)
+            r = await self._http.post("/api/chat", json={**payload, "stream": False})
+            r.raise_for_status()
+            data = r.json()
+            if stats is not None:
+                stats.update(_stats(data))
+            return _parse_json(data["message"]["content"])
+
+        scanner = JsonObjectScanner()
+        found = None
+        async with aclosing(self.chat_json_stream(chat_history, model_name, schema=schema, num_predict=num_predict,
+                                                  options=options, keep_alive=keep_alive, stats=stats)) as chunks:
+            async for chunk in chunks:
+                if found is None:
+                    found = scanner.feed(chunk)
+        return _parse_json(found or scanner.text)
+
+    async def chat_json_stream(
+        self,
+        chat_history: List[dict],
+        model_name: str,
+        *,
+        schema: dict | None = None,
+        num_predict: int = JSON_NUM_PREDICT,
+        options: dict | None = None,
+        keep_alive: str | None = None,
+        stats: dict | None = None,
+    ) -> AsyncGenerator[str, None]:
+        """Raw text of chat_json()'s object as it streams; stops after the closing brace."""
+        payload = _json_payload(model_name, chat_history, schema, num_predict, options, keep_alive)
+        scanner = JsonObjectScanner()
+        grace = None
+        async with self._http.stream("POST", "/api/chat", json={**payload, "stream": True}) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("done"):
+                    if stats is not None:
+                        stats.update(_stats(data))
+                    return
+                if grace is not None:
+                    grace -= 1
+                    if grace <= 0:
+                        # leaving the block closes the connection, which stops generation
+                        return
+                    continue
+                chunk = data.get("message", {}).get("content", "")
+                yield chunk
+                if scanner.feed(chunk) is not None:
+                    if stats is None:
+                        return
+                    grace = STATS_GRACE_LINES
+
+
 class OllamaClient:
-    def __init__(self, api_url="http://127.0.0.1:11434"):
+    """Blocking client (the original interface), sharing one connection pool per host."""
+
+    _pools: Dict[str, httpx.Client] = {}
+
+    def __init__(self, api_url=DEFAULT_HOST):
         self.api_url = api_url
         logger.debug("OllamaClient initialized")
 
+    @property
+    def _http(self) -> httpx.Client:
+        key = self.api_url.rstrip("/")
+        client = self._pools.get(key)
+        if client is None:
+            client = self._pools[key] = httpx.Client(base_url=key, timeout=_timeout(), limits=_limits())
+        return client
+
     def update_host(self, host_url: str):
         logger.debug(f"update_host() called with {host_url}")
         self.api_url = host_url
@@ -23,80 +328,163 @@ class OllamaClient:
     def fetch_models(self) -> List[str]:
         logger.debug("fetch_models() called")
         try:
-            with urllib.request.urlopen(
-                urllib.parse.urljoin(self.api_url, "/api/tags")
-            ) as response:
-                data = json.load(response)
-                models = [model["name"] for model in data["models"]]
-                return models
+            r = self._http.get("/api/tags")
+            r.raise_for_status()
+            return [model["name"] for model in r.json()["models"]]
         except Exception as e:
             logger.error(f"Error fetching models: {e}")
             return []
 
     def delete_model(self, model_name: str) -> str:
         logger.debug(f"delete_model() called for: {model_name}")
-        req = urllib.request.Request(
-            urllib.parse.urljoin(self.api_url, "/api/delete"),
-            data=json.dumps({"name": model_name}).encode("utf-8"),
-            method="DELETE",
-        )
         try:
-            with urllib.request.urlopen(req) as response:
-                if response.status == 200:
-                    return "Model deleted successfully."
-                elif response.status == 404:
-                    return "Model not found."
+            r = self._http.request("DELETE", "/api/delete", json={"name": model_name})
+            if r.status_code == 404:
+                return "Model not found."
+            r.raise_for_status()
+            return "Model deleted successfully."
         except Exception as e:
             logger.error(f"Failed to delete model: {e}")
             return f"Failed to delete model: {e}"
 
     def download_model(self, model_name: str, insecure: bool = False) -> Generator[str, None, None]:
         logger.debug(f"download_model() called for: {model_name}")
-        req = urllib.request.Request(
-            urllib.parse.urljoin(self.api_url, "/api/pull"),
-            data=json.dumps(
-                {"name": model_name, "insecure": insecure, "stream": True}
-            ).encode("utf-8"),
-            method="POST",
-        )
         try:
-            with urllib.request.urlopen(req) as response:
-                for line in response:
-                    data = json.loads(line.decode("utf-8"))
-                    log = data.get("error") or data.get("status") or "No response"
-                    if "status" in data:
-                        total = data.get("total")
-                        completed = data.get("completed", 0)
-                        if total:
-                            log += f" [{completed}/{total}]"
-                    yield log
+            with self._http.stream(
+                "POST", "/api/pull", json={"name": model_name, "insecure": insecure, "stream": True}
+            ) as resp:
+                for line in resp.iter_lines():
+                    if line:
+                        yield _pull_status(json.loads(line))
         except Exception as e:
             logger.error(f"Failed to download model: {e}")
             yield f"Failed to download model: {e}"
 
+    def chat_json(
+        self,
+        chat_history: List[dict],
+        model_name: str,
+        *,
+        schema: dict | None = None,
+        num_predict: int = JSON_NUM_PREDICT,
+        options: dict | None = None,
+        keep_alive: str | None = None,
+        stats: dict | None = None,
+    ) -> dict:
+        payload = _json_payload(model_name, chat_history, schema, num_predict, options, keep_alive)
+        r = self._http.post("/api/chat", json={**payload, "stream": False})
+        r.raise_for_status()
+        data = r.json()
+        if stats is not None:
+            stats.update(_stats(data))
+        return _parse_json(data["message"]["content"])
+
     def fetch_chat_stream_result(self, chat_history: List[dict], model_name: str) -> Generator[str, None, None]:
         logger.debug("fetch_chat_stream_result() called")
-        request = urllib.request.Request(
-            urllib.parse.urljoin(self.api_url, "/api/chat"),
-            data=json.dumps(
-                {
-                    "model": model_name,
-                    "messages": chat_history,
-                    "stream": True,
-                }
-            ).encode("utf-8"),
-            headers={"Content-Type": "application/json"},
-            method="POST",
-        )
         try:
-            with urllib.request.urlopen(request) as resp:
-                for line in resp:
-                    data = json.loads(line.decode("utf-8"))
+            with self._http.stream(
+                "POST", "/api/chat", json={"model": model_name, "messages": chat_history, "stream": True}
+            ) as resp:
+                resp.raise_for_status()
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
                     if "message" in data:
-                        time.sleep(0.01)
                         yield data["message"]["content"]
                     else:
                         logger.debug(f"Streamed data: {data}")
         except Exception as e:
             logger.error(f"Chat stream error: {e}")
             raise
+
+
+_END = object()
+
+
+async def coalesce(
+    chunks: AsyncIterator[str],
+    flush_ms: float = FLUSH_MS,
+    flush_bytes: int = FLUSH_BYTES,
+    buffer: int = STREAM_BUFFER,
+) -> AsyncGenerator[str, None]:
+    """Re-chunk a text stream: flush every `flush_ms` or `flush_bytes`, reading at most `buffer` ahead."""
+    if flush_ms <= 0 and flush_bytes <= 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, buffer))
+
+    async def pump() -> None:
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)  # blocks when the consumer is behind
+            await queue.put(_END)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+
+    loop = asyncio.get_running_loop()
+    task = asyncio.create_task(pump())
+    try:
+        done = False
+        while not done:
+            item = await queue.get()
+            parts: List[str] = []
+            size = 0
+            deadline = loop.time() + flush_ms / 1000.0
+            while True:
+                if item is _END:
+                    done = True
+                    break
+                if isinstance(item, Exception):
+                    if parts:
+                        yield "".join(parts)
+                    raise item
+                parts.append(item)
+                size += len(item)
+                if flush_bytes > 0 and size >= flush_bytes:
+                    break
+                try:
+                    item = queue.get_nowait()  # whatever piled up while the consumer was busy
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                remaining = deadline - loop.time()
+                if flush_ms <= 0 or remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            if parts:
+                yield "".join(parts)
+    finally:
+        task.cancel()
+
+
+_async_clients: Dict[str, AsyncOllamaClient] = {}
+
+
+def get_async_client(api_url: str = DEFAULT_HOST) -> AsyncOllamaClient:
+    """Shared async client for `api_url`; call from the event loop that will use it."""
+    key = api_url.rstrip("/")
+    client = _async_clients.get(key)
+    if client is None:
+        client = _async_clients[key] = AsyncOllamaClient(key)
+    return client
+
+
+def get_client(api_url: str = DEFAULT_HOST) -> OllamaClient:
+    return OllamaClient(api_url)
+
+
+async def close_clients() -> None:
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+    for client in list(OllamaClient._pools.values()):
+        client.close()
+    OllamaClient._pools.clear()
@@ -0,0 +1,119 @@
+# utils/sqlite_pool.py
+"""
+Per-thread SQLite connections shared by the routers.
+
+Each database file gets one SQLitePool. The first connection runs the
+owner's schema hook exactly once per process, on a private connection, and
+switches the file to WAL so readers never wait behind a long indexing
+transaction. After that every thread keeps one tuned connection for its
+lifetime (FastAPI's worker threads are reused, so this is effectively a pool).
+
+    _pool = get_pool(DB_PATH, init=_prepare_schema)
+    with _pool.connection() as db:   # commits on success, rolls back on error
+        db.execute(...)
+
+The `with` block does not close the connection; it stays with the thread.
+"""
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List
+
+MMAP_SIZE = 256 * 1024 * 1024   # bytes of the file mapped into memory
+CACHE_SIZE_KIB = 64 * 1024      # page cache per connection
+BUSY_TIMEOUT_MS = 5000
+
+
+class SQLitePool:
+    def __init__(
+        self,
+        path: str,
+        *,
+        init: Callable[[sqlite3.Connection], None] | None = None,
+        foreign_keys: bool = False,
+        synchronous: str = "NORMAL",
+        mmap_size: int = MMAP_SIZE,
+        cache_size_kib: int = CACHE_SIZE_KIB,
+    ):
+        self.path = path
+        self._init = init
+        self._pragmas = [
+            f"PRAGMA synchronous = {synchronous}",
+            f"PRAGMA mmap_size = {int(mmap_size)}",
+            f"PRAGMA cache_size = {-int(cache_size_kib)}",
+            f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+            "PRAGMA temp_store = MEMORY",
+            f"PRAGMA foreign_keys = {'ON' if foreign_keys else 'OFF'}",
+        ]
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._prepared = False
+        self._all: List[sqlite3.Connection] = []
+
+    def _connect(self) -> sqlite3.Connection:
+        # check_same_thread is off only so close_all() can run at shutdown;
+        # each connection is otherwise used by the thread that opened it.
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def prepare(self) -> None:
+        """Create the file, enable WAL and run the schema hook (once per process)."""
+        if self._prepared:
+            return
+        with self._lock:
+            if self._prepared:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = self._connect()
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+                if self._init:
+                    self._init(conn)
+                conn.commit()
+            finally:
+                conn.close()
+            self._prepared = True
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.prepare()
+            conn = self._connect()
+            for pragma in self._pragmas:
+                conn.execute(pragma)
+            self._local.conn = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+_pools: Dict[str, SQLitePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path: str, **kwargs) -> SQLitePool:
+    """The process-wide pool for `path` (created on first call with `kwargs`)."""
+    key = os.path.abspath(path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SQLitePool(key, **kwargs)
+        return pool
+
+
+def close_all() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close_all()
@@ -4,6 +4,7 @@ import subprocess
 import sys
 import time
 import os
+import threading
 # Add the base project directory to the Python path for imports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "python")))
 
@@ -67,6 +68,43 @@ def test_websocket(url, label):
         print(f"    WebSocket FAILED: {e}")
         log_lines.append(f"    WebSocket FAILED: {e}")
 
+def test_websocket_latency_during_reindex(url, label, seconds=8, max_gap=2.5):
+    """/ws/system-status ticks at 1 Hz; a reindex running in the background must not stall it."""
+    reindex_result = {}
+
+    def run_reindex():
+        try:
+            reindex_result["status"] = requests.post(f"{API_BASE}/rag/reindex", headers=HEADERS, json={}, timeout=600).status_code
+        except Exception as e:
+            reindex_result["error"] = str(e)
+
+    try:
+        proc = subprocess.Popen(["websocat", url], stdout=subprocess.PIPE, text=True)
+    except Exception as e:
+        show_message(label, 0, False)
+        print(f"    WebSocket FAILED: {e}")
+        log_lines.append(f"    WebSocket FAILED: {e}")
+        return
+
+    ticks = []
+    reader = threading.Thread(target=lambda: [ticks.append(time.monotonic()) for _ in proc.stdout], daemon=True)
+    reader.start()
+    time.sleep(1.5)  # let the stream settle before loading the server
+    worker = threading.Thread(target=run_reindex, daemon=True)
+    worker.start()
+    start = time.monotonic()
+    time.sleep(seconds)
+    proc.terminate()
+
+    during = [t for t in ticks if t >= start]
+    gaps = [b - a for a, b in zip(during, during[1:])]
+    worst = max(gaps) if gaps else float("inf")
+    ok = len(during) >= seconds / 2 and worst <= max_gap
+    show_message(label, 101 if during else 0, ok)
+    msg = f"    {len(during)} ticks in {seconds}s during reindex, worst gap {worst:.2f}s (limit {max_gap}s)"
+    print(msg)
+    log_lines.append(msg)
+
 def test_static_files():
     log("\nChecking static files...")
     paths = ["/index.html", "/css/chat.css", "/js/chat.js"]
@@ -143,6 +181,7 @@ def main():
 
     test_websocket("ws://127.0.0.1:56969/ws/system-info", "WebSocket: system-info")
     test_websocket("ws://127.0.0.1:56969/ws/system-status", "WebSocket: system-status")
+    test_websocket_latency_during_reindex("ws://127.0.0.1:56969/ws/system-status", "WebSocket: system-status keeps ticking during /rag/reindex")
 
     test_static_files()
 